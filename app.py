@@ -1,17 +1,35 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
+import csv
+import codecs
+import contextlib
+import contextvars
+import importlib.util
 import os
+import pickle
 import re
+import shutil
+import functools
+import hashlib
+import json
+import math
+import queue
+import threading
+import time
 import requests
 import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from io import BytesIO
 from datetime import datetime
-from PIL import Image as PILImage
+from PIL import Image as PILImage, ImageOps
 from PyPDF2 import PdfReader, PdfWriter
 import pdfplumber
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak, HRFlowable, Table, TableStyle, KeepTogether
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak, HRFlowable, Table, TableStyle, KeepTogether, Flowable
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT, TA_JUSTIFY
@@ -20,14 +38,16 @@ from reportlab.lib import colors
 from reportlab.pdfgen import canvas
 import fitz  # PyMuPDF for image extraction
 
-# --- CONFIGURATION & CONSTANTS ---
-st.set_page_config(
-    page_title="Inertia Offer Letter Generator",
-    page_icon="🏗️",
-    layout="wide",
-    initial_sidebar_state="collapsed"
-)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv  # fast multi-threaded CSV reader (optional)
+    import pyarrow.feather as pa_feather  # memory-mapped inventory snapshots (optional)
+except ImportError:
+    pa = None
+    pa_csv = None
+    pa_feather = None
 
+# --- CONFIGURATION & CONSTANTS ---
 # Inertia Brand Colors
 COLOR_PRIMARY = "#2A3932"  # Deep Slate
 COLOR_ACCENT = "#07141D"   # Dark Navy (changed from green)
@@ -39,7 +59,7 @@ COLOR_TEXT = "#07141D"     # Dark Navy
 LOGO_URL = "https://ik.imagekit.io/xtj3m9hth/image.png"
 
 # Enhanced CSS Styling with Animated Construction Background
-st.markdown(f"""
+APP_CSS = f"""
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;700&family=Playfair+Display:wght@400;700&display=swap');
     
@@ -315,215 +335,2145 @@ st.markdown(f"""
     <div class="building"></div>
     <div class="building"></div>
 </div>
-""", unsafe_allow_html=True)
+"""
+
+def setup_page():
+    """Page config and brand styling. Runs at the start of main() so the module stays importable."""
+    st.set_page_config(
+        page_title="Inertia Offer Letter Generator",
+        page_icon="🏗️",
+        layout="wide",
+        initial_sidebar_state="collapsed"
+    )
+    st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # --- HELPER FUNCTIONS ---
 
-def download_logo(url):
-    """Downloads the logo image and returns it as a BytesIO object."""
+# --- PERFORMANCE INSTRUMENTATION ---
+
+# Stage records kept in memory for the performance panel
+PERF_LOG_MAX_RECORDS = 2000
+# Optional JSON-lines file every stage record is also appended to (batch workers included)
+PERF_LOG_PATH = os.environ.get("INERTIA_PERF_LOG")
+PERF_RECORD_FIELDS = ('stage', 'started', 'wall_ms', 'cpu_ms', 'pages', 'bytes_in', 'bytes_out', 'thread', 'error')
+# Page objects in a generated PDF
+PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+class PerfLog:
+    """
+    Bounded, thread-safe log of stage timings: wall and CPU time, pages processed
+    and bytes in/out per call. Records are plain dicts exported as JSON lines;
+    with `path` set each record is also appended to that file as it arrives.
+    """
+    
+    def __init__(self, max_records=PERF_LOG_MAX_RECORDS, path=PERF_LOG_PATH):
+        self.path = path
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+    
+    def record(self, record):
+        with self._lock:
+            self._records.append(record)
+            if self.path:
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                except OSError:
+                    pass
+    
+    def records(self):
+        with self._lock:
+            return list(self._records)
+    
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+    
+    def to_jsonl(self):
+        return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in self.records())
+    
+    def summary(self):
+        """Per-stage calls, timings, pages and MB in/out, slowest stage first."""
+        df = pd.DataFrame(self.records(), columns=list(PERF_RECORD_FIELDS))
+        if df.empty:
+            return df
+        grouped = df.groupby('stage', sort=False)
+        return pd.DataFrame({
+            'calls': grouped.size(),
+            'wall ms (mean)': grouped['wall_ms'].mean().round(1),
+            'wall ms (max)': grouped['wall_ms'].max().round(1),
+            'cpu ms (mean)': grouped['cpu_ms'].mean().round(1),
+            'pages': grouped['pages'].sum(min_count=1),
+            'MB in': (grouped['bytes_in'].sum(min_count=1) / 1e6).round(2),
+            'MB out': (grouped['bytes_out'].sum(min_count=1) / 1e6).round(2),
+            'errors': grouped['error'].count(),
+        }).sort_values('wall ms (mean)', ascending=False)
+    
+    def __len__(self):
+        return len(self._records)
+
+@st.cache_resource
+def get_perf_log():
+    """Single PerfLog shared by every session and rerun in this process."""
+    return PerfLog()
+
+# PerfLog bound for work on worker threads, which must not call get_perf_log()
+_BOUND_PERF_LOG = contextvars.ContextVar('bound_perf_log', default=None)
+
+def with_perf_log(perf_log, func):
+    """`func` wrapped so the perf stages it runs are recorded into perf_log."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _BOUND_PERF_LOG.set(perf_log)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _BOUND_PERF_LOG.reset(token)
+    return wrapper
+
+@contextlib.contextmanager
+def perf_stage(stage):
+    """
+    Record the enclosed block as one `stage` call. Yields the record so the block
+    can fill in 'pages', 'bytes_in' and 'bytes_out'. CPU time is the calling
+    thread's own: work handed to other threads is not included. Records go to
+    the PerfLog bound with with_perf_log, else get_perf_log().
+    """
+    record = dict.fromkeys(PERF_RECORD_FIELDS)
+    record.update(
+        stage=stage,
+        started=datetime.now().isoformat(timespec='milliseconds'),
+        thread=threading.current_thread().name,
+    )
+    wall, cpu = time.perf_counter(), time.thread_time()
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return BytesIO(response.content)
+        yield record
     except Exception as e:
-        st.warning(f"Could not download logo: {e}")
+        record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['wall_ms'] = round((time.perf_counter() - wall) * 1000, 3)
+        record['cpu_ms'] = round((time.thread_time() - cpu) * 1000, 3)
+        perf_log = _BOUND_PERF_LOG.get()
+        (get_perf_log() if perf_log is None else perf_log).record(record)
+
+def instrumented(measure=None, stage=None):
+    """
+    Decorator recording every call as a perf_stage named after the function.
+    `measure(result, *args, **kwargs)` returns the pages/bytes_in/bytes_out it
+    knows for the call; a failing measure never fails the call.
+    """
+    def decorate(func):
+        name = stage or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with perf_stage(name) as record:
+                result = func(*args, **kwargs)
+                if measure is not None:
+                    try:
+                        record.update(measure(result, *args, **kwargs))
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return decorate
+
+def file_size(file):
+    """Size in bytes of an uploaded or open binary file."""
+    size = getattr(file, 'size', None)
+    if size is None:
+        position = file.tell()
+        size = file.seek(0, os.SEEK_END)
+        file.seek(position)
+    return size
+
+def measure_brochure(result, pdf_bytes, *args, **kwargs):
+    """
+    Bytes of the brochure a stage worked on, and its pages when it was passed
+    as a ParsedBrochure. Raw bytes are not looked up again: that would skew the
+    BrochureCache counters and re-parse broken PDFs on the error path.
+    """
+    if isinstance(pdf_bytes, (bytes, bytearray, memoryview)):
+        return {'bytes_in': len(pdf_bytes)}
+    return {'pages': pdf_bytes.page_count, 'bytes_in': len(pdf_bytes.pdf_bytes)}
+
+# --- BRANDING ASSET CACHE ---
+
+# On-disk copies of remote branding assets, revalidated in the background
+ASSET_CACHE_DIR = os.environ.get(
+    "INERTIA_ASSET_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "inertia-offer-letters")
+)
+# Local copy of the real logo, used while there is no downloaded copy
+LOGO_FALLBACK_PATH = os.environ.get(
+    "INERTIA_LOGO_FALLBACK",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "logo_fallback.png")
+)
+ASSET_REVALIDATE_SECONDS = 6 * 60 * 60
+ASSET_FETCH_TIMEOUT = 10
+
+class BrandingAssetCache:
+    """
+    Remote branding asset (the logo) served from memory, then the on-disk copy,
+    then the local copy at fallback_path. get() never waits on the network: a
+    background thread fetches the asset and revalidates the disk copy with
+    ETag / Last-Modified. Short-lived processes call fetch_now() first.
+    """
+    
+    def __init__(self, url, cache_dir=ASSET_CACHE_DIR, fallback_path=LOGO_FALLBACK_PATH,
+                 revalidate_seconds=ASSET_REVALIDATE_SECONDS):
+        self.url = url
+        self.fallback_path = fallback_path
+        self.revalidate_seconds = revalidate_seconds
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        self.data_path = os.path.join(cache_dir, f"{key}.bin")
+        self.meta_path = os.path.join(cache_dir, f"{key}.json")
+        self.content = None
+        self.source = None
+        self.meta = {}
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+        self._load_local()
+    
+    def _load_local(self):
+        """Populate memory from the disk copy, else the local fallback copy."""
+        try:
+            with open(self.data_path, "rb") as f:
+                self.content = f.read()
+            self.source = "disk"
+            try:
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    self.meta = json.load(f)
+            except (OSError, ValueError):
+                self.meta = {}
+            return
+        except OSError:
+            pass
+        try:
+            with open(self.fallback_path, "rb") as f:
+                self.content = f.read()
+            self.source = "fallback"
+        except (OSError, TypeError):
+            self.content = None
+            self.source = None
+    
+    def get(self):
+        """Current asset bytes (or None); never blocks on the network."""
+        self.start_background_refresh()
+        return self.content
+    
+    def fetch_now(self):
+        """
+        Blocking fetch when there is no downloaded copy yet. For short-lived
+        processes (the batch CLI) that finish before the background thread.
+        """
+        if self.source != "disk":
+            self.refresh()
+        return self.content
+    
+    def is_stale(self):
+        return time.time() - self.meta.get("checked_at", 0) >= self.revalidate_seconds
+    
+    def refresh(self):
+        """Conditionally re-fetch the asset; returns True if new content was stored."""
+        headers = {}
+        if self.source == "disk":
+            if self.meta.get("etag"):
+                headers["If-None-Match"] = self.meta["etag"]
+            if self.meta.get("last_modified"):
+                headers["If-Modified-Since"] = self.meta["last_modified"]
+        try:
+            response = requests.get(self.url, headers=headers, timeout=ASSET_FETCH_TIMEOUT)
+            if response.status_code == 304:
+                with self._lock:
+                    self.meta["checked_at"] = time.time()
+                    self._write_meta()
+                return False
+            response.raise_for_status()
+            # Reject error pages and truncated downloads before replacing a good copy
+            PILImage.open(BytesIO(response.content)).verify()
+        except Exception as e:
+            self.last_error = str(e)
+            return False
+        
+        with self._lock:
+            self.meta = {
+                "url": self.url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "checked_at": time.time(),
+            }
+            self._write_data(response.content)
+            self._write_meta()
+            self.content = response.content
+            self.source = "disk"
+            self.last_error = None
+        return True
+    
+    def _write_data(self, content):
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        tmp_path = self.data_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, self.data_path)
+    
+    def _write_meta(self):
+        try:
+            os.makedirs(os.path.dirname(self.meta_path), exist_ok=True)
+            tmp_path = self.meta_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.meta, f)
+            os.replace(tmp_path, self.meta_path)
+        except OSError as e:
+            self.last_error = str(e)
+    
+    def start_background_refresh(self):
+        """Start (once) the daemon thread that revalidates the asset on schedule."""
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="branding-asset-refresh", daemon=True)
+            self._refresher.start()
+    
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            if self.is_stale():
+                self.refresh()
+            if self.source == "disk":
+                wait = self.revalidate_seconds - (time.time() - self.meta.get("checked_at", 0))
+            else:
+                # Retry sooner while there is no downloaded copy
+                wait = min(self.revalidate_seconds, 300)
+            self._stop.wait(max(wait, 1))
+    
+    def stop(self):
+        self._stop.set()
+
+@st.cache_resource
+def get_branding_cache(url):
+    """One BrandingAssetCache per asset URL for the whole process."""
+    return BrandingAssetCache(url)
+
+@instrumented(lambda logo, url: {'bytes_out': len(logo.getvalue()) if logo else 0})
+def download_logo(url):
+    """Returns the logo as a BytesIO object from the branding cache (only fetched while nothing is cached)."""
+    cache = get_branding_cache(url)
+    content = cache.get()
+    if content is None:
+        st.warning(f"Could not load logo: {cache.last_error or 'no cached or bundled copy available'}")
         return None
+    return BytesIO(content)
 
-def normalize_text(text):
-    """Advanced text normalization for searching."""
-    if not text:
-        return ""
+# Unicode blocks normalize_text handles with a translation table: Latin-1,
+# Latin Extended, combining diacritics, Greek, Arabic (with presentation
+# forms, as PDF text extraction often yields), and common punctuation/symbols
+NORMALIZE_TABLE_RANGES = [
+    (0x0080, 0x024F), (0x0300, 0x03FF), (0x0600, 0x06FF), (0x0750, 0x077F),
+    (0x08A0, 0x08FF), (0x1E00, 0x1EFF), (0x2000, 0x214F), (0x2190, 0x21FF),
+    (0x25A0, 0x25FF), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF), (0xFFFD, 0xFFFD),
+]
+# Queries up to this length are memoized
+NORMALIZE_CACHE_MAX_LENGTH = 256
+
+def normalize_text_unicodedata(text):
+    """Reference normalization: NFD, drop nonspacing marks (Mn), lowercase, strip."""
     text = unicodedata.normalize('NFD', text)
     text = ''.join(char for char in text if unicodedata.category(char) != 'Mn')
     return text.lower().strip()
 
-def suggest_units_based_on_request(df, customer_request, max_suggestions=5):
+def build_normalize_table():
+    """
+    str.translate table mapping each character of NORMALIZE_TABLE_RANGES to its
+    NFD decomposition without Mn marks, plus the regex that finds characters
+    outside the table. A character is only covered if its decomposition keeps
+    no combining (ccc != 0) non-Mn character: then NFD's canonical reordering
+    cannot change the result and per-character translation is exact.
+    """
+    table = {}
+    covered = []
+    for first, last in NORMALIZE_TABLE_RANGES:
+        for code in range(first, last + 1):
+            char = chr(code)
+            decomposed = unicodedata.normalize('NFD', char)
+            kept = ''.join(c for c in decomposed if unicodedata.category(c) != 'Mn')
+            if any(unicodedata.combining(c) for c in kept):
+                continue
+            covered.append(char)
+            if kept != char:
+                table[code] = kept or None
+    uncovered = re.compile('[^\x00-\x7f' + ''.join(re.escape(c) for c in covered) + ']')
+    return table, uncovered
+
+NORMALIZE_TABLE, NORMALIZE_UNCOVERED_RE = build_normalize_table()
+
+def _normalize_text(text):
+    if text.isascii():
+        return text.lower().strip()
+    if NORMALIZE_UNCOVERED_RE.search(text) is None:
+        return text.translate(NORMALIZE_TABLE).lower().strip()
+    return normalize_text_unicodedata(text)
+
+_normalize_short_text = functools.lru_cache(maxsize=4096)(_normalize_text)
+
+def normalize_text(text):
+    """
+    Advanced text normalization for searching.
+    Same result as normalize_text_unicodedata(): ASCII text and text within
+    NORMALIZE_TABLE_RANGES take fast paths, and short strings (queries) are
+    memoized.
+    """
+    if not text:
+        return ""
+    if len(text) <= NORMALIZE_CACHE_MAX_LENGTH:
+        return _normalize_short_text(text)
+    return _normalize_text(text)
+
+# --- UNIT SUGGESTION ENGINE ---
+
+# Keywords for features
+GARDEN_KEYWORDS = ['garden', 'outdoor', 'green', 'terrace']
+VIEW_KEYWORDS = ['view', 'sea', 'ocean', 'lagoon', 'golf', 'landscape']
+FLOOR_KEYWORDS = ['ground', 'first', 'top', 'penthouse']
+AVAILABLE_STATUSES = ['available', 'ready']
+
+def parse_bedrooms_value(value):
+    """Parse a single bedrooms cell the way the row-by-row scorer did (int(), else NaN)."""
+    try:
+        return float(int(value))
+    except Exception:
+        return np.nan
+
+def parse_garden_value(value):
+    """Parse a single garden cell such as '120 m²' into square metres (NaN if unparsable)."""
+    try:
+        return float(str(value).replace('m²', '').strip())
+    except Exception:
+        return np.nan
+
+def map_column_values(series, parser, dtype=float):
+    """Apply a scalar parser once per distinct value of a column and broadcast the result."""
+    values = series.to_numpy(dtype=object)
+    # Mixed columns may hash 1, 1.0 and True together, so parse those cell by cell
+    if pd.api.types.infer_dtype(values, skipna=True) in ('mixed', 'mixed-integer'):
+        return np.fromiter((parser(v) for v in values), dtype=dtype, count=len(values))
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    parsed = np.fromiter((parser(v) for v in uniques), dtype=dtype, count=len(uniques))
+    return parsed[codes]
+
+def single_column(df, column):
+    """Return df[column] as a Series, or None if the column is missing or duplicated."""
+    if column not in df.columns or not isinstance(df.columns.get_loc(column), int):
+        return None
+    return df[column]
+
+def parse_bedrooms_column(series):
+    """Vectorized bedrooms parser: float array of whole bedroom counts, NaN where invalid."""
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else None
+    if kind in ('i', 'u', 'b'):
+        return series.to_numpy(dtype=float)
+    if kind == 'f' and series.dtype.itemsize == 8:
+        values = series.to_numpy()
+        with np.errstate(invalid='ignore'):
+            return np.where(np.isfinite(values), np.trunc(values), np.nan)
+    return map_column_values(series, parse_bedrooms_value)
+
+def parse_garden_column(series):
+    """Vectorized garden parser: float array of garden areas in m², NaN where invalid."""
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else None
+    if kind in ('i', 'u') or (kind == 'f' and series.dtype.itemsize == 8):
+        return series.to_numpy(dtype=float)
+    return map_column_values(series, parse_garden_value)
+
+def text_contains_any(series, keywords):
+    """Boolean array: str(cell).lower() contains any of the keywords."""
+    return map_column_values(
+        series, lambda v: any(kw in str(v).lower() for kw in keywords), dtype=bool
+    )
+
+def build_scoring_features(df):
+    """Parse every column the suggester uses into typed arrays, once per inventory."""
+    n = len(df)
+    features = {'size': n, 'bedrooms': None, 'garden': None, 'available': None}
+    
+    bedrooms = single_column(df, 'No.Bedrooms')
+    if bedrooms is not None:
+        features['bedrooms'] = parse_bedrooms_column(bedrooms)
+    
+    garden = single_column(df, 'Garden')
+    if garden is not None:
+        features['garden'] = parse_garden_column(garden)
+    
+    premium = np.zeros(n, dtype=bool)
+    for column in ('Dev Name', 'Type'):
+        series = single_column(df, column)
+        if series is not None:
+            premium |= text_contains_any(series, VIEW_KEYWORDS)
+    features['premium_location'] = premium
+    
+    status = single_column(df, 'Status')
+    if status is not None:
+        features['available'] = map_column_values(
+            status, lambda v: str(v).lower() in AVAILABLE_STATUSES, dtype=bool
+        )
+    
+    return features
+
+def rank_top_scores(scores, max_suggestions):
+    """
+    Positions of the best positive scores, highest first.
+    Ties keep inventory order, exactly like a stable sort on score.
+    """
+    candidates = np.flatnonzero(scores > 0)
+    # Unique key per candidate: higher score first, then earlier row first
+    rank_key = -scores[candidates] * (len(scores) + 1) + candidates
+    
+    if 0 < max_suggestions < len(candidates):
+        selected = np.argpartition(rank_key, max_suggestions - 1)[:max_suggestions]
+        return candidates[selected[np.argsort(rank_key[selected])]]
+    
+    ordered = candidates[np.argsort(rank_key, kind='stable')]
+    return ordered[:max_suggestions]
+
+@instrumented(lambda result, df, customer_request, *args, **kwargs: {
+    'bytes_in': len(customer_request.encode('utf-8')) if customer_request else 0
+})
+def suggest_units_based_on_request(df, customer_request, max_suggestions=5, features=None,
+                                   text_index=None, candidates=None):
     """
     AI-powered unit suggestions based on customer request.
     Analyzes the request and matches with inventory.
+    Scores are computed column-wise over pre-parsed feature arrays; pass
+    `features` from build_scoring_features() and a UnitTextIndex to skip
+    re-parsing the inventory. Free-text relevance (BM25 over the unit's
+    descriptive columns) adds up to TEXT_MATCH_POINTS. `candidates`
+    (ascending row positions, e.g. from InventoryIndex.filter_positions)
+    restricts scoring to those rows.
     """
     if not customer_request or df is None or df.empty:
         return []
+    if candidates is not None and len(candidates) == 0:
+        return []
+    
+    if features is None:
+        features = build_scoring_features(df)
+    if text_index is None:
+        text_index = UnitTextIndex(df)
+    
+    def rows(values):
+        # Feature values of the scored rows
+        return values if candidates is None or values is None else values[candidates]
     
     request_lower = customer_request.lower()
-    suggestions = []
     
     # Extract keywords from request
     bedroom_match = re.search(r'(\d+)\s*bedroom', request_lower)
     bedrooms_needed = int(bedroom_match.group(1)) if bedroom_match else None
     
-    # Keywords for features
-    garden_keywords = ['garden', 'outdoor', 'green', 'terrace']
-    view_keywords = ['view', 'sea', 'ocean', 'lagoon', 'golf', 'landscape']
-    floor_keywords = ['ground', 'first', 'top', 'penthouse']
+    has_garden_preference = any(kw in request_lower for kw in GARDEN_KEYWORDS)
+    has_view_preference = any(kw in request_lower for kw in VIEW_KEYWORDS)
+    
+    scores = np.zeros(features['size'] if candidates is None else len(candidates), dtype=np.int64)
+    bedroom_exact = None
+    garden_positive = None
+    garden = rows(features['garden'])
+    premium_location = rows(features['premium_location'])
+    available = rows(features['available'])
+    
+    # Bedroom match (highest priority)
+    if bedrooms_needed and features['bedrooms'] is not None:
+        bedrooms = rows(features['bedrooms'])
+        with np.errstate(invalid='ignore'):
+            bedroom_exact = bedrooms == bedrooms_needed
+            bedroom_near = np.abs(bedrooms - bedrooms_needed) == 1
+        scores += 50 * bedroom_exact + 25 * (bedroom_near & ~bedroom_exact)
+    
+    # Garden preference
+    if has_garden_preference and garden is not None:
+        with np.errstate(invalid='ignore'):
+            garden_positive = garden > 0
+        scores += 30 * garden_positive
     
-    has_garden_preference = any(kw in request_lower for kw in garden_keywords)
-    has_view_preference = any(kw in request_lower for kw in view_keywords)
+    # View/location preference
+    if has_view_preference:
+        scores += 20 * premium_location
     
-    # Score each unit
-    for idx, row in df.iterrows():
-        score = 0
+    # Status - Available units priority
+    if available is not None:
+        scores += 15 * available
+    
+    # Free-text relevance, scaled so the best-matching unit gets TEXT_MATCH_POINTS
+    text_scores, text_terms = text_index.score(customer_request)
+    text_scores = rows(text_scores)
+    if text_scores is not None and text_scores.max() > 0:
+        scores += np.rint(TEXT_MATCH_POINTS * text_scores / text_scores.max()).astype(np.int64)
+    
+    # Select top suggestions without sorting the whole inventory
+    top = rank_top_scores(scores, max_suggestions)
+    top_positions = top if candidates is None else candidates[top]
+    
+    suggestions = []
+    for i, pos, (idx, row) in zip(top, top_positions, df.iloc[top_positions].iterrows()):
         reasons = []
+        if bedroom_exact is not None and bedroom_exact[i]:
+            reasons.append(f"{bedrooms_needed} bedrooms")
+        if garden_positive is not None and garden_positive[i]:
+            reasons.append(f"Garden {float(garden[i])}m²")
+        if has_view_preference and premium_location[i]:
+            reasons.append("Premium location")
+        if available is not None and available[i]:
+            reasons.append("Available now")
+        if text_scores is not None and text_scores[i] > 0:
+            reasons.append("Matches " + ", ".join(f"'{t}'" for t in text_index.matched_terms(pos, text_terms)))
         
-        # Bedroom match (highest priority)
-        if bedrooms_needed and 'No.Bedrooms' in row:
-            try:
-                unit_bedrooms = int(row['No.Bedrooms'])
-                if unit_bedrooms == bedrooms_needed:
-                    score += 50
-                    reasons.append(f"{bedrooms_needed} bedrooms")
-                elif abs(unit_bedrooms - bedrooms_needed) == 1:
-                    score += 25
-            except:
-                pass
+        suggestions.append({
+            'unit_number': row.get('Unit Number', 'N/A'),
+            'dev_name': row.get('Dev Name', 'N/A'),
+            'bedrooms': row.get('No.Bedrooms', 'N/A'),
+            'area': row.get('BUA with Terraces', 'N/A'),
+            'price': row.get('Final Price', 'N/A'),
+            'score': int(scores[i]),
+            'reasons': ', '.join(reasons)
+        })
+    
+    return suggestions
+
+# --- UNIT TEXT RETRIEVAL ---
+
+# Descriptive columns searched for free-text requests, and BM25 parameters
+UNIT_TEXT_COLUMNS = ['Dev Name', 'Type', 'Type 4', 'Floor', 'Delivery Date']
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Structured-score points for the best text match (scaled down for weaker ones)
+TEXT_MATCH_POINTS = 40
+
+TEXT_TOKEN_RE = re.compile(r'\w+')
+TEXT_STOPWORDS = frozenset([
+    'a', 'an', 'and', 'any', 'at', 'by', 'for', 'from', 'i', 'in', 'is', 'it', 'looking',
+    'me', 'my', 'near', 'of', 'on', 'or', 'please', 'the', 'to', 'unit', 'want', 'we',
+    'with', 'would', 'like', 'need', 'some', 'one',
+    'في', 'من', 'مع', 'على', 'الى', 'إلى', 'او', 'أو', 'و',
+])
+
+def text_tokens(text):
+    """Search terms of a text: normalized words, plural 's' and Arabic 'ال' stripped."""
+    tokens = []
+    for token in TEXT_TOKEN_RE.findall(normalize_text(str(text))):
+        if token in TEXT_STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+            token = token[:-1]
+        elif len(token) > 3 and token.startswith('ال'):
+            token = token[2:]
+        tokens.append(token)
+    return tokens
+
+def query_tokens(text):
+    """Distinct query terms; short numbers ('3 bedrooms') are left to the structured scores."""
+    return list(dict.fromkeys(t for t in text_tokens(text) if not (t.isdigit() and len(t) < 4)))
+
+class UnitTextIndex:
+    """
+    BM25 index over each unit's descriptive columns.
+    Units with identical text share one document, so building and querying
+    cost scales with the number of distinct descriptions, not units; the
+    statistics (document frequency, average length) still count units.
+    """
+    
+    def __init__(self, df):
+        self.size = len(df)
+        self.postings = {}
+        self.doc_terms = []
+        self.doc_codes = np.zeros(self.size, dtype=np.int64)
         
-        # Garden preference
-        if has_garden_preference and 'Garden' in row:
-            try:
-                garden_area = float(str(row['Garden']).replace('m²', '').strip())
-                if garden_area > 0:
-                    score += 30
-                    reasons.append(f"Garden {garden_area}m²")
-            except:
-                pass
+        codes, uniques = [], []
+        for column in UNIT_TEXT_COLUMNS:
+            series = single_column(df, column)
+            if series is None:
+                continue
+            column_codes, column_uniques = pd.factorize(series.to_numpy(dtype=object))
+            codes.append(column_codes)
+            uniques.append([text_tokens(value) for value in column_uniques])
+        if not codes or self.size == 0:
+            return
         
-        # View/location preference
-        if has_view_preference:
-            dev_name = str(row.get('Dev Name', '')).lower()
-            type_info = str(row.get('Type', '')).lower()
-            if any(kw in dev_name or kw in type_info for kw in view_keywords):
-                score += 20
-                reasons.append("Premium location")
-        
-        # Status - Available units priority
-        if 'Status' in row and str(row['Status']).lower() in ['available', 'ready']:
-            score += 15
-            reasons.append("Available now")
+        # One document per distinct combination of column values, numbered in
+        # order of first appearance (hash factorize, column by column)
+        doc_codes = np.zeros(self.size, dtype=np.int64)
+        for column_codes, column_uniques in zip(codes, uniques):
+            doc_codes, _ = pd.factorize(doc_codes * (len(column_uniques) + 1) + column_codes + 1)
+        self.doc_codes = doc_codes
+        units_per_doc = np.bincount(doc_codes)
+        first_rows = np.full(len(units_per_doc), self.size, dtype=np.int64)
+        np.minimum.at(first_rows, doc_codes, np.arange(self.size))
+        combos = np.stack(codes, axis=1)[first_rows]
+        
+        doc_tf = []
+        for combo in combos:
+            tf = {}
+            for column_uniques, code in zip(uniques, combo):
+                if code >= 0:
+                    for token in column_uniques[code]:
+                        tf[token] = tf.get(token, 0) + 1
+            doc_tf.append(tf)
+        self.doc_terms = [frozenset(tf) for tf in doc_tf]
         
-        # Add to suggestions if score is good
-        if score > 0:
-            suggestions.append({
-                'unit_number': row.get('Unit Number', 'N/A'),
-                'dev_name': row.get('Dev Name', 'N/A'),
-                'bedrooms': row.get('No.Bedrooms', 'N/A'),
-                'area': row.get('BUA with Terraces', 'N/A'),
-                'price': row.get('Final Price', 'N/A'),
-                'score': score,
-                'reasons': ', '.join(reasons)
-            })
-    
-    # Sort by score and return top suggestions
-    suggestions.sort(key=lambda x: x['score'], reverse=True)
-    return suggestions[:max_suggestions]
+        doc_length = np.array([sum(tf.values()) for tf in doc_tf], dtype=float)
+        avg_length = float(np.dot(doc_length, units_per_doc)) / self.size or 1.0
+        
+        term_docs = {}
+        for doc, tf in enumerate(doc_tf):
+            for token, count in tf.items():
+                term_docs.setdefault(token, []).append((doc, count))
+        
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length)
+        for token, entries in term_docs.items():
+            docs = np.array([doc for doc, _ in entries], dtype=np.int64)
+            tf = np.array([count for _, count in entries], dtype=float)
+            units = int(units_per_doc[docs].sum())
+            idf = math.log(1 + (self.size - units + 0.5) / (units + 0.5))
+            self.postings[token] = (docs, idf * tf * (BM25_K1 + 1) / (tf + length_norm[docs]))
+    
+    def __len__(self):
+        return self.size
+    
+    def score(self, query):
+        """
+        Per-unit BM25 scores for a free-text query and the query terms the
+        index knows; (None, []) if no query term occurs in any unit.
+        """
+        terms = [t for t in query_tokens(query) if t in self.postings]
+        if not terms:
+            return None, []
+        doc_scores = np.zeros(len(self.doc_terms))
+        for term in terms:
+            docs, weights = self.postings[term]
+            doc_scores[docs] += weights
+        return doc_scores[self.doc_codes], terms
+    
+    def matched_terms(self, position, terms):
+        """Query terms found in the unit at a row position."""
+        doc_terms = self.doc_terms[self.doc_codes[position]]
+        return [t for t in terms if t in doc_terms]
 
-def extract_unit_types_from_pdf(pdf_bytes):
-    """Auto-detect unit/villa types from PDF brochure."""
-    unit_types = set()
-    keywords = ['villa', 'apartment', 'chalet', 'townhouse', 'twin house', 
-                'residence', 'penthouse', 'duplex', 'studio']
+# --- REQUEST CONSTRAINTS ---
+
+# Floor numbers for named floors; roof/top floors sort above any numbered floor
+ROOF_FLOOR = 100
+FLOOR_NAMES = {
+    'basement': -1, 'ground': 0, 'gf': 0, 'first': 1, 'second': 2, 'third': 3,
+    'fourth': 4, 'fifth': 5, 'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9,
+    'tenth': 10, 'roof': ROOF_FLOOR, 'rooftop': ROOF_FLOOR, 'top': ROOF_FLOOR,
+    'penthouse': ROOF_FLOOR,
+}
+# Delivery "year" of units that are already delivered, below any real year
+READY_DELIVERY_YEAR = 0
+READY_DELIVERY_WORDS = ('ready', 'delivered', 'immediate')
+
+PRICE_UNITS = {
+    'm': 1e6, 'mn': 1e6, 'mil': 1e6, 'million': 1e6, 'millions': 1e6, 'مليون': 1e6,
+    'k': 1e3, 'thousand': 1e3, 'الف': 1e3, 'ألف': 1e3,
+    'egp': 1, 'le': 1, 'pound': 1, 'pounds': 1, 'جنيه': 1,
+}
+
+REQUEST_NUMBER = r'\d+(?:[.,]\d+)*'
+REQUEST_UPPER_OPS = (r'under|below|less\s+than|cheaper\s+than|smaller\s+than|max(?:imum)?|up\s+to|'
+                     r'no\s+more\s+than|not\s+more\s+than|at\s+most|within|budget(?:\s+(?:of|is))?|<=?|'
+                     r'[اأ]قل\s+من|تحت')
+REQUEST_LOWER_OPS = (r'over|above|more\s+than|bigger\s+than|larger\s+than|min(?:imum)?|at\s+least|'
+                     r'from|starting\s+(?:from|at)|>=?|[اأ]كثر\s+من|فوق')
+# Comparators that exclude the bound itself (matters for whole floors and years)
+REQUEST_STRICT_OPS = re.compile(r'under|below|less|cheaper|smaller|over|above|more\s+than|bigger|larger|^[<>]$')
+
+PRICE_UNIT_PATTERN = r'(?:million|millions|mn|mil|m|k|thousand|egp|le|pounds?|مليون|[اأ]لف|جنيه)(?!\w)'
+AREA_UNIT_PATTERN = (r'(?:m²|m2|sqm|sq\.?\s*m(?:eters?|etres?)?|square\s+met(?:er|re)s?|met(?:er|re)s?|'
+                     r'م²|م2|متر(?:\s+مربع)?)(?!\w)')
+# Plain amounts with thousands separators or 6-10 digits are prices too; runs
+# starting with 0 or +, or longer, are phone numbers
+BARE_PRICE_PATTERN = r'(?<![\d+])(?:\d{1,3}(?:,\d{3}){2,}|[1-9]\d{5,9})'
+
+def quantity_patterns(unit_pattern):
+    """(range regex, bound regex) for a quantity with the given unit."""
+    range_re = re.compile(
+        rf'(?:between\s+|from\s+)?(?P<low>{REQUEST_NUMBER})\s*(?P<low_unit>{unit_pattern})?\s*'
+        rf'(?:-|–|to|and)\s*(?P<high>{REQUEST_NUMBER})\s*(?P<unit>{unit_pattern})'
+    )
+    bound_re = re.compile(
+        rf'(?:(?P<op>{REQUEST_UPPER_OPS}|{REQUEST_LOWER_OPS})\s*)?(?P<value>{REQUEST_NUMBER})\s*(?P<unit>{unit_pattern})'
+    )
+    return range_re, bound_re
+
+PRICE_RANGE_RE, PRICE_BOUND_RE = quantity_patterns(PRICE_UNIT_PATTERN)
+AREA_RANGE_RE, AREA_BOUND_RE = quantity_patterns(AREA_UNIT_PATTERN)
+BARE_PRICE_RE = re.compile(
+    rf'(?:(?P<op>{REQUEST_UPPER_OPS}|{REQUEST_LOWER_OPS})\s*)?(?P<value>{BARE_PRICE_PATTERN})(?![\w.,])'
+)
+UPPER_OP_RE = re.compile(rf'(?:{REQUEST_UPPER_OPS})$')
+
+# Between the floors of a list: 'ground, first or second floor'
+FLOOR_LIST_SEPARATOR = r'\s*(?:,|/|&|\bor\b|\band\b|و)\s*'
+# A unit's floor is named ('ground', 'first') or an ordinal ('3rd'); '3 floors' is a storey count
+FLOOR_NAME_PATTERN = rf'(?:{"|".join(FLOOR_NAMES)}|(?<![\d.,])\d{{1,2}}(?:st|nd|rd|th))'
+FLOOR_RE = re.compile(
+    rf'(?:(?P<op>{REQUEST_UPPER_OPS}|{REQUEST_LOWER_OPS})\s+)?(?:the\s+)?'
+    rf'(?P<floor>(?:{FLOOR_NAME_PATTERN}{FLOOR_LIST_SEPARATOR})*{FLOOR_NAME_PATTERN})\s+floor(?!\w)'
+    rf'|(?P<floor_list>{FLOOR_NAME_PATTERN}(?:{FLOOR_LIST_SEPARATOR}{FLOOR_NAME_PATTERN})+)\s+floors(?!\w)'
+    rf'|floor\s*(?:no\.?|number|#)?\s*(?P<floor_number>\d{{1,2}}(?:{FLOOR_LIST_SEPARATOR}\d{{1,2}})*)(?![\w.,])'
+)
+DELIVERY_WORDS = r'delivery|delivered|deliver|handover|hand\s+over|ready|move\s+in|receiv(?:e|ing)|استلام|تسليم'
+DELIVERY_OPS = r'in|by|before|until|till|no\s+later\s+than|after|from|starting|on|at|within'
+DELIVERY_YEAR = r'(?:(?:q[1-4]|h[12])\s*)?(?P<year>(?:19|20)\d\d)(?![\d.,])'
+DELIVERY_PATTERNS = (
+    # 'delivery by 2027', 'handover Q3 2027'
+    re.compile(rf'(?:{DELIVERY_WORDS})\s*(?:date\s*)?(?:(?P<op>{DELIVERY_OPS})\s+)?{DELIVERY_YEAR}'),
+    # 'Q3 2027 delivery', 'by 2027 handover'
+    re.compile(rf'(?:(?P<op>{DELIVERY_OPS})\s+)?{DELIVERY_YEAR}\s*(?:{DELIVERY_WORDS})'),
+    # A year on its own is a delivery year too: 'from 2026', 'Q3 2027'
+    re.compile(rf'(?:(?P<op>by|before|until|till|no\s+later\s+than|after|from|starting(?:\s+from)?)\s+|'
+               rf'(?=(?:q[1-4]|h[12])\s*\d))(?<![\d.,]){DELIVERY_YEAR}'),
+)
+# Amounts right after these words (or right before 'per ...') are payments, not the unit price
+PAYMENT_CONTEXT_RE = re.compile(
+    r'down\s*payment|deposit|install?ments?|monthly|quarterly|yearly|annual(?:ly)?|per\s+\w+|%|'
+    r'مقدم|قسط|اقساط|أقساط|شهري'
+)
+PAYMENT_AFTER_RE = re.compile(
+    r'\s*(?:per\b|a\s+(?:month|quarter|year)\b|/\s*\w|monthly|quarterly|yearly|annual|'
+    r'down\s*payment|deposit|install?ments?|مقدم|قسط|شهري)'
+)
+# An 'm' amount next to one of these words is metres, not millions
+METRE_CONTEXT_WORDS = (r'garden|terrace|roof|ceiling|height|high|wide|long|width|length|'
+                       r'bua|built|area|land|plot|space|حديقة|مساحة|سقف')
+METRE_BEFORE_RE = re.compile(rf'(?:{METRE_CONTEXT_WORDS})\s*(?:of|is|area|:)?\s*$')
+METRE_AFTER_RE = re.compile(rf'\s*(?:{METRE_CONTEXT_WORDS})')
+# Metre amounts in these contexts are areas; the rest (ceilings, widths) are ignored
+AREA_CONTEXT_RE = re.compile(r'garden|bua|built|area|land|plot|حديقة|مساحة')
+READY_NOW_RE = re.compile(r'ready\s+to\s+move|immediate(?:\s+delivery)?|ready\s+now|already\s+delivered|فوري|جاهز')
+GARDEN_CONTEXT_RE = re.compile(r'garden|حديقة')
+
+class RangeConstraint:
+    """
+    Inclusive numeric range over one InventoryIndex column; None means unbounded.
+    `values`, if set, are the only values allowed within the range (named floors).
+    """
     
-    try:
-        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    lines = text.split('\n')
-                    for line in lines:
-                        line_lower = line.lower()
-                        for keyword in keywords:
-                            if keyword in line_lower:
-                                cleaned = re.sub(r'[^\w\s]', '', line).strip()
-                                if 10 < len(cleaned) < 80:
-                                    unit_types.add(line.strip())
-                                    break
-    except Exception as e:
-        st.error(f"Error extracting unit types: {e}")
+    def __init__(self, column, low=None, high=None, values=None):
+        self.column = column
+        self.low = low
+        self.high = high
+        self.values = values
+    
+    def intersect(self, low=None, high=None):
+        if low is not None:
+            self.low = low if self.low is None else max(self.low, low)
+        if high is not None:
+            self.high = high if self.high is None else min(self.high, high)
+        if self.values is not None:
+            self.values = {v for v in self.values
+                           if (self.low is None or v >= self.low) and (self.high is None or v <= self.high)}
+    
+    def allow(self, values):
+        """Narrow to a set of values (the range becomes their span, within the current one)."""
+        self.values = set(values) if self.values is None else self.values & set(values)
+        if self.values:
+            self.intersect(min(self.values), max(self.values))
+    
+    def __eq__(self, other):
+        return isinstance(other, RangeConstraint) and \
+            (self.column, self.low, self.high, self.values) == (other.column, other.low, other.high, other.values)
+    
+    def __repr__(self):
+        values = f", values={sorted(self.values)!r}" if self.values is not None else ""
+        return f"RangeConstraint({self.column!r}, {self.low!r}, {self.high!r}{values})"
+    
+    def describe(self):
+        """Human-readable form for the UI, e.g. 'Price ≤ 15M'."""
+        label, fmt = CONSTRAINT_LABELS[self.column]
+        if self.values is not None and len(self.values) > 1:
+            return f"{label} {' / '.join(fmt(v) for v in sorted(self.values))}"
+        if self.low is not None and self.high is not None:
+            if self.low == self.high:
+                return f"{label} = {fmt(self.low)}"
+            return f"{label} {fmt(self.low)}–{fmt(self.high)}"
+        if self.high is not None:
+            return f"{label} ≤ {fmt(self.high)}"
+        return f"{label} ≥ {fmt(self.low)}"
+
+def format_price_bound(value):
+    return f"{value / 1e6:g}M" if value >= 1e6 else f"{value:,.0f} EGP"
+
+def format_floor_bound(value):
+    names = {-1: "Basement", 0: "Ground", ROOF_FLOOR: "Roof"}
+    return names.get(int(value), str(int(value)))
+
+def format_delivery_bound(value):
+    return "Ready" if value == READY_DELIVERY_YEAR else str(int(value))
+
+CONSTRAINT_LABELS = {
+    'price': ("Price", format_price_bound),
+    'bua': ("BUA", lambda v: f"{v:g} m²"),
+    'garden': ("Garden", lambda v: f"{v:g} m²"),
+    'floor': ("Floor", format_floor_bound),
+    'delivery_year': ("Delivery", format_delivery_bound),
+}
+
+def parse_request_number(text):
+    """'12,500,000' / '12.500.000' -> 12500000.0, '1.5' / '1,5' -> 1.5."""
+    if re.fullmatch(r'\d{1,3}(?:,\d{3})+(?:\.\d+)?', text):
+        return float(text.replace(',', ''))
+    if text.count('.') > 1:
+        return float(text.replace('.', '').replace(',', '.'))
+    if text.count(',') == 1 and '.' not in text:
+        # Decimal comma: '1,5M'
+        return float(text.replace(',', '.'))
+    return float(text.replace(',', ''))
+
+def bound_from_op(op, value, step=0):
+    """(low, high) for a comparator and value; `step` turns strict bounds on whole numbers inclusive."""
+    if not op:
+        return None
+    strict = step if REQUEST_STRICT_OPS.search(op) else 0
+    if UPPER_OP_RE.match(op):
+        return None, value - strict
+    return value + strict, None
+
+def parse_request_constraints(request):
+    """
+    Pull price, BUA, garden, floor and delivery ranges out of a free-text
+    request ('under 15M', 'at least 250 m²', 'garden 100-200 sqm',
+    'ground floor', 'delivery 2027', 'Q3 2027 delivery', 'from 2026',
+    'ready to move') as a dict of column -> RangeConstraint. Bare prices are
+    read as a budget (maximum) and bare areas as a minimum. Payment amounts
+    ('down payment 1.5M', '80k monthly') are not prices, 'm' right next to an
+    area word ('200m garden') is metres, a list of floors ('1st or 2nd floor')
+    keeps each of them, and a storey count ('3 floors') is not a floor.
+    """
+    constraints = {}
+    if not request:
+        return constraints
+    text = normalize_text(request)
+    
+    def add(column, low=None, high=None):
+        constraints.setdefault(column, RangeConstraint(column)).intersect(low, high)
+    
+    def consume(match):
+        # Blank out a parsed span so later patterns do not read it again
+        nonlocal text
+        text = text[:match.start()] + ' ' * (match.end() - match.start()) + text[match.end():]
+    
+    def area_column(match):
+        before = re.split(r'[,;.]|\band\b', text[max(0, match.start() - 40):match.start()])[-1]
+        after = text[match.end():match.end() + 15]
+        return 'garden' if GARDEN_CONTEXT_RE.search(before) or GARDEN_CONTEXT_RE.match(after.strip()) else 'bua'
+    
+    # Context checks read the request as written, not the blanked-out text
+    request_text = text
+    
+    def clause_before(match):
+        return re.split(r'[,;]|\.(?!\d)|\band\b', request_text[max(0, match.start() - 40):match.start()])[-1]
+    
+    def is_payment(match):
+        return bool(PAYMENT_CONTEXT_RE.search(clause_before(match))
+                    or PAYMENT_AFTER_RE.match(request_text, match.end()))
+    
+    def metre_context(match):
+        """
+        The area word right next to an 'm' amount ('garden 200m', '200m garden'),
+        or None if it reads as millions. An area word before a comparator
+        ('garden under 30M') does not count.
+        """
+        if match.group('unit') != 'm':
+            return None
+        number_start = match.start('value' if 'value' in match.groupdict() else 'low')
+        before = None
+        if number_start == match.start():
+            before = METRE_BEFORE_RE.search(request_text[max(0, number_start - 20):number_start])
+        after = METRE_AFTER_RE.match(request_text, match.end())
+        found = before or after
+        return found.group().strip() if found else None
+    
+    # Price
+    for match in list(PRICE_RANGE_RE.finditer(text)):
+        metres = metre_context(match)
+        if metres is not None:
+            if AREA_CONTEXT_RE.search(metres):
+                column = 'garden' if GARDEN_CONTEXT_RE.search(metres) else 'bua'
+                add(column, parse_request_number(match.group('low')), parse_request_number(match.group('high')))
+        elif not is_payment(match):
+            high_unit = PRICE_UNITS[match.group('unit')]
+            low_unit = PRICE_UNITS[match.group('low_unit')] if match.group('low_unit') else high_unit
+            add('price', parse_request_number(match.group('low')) * low_unit,
+                parse_request_number(match.group('high')) * high_unit)
+        consume(match)
+    for pattern in (PRICE_BOUND_RE, BARE_PRICE_RE):
+        for match in list(pattern.finditer(text)):
+            metres = metre_context(match) if pattern is PRICE_BOUND_RE else None
+            if metres is not None:
+                if AREA_CONTEXT_RE.search(metres):
+                    column = 'garden' if GARDEN_CONTEXT_RE.search(metres) else 'bua'
+                    value = parse_request_number(match.group('value'))
+                    add(column, *(bound_from_op(match.group('op'), value) or (value, None)))
+            elif not is_payment(match):
+                unit = PRICE_UNITS[match.group('unit')] if 'unit' in match.groupdict() else 1
+                value = parse_request_number(match.group('value')) * unit
+                add('price', *(bound_from_op(match.group('op'), value) or (None, value)))
+            consume(match)
+    
+    # Built-up and garden area
+    for match in list(AREA_RANGE_RE.finditer(text)):
+        add(area_column(match), parse_request_number(match.group('low')), parse_request_number(match.group('high')))
+        consume(match)
+    for match in list(AREA_BOUND_RE.finditer(text)):
+        value = parse_request_number(match.group('value'))
+        add(area_column(match), *(bound_from_op(match.group('op'), value) or (value, None)))
+        consume(match)
+    
+    # Floor: comparators narrow the range; named floors ('1st or 2nd floor') allow each of them
+    named_floors = []
+    for match in list(FLOOR_RE.finditer(text)):
+        names = re.split(FLOOR_LIST_SEPARATOR,
+                         match.group('floor') or match.group('floor_list') or match.group('floor_number'))
+        floors = [
+            FLOOR_NAMES[name] if name in FLOOR_NAMES else int(re.match(r'\d+', name).group())
+            for name in (re.sub(r'(?<=\d)(?:st|nd|rd|th)$', '', name) for name in names)
+        ]
+        bound = bound_from_op(match.group('op'), floors[0], step=1) if len(floors) == 1 else None
+        if bound:
+            add('floor', *bound)
+        else:
+            named_floors.extend(floors)
+        consume(match)
+    if named_floors:
+        constraints.setdefault('floor', RangeConstraint('floor')).allow(named_floors)
     
+    # Delivery
+    for pattern in DELIVERY_PATTERNS:
+        for match in list(pattern.finditer(text)):
+            year, op = int(match.group('year')), (match.group('op') or '').split(' ')[0]
+            if op in ('by', 'until', 'till', 'no', 'within'):
+                add('delivery_year', None, year)
+            elif op == 'before':
+                add('delivery_year', None, year - 1)
+            elif op == 'after':
+                add('delivery_year', year + 1, None)
+            elif op in ('from', 'starting'):
+                add('delivery_year', year, None)
+            else:
+                add('delivery_year', year, year)
+            consume(match)
+    if READY_NOW_RE.search(text):
+        add('delivery_year', None, datetime.now().year)
+    
+    return constraints
+
+def parse_floor_value(value):
+    """Floor cell ('Ground', '3rd', 'Floor 2', 'Roof', 4) as a number (NaN if unknown)."""
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip().lower()
+    number = re.search(r'-?\d+', text)
+    if number:
+        return float(number.group())
+    for word in re.findall(r'[a-z]+', text):
+        if word in FLOOR_NAMES:
+            return float(FLOOR_NAMES[word])
+    return np.nan
+
+def parse_delivery_year_value(value):
+    """Delivery cell ('Q3 2027', '2026-06-30', a date, 'Ready') as a year (NaN if unknown)."""
+    if hasattr(value, 'year'):
+        return float(value.year)
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value) if 1900 <= value <= 2100 else np.nan
+    text = str(value).lower()
+    year = re.search(r'(?:19|20)\d\d', text)
+    if year:
+        return float(year.group())
+    if any(word in text for word in READY_DELIVERY_WORDS):
+        return float(READY_DELIVERY_YEAR)
+    return np.nan
+
+def parse_text_column(df, column, parser):
+    """Float array from a per-value parser (NaN everywhere if the column is missing)."""
+    series = single_column(df, column)
+    if series is None:
+        return np.full(len(df), np.nan)
+    return map_column_values(series, parser)
+
+# --- BROCHURE CACHE ---
+
+# Upper bound for parsed brochures kept in memory (PDF bytes + extracted text)
+BROCHURE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+UNIT_TYPE_KEYWORDS = ['villa', 'apartment', 'chalet', 'townhouse', 'twin house', 
+                      'residence', 'penthouse', 'duplex', 'studio']
+
+def brochure_digest(pdf_bytes):
+    """SHA-256 hex digest identifying a brochure by its content."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+def detect_unit_types(page_texts):
+    """Auto-detect unit/villa type lines from the brochure's page text."""
+    unit_types = set()
+    for text in page_texts:
+        if text:
+            lines = text.split('\n')
+            for line in lines:
+                line_lower = line.lower()
+                for keyword in UNIT_TYPE_KEYWORDS:
+                    if keyword in line_lower:
+                        cleaned = re.sub(r'[^\w\s]', '', line).strip()
+                        if 10 < len(cleaned) < 80:
+                            unit_types.add(line.strip())
+                            break
     return sorted(list(unit_types))[:20]
 
-def extract_images_from_pdf_pages(pdf_bytes, page_indices, max_images=4):
-    """Extract images from specific PDF pages."""
-    images = []
-    try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+# Character n-gram length used by the brochure page index
+PAGE_INDEX_NGRAM = 3
+PAGE_INDEX_MAX_QUERIES = 256
+
+def iter_page_bits(mask):
+    """Yield the page numbers set in a page bitmask, in ascending order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+class PageTextIndex:
+    """
+    Inverted index over a brochure's normalized page text.
+    Maps every character n-gram to a bitmask of the pages containing it, so a
+    search only runs the exact substring check on pages holding all its n-grams.
+    """
+    
+    def __init__(self, normalized_pages, page_has_text):
+        self.pages = normalized_pages
+        self.postings = {}
+        self.text_pages = 0
+        self._results = {}
+        n = PAGE_INDEX_NGRAM
         
-        for page_idx in page_indices:
-            if page_idx >= len(doc):
+        for page_num, text in enumerate(normalized_pages):
+            if not page_has_text[page_num]:
                 continue
-                
-            page = doc[page_idx]
-            image_list = page.get_images(full=True)
-            
-            for img_idx, img_info in enumerate(image_list):
-                if len(images) >= max_images:
-                    break
-                    
-                try:
-                    xref = img_info[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    pil_image = PILImage.open(BytesIO(image_bytes))
-                    
-                    if pil_image.width > 200 and pil_image.height > 200:
-                        images.append(pil_image)
-                        
-                except Exception:
-                    continue
-            
-            if len(images) >= max_images:
+            bit = 1 << page_num
+            self.text_pages |= bit
+            for gram in {text[i:i + n] for i in range(len(text) - n + 1)}:
+                self.postings[gram] = self.postings.get(gram, 0) | bit
+    
+    @classmethod
+    def from_state(cls, normalized_pages, postings, text_pages):
+        """Rebuild an index from its stored postings without re-scanning the pages."""
+        index = cls.__new__(cls)
+        index.pages = normalized_pages
+        index.postings = postings
+        index.text_pages = text_pages
+        index._results = {}
+        return index
+    
+    def candidate_pages(self, term_clean):
+        """Bitmask of pages that contain every n-gram of the (normalized) term."""
+        n = PAGE_INDEX_NGRAM
+        mask = self.text_pages
+        for gram in {term_clean[i:i + n] for i in range(len(term_clean) - n + 1)}:
+            mask &= self.postings.get(gram, 0)
+            if not mask:
                 break
-        
-        doc.close()
-        
-    except Exception as e:
-        st.error(f"Error extracting images: {e}")
+        return mask
     
-    return images[:max_images]
+    def search(self, term_clean):
+        """All pages (ascending) whose normalized text contains the normalized term."""
+        pages = self._results.get(term_clean)
+        if pages is None:
+            pages = [
+                page_num for page_num in iter_page_bits(self.candidate_pages(term_clean))
+                if term_clean in self.pages[page_num]
+            ]
+            if len(self._results) >= PAGE_INDEX_MAX_QUERIES:
+                self._results.clear()
+            self._results[term_clean] = pages
+        return pages
 
-def find_pages_in_pdf(pdf_bytes, search_term, limit=4):
-    """Find pages containing search term."""
-    found_pages = []
-    try:
-        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-            search_clean = normalize_text(search_term)
-            
-            for i, page in enumerate(pdf.pages):
-                if len(found_pages) >= limit:
-                    break
-                
-                text = page.extract_text()
-                if text:
-                    page_clean = normalize_text(text)
-                    if search_clean in page_clean:
-                        found_pages.append(i)
-    except Exception as e:
-        st.error(f"Error searching PDF: {e}")
+class ParsedBrochure:
+    """Everything derived from one brochure PDF, computed a single time."""
     
-    return found_pages
-
-class ProfessionalLetterhead(canvas.Canvas):
-    """Custom canvas for professional letterhead template"""
+    def __init__(self, digest, pdf_bytes, page_texts, page_images, normalized_pages=None, unit_types=None):
+        self.digest = digest
+        self.pdf_bytes = pdf_bytes
+        self.page_texts = page_texts
+        if normalized_pages is None:
+            normalized_pages = [normalize_text(text) for text in page_texts]
+        self.normalized_pages = normalized_pages
+        self.unit_types = detect_unit_types(page_texts) if unit_types is None else unit_types
+        # Per page: the raw page.get_images(full=True) tuples (xref, smask, width, height, ...)
+        self.page_images = page_images
+        self.nbytes = (
+            len(pdf_bytes)
+            + sum(len(text) for text in page_texts)
+            + sum(len(text) for text in self.normalized_pages)
+        )
     
-    def __init__(self, *args, logo_bytes=None, customer_data=None, **kwargs):
-        canvas.Canvas.__init__(self, *args, **kwargs)
-        self.logo_bytes = logo_bytes
-        self.customer_data = customer_data or {}
-        self.pages = 0
-        
-    def showPage(self):
-        self.pages += 1
-        self._add_letterhead()
-        canvas.Canvas.showPage(self)
-        
-    def save(self):
-        self._add_letterhead()
-        canvas.Canvas.save(self)
-        
-    def _add_letterhead(self):
-        """Add header and footer to each page"""
-        page_width, page_height = A4
-        
+        self._page_index = None
+        # Per page, built on demand: image placements and text blocks (see catalog_brochure_pages)
+        self._image_catalog = {}
+    
+    def to_state(self):
+        """
+        Everything derived from the PDF, search index included, as plain data.
+        Stored state never references app classes, which Streamlit redefines on
+        every rerun and which live under a different module in batch.py.
+        """
+        index = self.page_index
+        return {
+            'digest': self.digest,
+            'pdf_bytes': self.pdf_bytes,
+            'page_texts': self.page_texts,
+            'page_images': self.page_images,
+            'normalized_pages': self.normalized_pages,
+            'unit_types': self.unit_types,
+            'postings': index.postings,
+            'text_pages': index.text_pages,
+            'image_catalog': self.image_catalog(range(self.page_count)),
+        }
+    
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a brochure from to_state() output without parsing or normalizing anything."""
+        brochure = cls(
+            state['digest'], state['pdf_bytes'], state['page_texts'], state['page_images'],
+            state['normalized_pages'], state['unit_types'],
+        )
+        brochure._page_index = PageTextIndex.from_state(
+            brochure.normalized_pages, state['postings'], state['text_pages']
+        )
+        brochure._image_catalog = dict(state.get('image_catalog', {}))
+        return brochure
+    
+    @property
+    def page_count(self):
+        return len(self.page_texts)
+    
+    @property
+    def page_index(self):
+        """Inverted n-gram index over the normalized pages, built on first search."""
+        if self._page_index is None:
+            self._page_index = PageTextIndex(
+                self.normalized_pages, [bool(text) for text in self.page_texts]
+            )
+        return self._page_index
+    
+    def search_pages(self, search_term, limit=None):
+        """Pages whose normalized text contains the normalized search term."""
+        pages = self.page_index.search(normalize_text(search_term))
+        return list(pages) if limit is None else pages[:max(limit, 0)]
+    
+    def image_catalog(self, pages):
+        """{page: catalog entry} for the given pages, cataloging each page once."""
+        pages = [page for page in pages if 0 <= page < self.page_count]
+        missing = [page for page in pages if page not in self._image_catalog]
+        if missing:
+            # FITZ_LOCK also keeps two threads from cataloging the same pages
+            with FITZ_LOCK:
+                missing = [page for page in missing if page not in self._image_catalog]
+                if missing:
+                    self._image_catalog.update(
+                        catalog_brochure_pages(self.pdf_bytes, self.page_images, missing)
+                    )
+        return {page: self._image_catalog[page] for page in pages}
+
+# --- TEXT EXTRACTION BACKENDS ---
+
+# MuPDF keeps process-global state and is not thread-safe: every fitz call that
+# may run off the script thread (pipeline stages, gallery encoders) holds this
+FITZ_LOCK = threading.RLock()
+
+def extract_page_texts_fitz(pdf_bytes):
+    """Page texts via PyMuPDF: one pass over the document, reading order sorted."""
+    with FITZ_LOCK:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            return [page.get_text("text", sort=True) for page in doc]
+        finally:
+            doc.close()
+
+def extract_page_texts_pdfplumber(pdf_bytes):
+    """Page texts via pdfplumber's character-level layout analysis (slower)."""
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+# Registered backends: name -> callable(pdf_bytes) returning one string per page
+TEXT_BACKENDS = {
+    'fitz': extract_page_texts_fitz,
+    'pdfplumber': extract_page_texts_pdfplumber,
+}
+DEFAULT_TEXT_BACKEND = 'fitz'
+FALLBACK_TEXT_BACKEND = 'pdfplumber'
+
+def extract_page_texts(pdf_bytes, backend=DEFAULT_TEXT_BACKEND):
+    """Extract the text of every page, falling back to pdfplumber if the backend fails."""
+    try:
+        return TEXT_BACKENDS[backend](pdf_bytes)
+    except Exception:
+        if backend == FALLBACK_TEXT_BACKEND:
+            raise
+        return TEXT_BACKENDS[FALLBACK_TEXT_BACKEND](pdf_bytes)
+
+def parse_brochure(pdf_bytes, digest=None, text_backend=DEFAULT_TEXT_BACKEND):
+    """Parse a brochure PDF into a ParsedBrochure (page text and image xrefs)."""
+    if text_backend == 'fitz':
+        # Single pass: text and image inventory from the same open document
+        try:
+            with FITZ_LOCK:
+                doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+                try:
+                    page_texts = []
+                    page_images = []
+                    for page in doc:
+                        page_texts.append(page.get_text("text", sort=True))
+                        page_images.append(page.get_images(full=True))
+                finally:
+                    doc.close()
+            return ParsedBrochure(digest or brochure_digest(pdf_bytes), pdf_bytes, page_texts, page_images)
+        except Exception:
+            text_backend = FALLBACK_TEXT_BACKEND
+    
+    page_texts = extract_page_texts(pdf_bytes, text_backend)
+    
+    try:
+        with FITZ_LOCK:
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            try:
+                page_images = [page.get_images(full=True) for page in doc]
+            finally:
+                doc.close()
+    except Exception:
+        page_images = [[] for _ in page_texts]
+    
+    return ParsedBrochure(digest or brochure_digest(pdf_bytes), pdf_bytes, page_texts, page_images)
+
+class BrochureCache:
+    """
+    Process-wide LRU cache of parsed brochures keyed by SHA-256 of the PDF bytes.
+    Eviction is bounded by the total size of the cached entries.
+    """
+    
+    def __init__(self, max_bytes=BROCHURE_CACHE_MAX_BYTES, text_backend=DEFAULT_TEXT_BACKEND):
+        self.max_bytes = max_bytes
+        self.text_backend = text_backend
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # Recently seen bytes objects -> digest, so repeat calls skip re-hashing
+        self._recent_digests = OrderedDict()
+    
+    def get(self, pdf_bytes):
+        """Return the ParsedBrochure for these bytes, parsing them on first use only; a ParsedBrochure passes through."""
+        if not isinstance(pdf_bytes, (bytes, bytearray, memoryview)):
+            return pdf_bytes
+        digest = self._digest(pdf_bytes)
+        with self._lock:
+            entry = self._lookup(digest)
+            if entry is not None:
+                return entry
+            key_lock = self._key_locks.setdefault(digest, threading.Lock())
+        
+        # Concurrent sessions uploading the same brochure wait for a single parse
+        with key_lock:
+            try:
+                with self._lock:
+                    entry = self._lookup(digest)
+                    if entry is not None:
+                        return entry
+                entry = parse_brochure(pdf_bytes, digest, self.text_backend)
+                with self._lock:
+                    self.misses += 1
+                    self._store(entry)
+            finally:
+                # Also on a failed parse; never drop a newer caller's lock
+                with self._lock:
+                    if self._key_locks.get(digest) is key_lock:
+                        del self._key_locks[digest]
+        return entry
+    
+    def _digest(self, pdf_bytes):
+        """SHA-256 of the bytes, memoized by object identity for the last few objects."""
+        with self._lock:
+            recent = self._recent_digests.get(id(pdf_bytes))
+            if recent is not None and recent[0] is pdf_bytes:
+                return recent[1]
+        digest = brochure_digest(pdf_bytes)
+        with self._lock:
+            # Holding a reference keeps id() from being reused while memoized
+            self._recent_digests[id(pdf_bytes)] = (pdf_bytes, digest)
+            while len(self._recent_digests) > 8:
+                self._recent_digests.popitem(last=False)
+        return digest
+    
+    def _lookup(self, digest):
+        entry = self._entries.get(digest)
+        if entry is not None:
+            self._entries.move_to_end(digest)
+            self.hits += 1
+        return entry
+    
+    def _store(self, entry):
+        self._entries[entry.digest] = entry
+        self.total_bytes += entry.nbytes
+        # Evict least recently used brochures, always keeping the newest one
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+    
+    def lookup(self, digest):
+        """The cached ParsedBrochure with this digest, or None."""
+        with self._lock:
+            return self._lookup(digest)
+    
+    def add(self, entry):
+        """Keep an already parsed brochure (e.g. loaded from the library)."""
+        with self._lock:
+            if entry.digest not in self._entries:
+                self._store(entry)
+            # Later get() calls with the same bytes object skip hashing them
+            self._recent_digests[id(entry.pdf_bytes)] = (entry.pdf_bytes, entry.digest)
+            while len(self._recent_digests) > 8:
+                self._recent_digests.popitem(last=False)
+    
+    def __contains__(self, pdf_bytes):
+        digest = brochure_digest(pdf_bytes)
+        with self._lock:
+            return digest in self._entries
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+@st.cache_resource
+def get_brochure_cache():
+    """Single BrochureCache shared by every session and rerun in this process."""
+    return BrochureCache()
+
+def get_parsed_brochure(pdf_bytes):
+    """Fetch (or parse once) the brochure for these PDF bytes; a ParsedBrochure passes through."""
+    if not isinstance(pdf_bytes, (bytes, bytearray, memoryview)):
+        return pdf_bytes
+    return get_brochure_cache().get(pdf_bytes)
+
+@instrumented(measure_brochure)
+def extract_unit_types_from_pdf(pdf_bytes):
+    """Auto-detect unit/villa types from PDF brochure."""
+    try:
+        return get_parsed_brochure(pdf_bytes).unit_types
+    except Exception as e:
+        st.error(f"Error extracting unit types: {e}")
+        return []
+
+# Minimum embedded image size (pixels, both sides) worth putting in the gallery
+MIN_GALLERY_IMAGE_PX = 200
+
+# dHash grid: DHASH_SIZE x DHASH_SIZE bits compared on a (size + 1) x size grayscale thumbnail
+DHASH_SIZE = 8
+# Images whose hashes differ in at most this many of the 64 bits are near-duplicates
+DUPLICATE_HASH_DISTANCE = 6
+# Gallery ranking: share of the on-page area that counts as fully prominent, and
+# how prominence and closeness to the matched text are weighed
+GALLERY_FULL_PROMINENCE_AREA = 0.4
+GALLERY_PROMINENCE_WEIGHT = 0.6
+GALLERY_PROXIMITY_WEIGHT = 0.4
+# Vector art on pages without gallery images: drawings covering more of the page
+# are backgrounds, clusters covering less are rules and icons
+VECTOR_BACKGROUND_AREA = 0.9
+MIN_VECTOR_CLUSTER_AREA = 0.03
+
+def image_dhash(data):
+    """64-bit difference hash of encoded image bytes; JPEGs are decoded at 1/8 scale."""
+    img = PILImage.open(BytesIO(data))
+    img.draft('L', (DHASH_SIZE * 4, DHASH_SIZE * 4))
+    small = img.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), PILImage.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def catalog_brochure_pages(pdf_bytes, page_images, pages):
+    """
+    Per page: its size, the gallery-sized images placed on it (xref, pixel size,
+    on-page bbox, share of the page it covers, dHash) and its text blocks
+    (bbox, normalized text). `page_images` are the brochure's get_images(full=True)
+    lists. Hashes are computed once per xref. Pages without gallery images
+    also list their vector graphics (floor plans, maps) as clustered rects.
+    """
+    catalog = {}
+    hashes = {}
+    with FITZ_LOCK:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            for page_num in pages:
+                page = doc[page_num]
+                page_area = abs(page.rect) or 1.0
+                
+                images = []
+                seen_xrefs = set()
+                # Tuples are (xref, smask, width, height, ...); get_image_info(xrefs=True)
+                # would also md5 every decoded image, so placements come from get_image_bbox
+                for item in page_images[page_num]:
+                    xref, width, height = item[0], item[2], item[3]
+                    if xref in seen_xrefs or width <= MIN_GALLERY_IMAGE_PX or height <= MIN_GALLERY_IMAGE_PX:
+                        continue
+                    seen_xrefs.add(xref)
+                    try:
+                        bbox = page.get_image_bbox(item)
+                    except Exception:
+                        bbox = fitz.Rect()
+                    # Images not drawn on the page (or drawn off it) count as zero area
+                    bbox = bbox & page.rect if bbox.is_valid and not bbox.is_infinite else fitz.Rect()
+                    
+                    if xref not in hashes:
+                        try:
+                            hashes[xref] = image_dhash(doc.extract_image(xref)["image"])
+                        except Exception:
+                            hashes[xref] = None
+                    images.append({
+                        'xref': xref,
+                        'width': width,
+                        'height': height,
+                        'bbox': tuple(bbox),
+                        'area': abs(bbox) / page_area,
+                        'dhash': hashes[xref],
+                    })
+                
+                blocks = [
+                    (tuple(block[:4]), normalize_text(block[4]))
+                    for block in page.get_text("blocks") if block[6] == 0
+                ]
+                drawings = []
+                if not images:
+                    paths = [d for d in page.get_drawings() if abs(d['rect']) < VECTOR_BACKGROUND_AREA * page_area]
+                    if paths:
+                        drawings = [
+                            tuple(rect) for rect in page.cluster_drawings(drawings=paths)
+                            if abs(rect & page.rect) >= MIN_VECTOR_CLUSTER_AREA * page_area
+                        ]
+                catalog[page_num] = {
+                    'size': (page.rect.width, page.rect.height),
+                    'images': images,
+                    'blocks': blocks,
+                    'drawings': drawings,
+                }
+        finally:
+            doc.close()
+    return catalog
+
+def rect_distance(a, b):
+    """Gap between two (x0, y0, x1, y1) rectangles; 0 if they touch or overlap."""
+    dx = max(0.0, a[0] - b[2], b[0] - a[2])
+    dy = max(0.0, a[1] - b[3], b[1] - a[3])
+    return math.hypot(dx, dy)
+
+def rank_gallery_images(catalog, search_term=None):
+    """
+    (score, page, xref, entry) for every cataloged image, best first. Prominence
+    is the share of the page the image covers; proximity is how close it sits
+    to a text block containing the search term (0 when no block matches).
+    """
+    term = normalize_text(search_term) if search_term else ""
+    ranked = []
+    for page_num, page in catalog.items():
+        diagonal = math.hypot(*page['size']) or 1.0
+        matched = [bbox for bbox, text in page['blocks'] if term and term in text]
+        for entry in page['images']:
+            prominence = min(1.0, entry['area'] / GALLERY_FULL_PROMINENCE_AREA)
+            proximity = 0.0
+            if matched:
+                gap = min(rect_distance(entry['bbox'], bbox) for bbox in matched)
+                proximity = 1.0 / (1.0 + 4.0 * gap / diagonal)
+            score = GALLERY_PROMINENCE_WEIGHT * prominence + GALLERY_PROXIMITY_WEIGHT * proximity
+            ranked.append((score, page_num, entry['xref'], entry))
+    # Best score first; ties keep page order
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked
+
+def is_near_duplicate(dhash, kept_hashes):
+    """True if the hash is within DUPLICATE_HASH_DISTANCE bits of an image already kept."""
+    if dhash is None:
+        return False
+    return any((dhash ^ kept).bit_count() <= DUPLICATE_HASH_DISTANCE for kept in kept_hashes)
+
+class BrochureImage:
+    """
+    Lazy handle to an image embedded in a brochure.
+    Size is known from the PDF image dictionary; pixels are only extracted and
+    decoded when the letter is rendered.
+    """
+    
+    def __init__(self, pdf_bytes, xref, width, height, page_index, brochure_digest=None):
+        self.pdf_bytes = pdf_bytes
+        self.brochure_digest = brochure_digest
+        self.xref = xref
+        self.width = width
+        self.height = height
+        self.page_index = page_index
+        self._image = None
+        self._extracted = None
+    
+    def extract(self):
+        """The embedded image as stored in the PDF: fitz extract_image() dict."""
+        if self._extracted is None:
+            with FITZ_LOCK:
+                doc = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+                try:
+                    self._extracted = doc.extract_image(self.xref)
+                finally:
+                    doc.close()
+        return self._extracted
+    
+    @property
+    def encoded(self):
+        """Original encoded image bytes and their format ('jpeg', 'jpx', 'png', ...)."""
+        extracted = self.extract()
+        return extracted["image"], extracted["ext"]
+    
+    @property
+    def image(self):
+        """Decoded PIL image (decoded once, on first access)."""
+        if self._image is None:
+            self._image = PILImage.open(BytesIO(self.extract()["image"]))
+        return self._image
+    
+    @property
+    def key(self):
+        """Identity of the image across letters and processes."""
+        return f"{self.brochure_digest}:{self.xref}"
+    
+    def save(self, fp, format=None, **params):
+        """Save the decoded image, mirroring PIL.Image.save."""
+        self.image.save(fp, format=format, **params)
+
+# Rendered vector-art clips kept per process (JPEG bytes)
+CLIP_RASTER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Room left around a clipped drawing and the text block it belongs with (points)
+CLIP_MARGIN_PT = 12
+# Highest resolution a clip is rendered at (tiny clips would otherwise render huge)
+MAX_CLIP_DPI = 600
+
+class ClipRasterCache:
+    """
+    Process-wide LRU cache of rasterized brochure regions, keyed by
+    (brochure digest, page, clip, dpi). Eviction is bounded by JPEG size.
+    """
+    
+    def __init__(self, max_bytes=CLIP_RASTER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, render):
+        """JPEG bytes for the key, calling render() for them on a miss."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        
+        data = render()
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries:
+                self._entries[key] = data
+                self.total_bytes += len(data)
+            # Evict least recently used clips, always keeping the newest one
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return data
+    
+    def __len__(self):
+        return len(self._entries)
+
+@st.cache_resource
+def get_clip_raster_cache():
+    """Single ClipRasterCache shared by every session and rerun in this process."""
+    return ClipRasterCache()
+
+def clip_raster_dpi(clip_width, clip_height, target_dpi=None):
+    """DPI at which a clip (points) fills the gallery slot at the gallery image resolution."""
+    target_dpi = target_dpi or GALLERY_IMAGE_DPI
+    draw_width, _ = fit_image_to_box(clip_width, clip_height)
+    # Rounded down: fitz rounds the pixmap size up, and the render must fit the slot as-is
+    dpi = math.floor(target_dpi * draw_width / clip_width)
+    return min(MAX_CLIP_DPI, max(1, dpi))
+
+def rasterize_brochure_clip(pdf_bytes, page_num, clip, dpi):
+    """JPEG of one page region rendered at dpi (vector art included)."""
+    with FITZ_LOCK:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            pixmap = doc[page_num].get_pixmap(dpi=dpi, clip=fitz.Rect(clip), alpha=False)
+            return pixmap.tobytes("jpeg", jpg_quality=GALLERY_JPEG_QUALITY)
+        finally:
+            doc.close()
+
+class BrochureClip:
+    """
+    Lazy handle to a rasterized region of a brochure page, standing in for an
+    embedded image where the page draws its visuals (floor plans) as vectors.
+    Rendered once per (brochure, page, clip, dpi) through the ClipRasterCache
+    (raster_cache, default the process-wide one).
+    """
+    
+    def __init__(self, pdf_bytes, page_index, clip, dpi, brochure_digest, raster_cache=None):
+        self.pdf_bytes = pdf_bytes
+        self.raster_cache = raster_cache
+        self.brochure_digest = brochure_digest
+        self.page_index = page_index
+        self.clip = tuple(round(v, 1) for v in clip)
+        self.dpi = dpi
+        # Pixel size of the render, as fitz rounds it
+        pixels = (fitz.Rect(self.clip) * fitz.Matrix(dpi / 72, dpi / 72)).irect
+        self.width = max(1, pixels.width)
+        self.height = max(1, pixels.height)
+        self._data = None
+        self._image = None
+    
+    @property
+    def key(self):
+        """Identity of the clip across letters and processes."""
+        return f"{self.brochure_digest}:p{self.page_index}:{','.join(map(str, self.clip))}@{self.dpi}"
+    
+    @property
+    def encoded(self):
+        """The rendered JPEG and its format, from the process-wide clip cache (looked up once)."""
+        if self._data is None:
+            raster_cache = get_clip_raster_cache() if self.raster_cache is None else self.raster_cache
+            self._data = raster_cache.get(
+                (self.brochure_digest, self.page_index, self.clip, self.dpi),
+                lambda: rasterize_brochure_clip(self.pdf_bytes, self.page_index, self.clip, self.dpi),
+            )
+        return self._data, 'jpeg'
+    
+    @property
+    def image(self):
+        """Decoded PIL image (decoded once, on first access)."""
+        if self._image is None:
+            self._image = PILImage.open(BytesIO(self.encoded[0]))
+        return self._image
+    
+    def save(self, fp, format=None, **params):
+        """Save the decoded image, mirroring PIL.Image.save."""
+        self.image.save(fp, format=format, **params)
+
+def vector_clip_rect(page, search_term=None):
+    """
+    Clip around a page's vector art (catalog entry): the drawing cluster
+    nearest a text block containing the search term, joined with that block,
+    or the largest cluster when no block matches. None without vector art.
+    """
+    if not page.get('drawings'):
+        return None
+    term = normalize_text(search_term) if search_term else ""
+    matched = [bbox for bbox, text in page['blocks'] if term and term in text]
+    
+    def area(rect):
+        return (rect[2] - rect[0]) * (rect[3] - rect[1])
+    
+    if matched:
+        gap, block, drawing = min(
+            ((rect_distance(d, b), b, d) for d in page['drawings'] for b in matched),
+            key=lambda item: (item[0], -area(item[2])),
+        )
+        clip = fitz.Rect(drawing) | fitz.Rect(block)
+    else:
+        clip = fitz.Rect(max(page['drawings'], key=area))
+    
+    clip = (clip + (-CLIP_MARGIN_PT, -CLIP_MARGIN_PT, CLIP_MARGIN_PT, CLIP_MARGIN_PT)) & fitz.Rect(0, 0, *page['size'])
+    return None if clip.is_empty else tuple(clip)
+
+@instrumented(lambda images, brochure, page_indices, *args, **kwargs: {
+    **measure_brochure(images, brochure), 'pages': len(page_indices)
+}, stage='extract_images_from_pdf_pages')
+def select_gallery_images(brochure, page_indices, max_images=4, search_term=None, raster_cache=None):
+    """
+    The best gallery images on specific pages of a ParsedBrochure: ranked by
+    prominence and closeness to the search term's text, with near-duplicates
+    (same render re-used across pages) dropped. Uses the brochure's cached
+    image catalog, so only pages never seen before are opened. Slots left over
+    are filled with rasterized clips of pages that draw their visuals as
+    vectors. Doesn't touch Streamlit, so it can run on worker threads; errors
+    propagate.
+    """
+    images = []
+    catalog = brochure.image_catalog(page_indices)
+    seen_xrefs = set()
+    kept_hashes = []
+    
+    for _, page_idx, xref, entry in rank_gallery_images(catalog, search_term):
+        if len(images) >= max_images:
+            break
+        if xref in seen_xrefs or is_near_duplicate(entry['dhash'], kept_hashes):
+            continue
+        seen_xrefs.add(xref)
+        if entry['dhash'] is not None:
+            kept_hashes.append(entry['dhash'])
+        images.append(BrochureImage(
+            brochure.pdf_bytes, xref, entry['width'], entry['height'], page_idx, brochure.digest
+        ))
+    
+    for page_idx, page in catalog.items():
+        if len(images) >= max_images:
+            break
+        clip = None if page['images'] else vector_clip_rect(page, search_term)
+        if clip is not None:
+            dpi = clip_raster_dpi(clip[2] - clip[0], clip[3] - clip[1])
+            images.append(BrochureClip(brochure.pdf_bytes, page_idx, clip, dpi, brochure.digest, raster_cache))
+    
+    return images
+
+def extract_images_from_pdf_pages(pdf_bytes, page_indices, max_images=4, search_term=None):
+    """select_gallery_images for script-thread callers: errors are shown and give no images."""
+    try:
+        return select_gallery_images(get_parsed_brochure(pdf_bytes), page_indices, max_images, search_term)
+    except Exception as e:
+        st.error(f"Error extracting images: {e}")
+        return []
+
+@instrumented(measure_brochure)
+def find_pages_in_pdf(pdf_bytes, search_term, limit=4):
+    """Find pages containing search term."""
+    found_pages = []
+    try:
+        brochure = get_parsed_brochure(pdf_bytes)
+        found_pages = brochure.search_pages(search_term, limit)
+    except Exception as e:
+        st.error(f"Error searching PDF: {e}")
+    
+    return found_pages
+
+# --- BROCHURE LIBRARY ---
+
+# Brochures preprocessed once at ingestion and shared by every session
+BROCHURE_LIBRARY_DIR = os.environ.get(
+    "INERTIA_BROCHURE_LIBRARY_DIR",
+    os.path.join(ASSET_CACHE_DIR, "brochures")
+)
+BROCHURE_LIBRARY_MANIFEST = "library.json"
+# Bump when the stored ParsedBrochure changes shape; older entries are re-ingested from their PDF
+BROCHURE_LIBRARY_FORMAT = 3
+BROCHURE_THUMBNAIL_WIDTH = 160
+BROCHURE_THUMBNAIL_QUALITY = 70
+
+def match_dev_names(brochure, dev_names):
+    """Inventory developments whose name appears in the brochure text."""
+    return [name for name in dev_names if name and normalize_text(str(name)) and brochure.search_pages(str(name), limit=1)]
+
+class BrochureLibrary:
+    """
+    On-disk library of preprocessed brochures. Each brochure is ingested once:
+    its ParsedBrochure state (page text, normalized pages and their search
+    index, unit types, the image catalog with perceptual hashes and vector
+    art) is pickled next to the PDF with one JPEG thumbnail per page.
+    library.json maps brochures to inventory Dev Names, so a unit's brochure
+    is picked without anyone uploading it again.
+    """
+    
+    def __init__(self, library_dir=BROCHURE_LIBRARY_DIR, brochure_cache=None):
+        self.library_dir = library_dir
+        self.brochure_cache = brochure_cache
+        self.manifest_path = os.path.join(library_dir, BROCHURE_LIBRARY_MANIFEST)
+        self.last_error = None
+        self._lock = threading.Lock()
+    
+    def brochure_dir(self, digest):
+        return os.path.join(self.library_dir, digest)
+    
+    def thumbnail_path(self, digest, page=0):
+        return os.path.join(self.brochure_dir(digest), "thumbs", f"page-{page + 1:04d}.jpg")
+    
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_manifest(self, manifest):
+        os.makedirs(self.library_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+    
+    def entries(self):
+        """Library entries (digest, file_name, dev_names, pages, ...), newest first."""
+        manifest = self._read_manifest()
+        entries = [dict(entry, digest=digest) for digest, entry in manifest.items()]
+        return sorted(entries, key=lambda entry: entry.get("ingested_at", ""), reverse=True)
+    
+    def find(self, dev_name):
+        """Newest entry mapped to this Dev Name (case and accents ignored), or None."""
+        key = normalize_text(str(dev_name)) if dev_name else ""
+        if not key:
+            return None
+        for entry in self.entries():
+            if any(normalize_text(name) == key for name in entry.get("dev_names", [])):
+                return entry
+        return None
+    
+    def ingest(self, brochure, file_name, dev_names=()):
+        """
+        Store a brochure (PDF bytes or ParsedBrochure) with everything derived
+        from it, mapped to `dev_names`. Returns its entry, or None on failure.
+        """
+        if self.brochure_cache is not None:
+            brochure = self.brochure_cache.get(brochure)
+        elif isinstance(brochure, (bytes, bytearray, memoryview)):
+            brochure = parse_brochure(bytes(brochure), brochure_digest(brochure))
+        
+        entry = {
+            "file_name": os.path.basename(file_name),
+            "dev_names": sorted({str(name).strip() for name in dev_names if str(name).strip()}),
+            "pages": brochure.page_count,
+            "unit_types": brochure.unit_types,
+            "format": BROCHURE_LIBRARY_FORMAT,
+            "ingested_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            try:
+                self._store_brochure(brochure)
+                manifest = self._read_manifest()
+                manifest[brochure.digest] = entry
+                self._write_manifest(manifest)
+            except Exception as e:
+                self.last_error = str(e)
+                return None
+        self.last_error = None
+        return dict(entry, digest=brochure.digest)
+    
+    def _store_brochure(self, brochure):
+        """Write the PDF, the pickled ParsedBrochure and the page thumbnails."""
+        directory = self.brochure_dir(brochure.digest)
+        os.makedirs(os.path.join(directory, "thumbs"), exist_ok=True)
+        with open(os.path.join(directory, "brochure.pdf"), "wb") as f:
+            f.write(brochure.pdf_bytes)
+        
+        tmp_path = os.path.join(directory, "parsed.pickle.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(brochure.to_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(directory, "parsed.pickle"))
+        
+        with FITZ_LOCK:
+            doc = fitz.open(stream=brochure.pdf_bytes, filetype="pdf")
+            try:
+                for page in doc:
+                    scale = BROCHURE_THUMBNAIL_WIDTH / page.rect.width
+                    pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+                    with open(self.thumbnail_path(brochure.digest, page.number), "wb") as f:
+                        f.write(pixmap.tobytes("jpeg", jpg_quality=BROCHURE_THUMBNAIL_QUALITY))
+            finally:
+                doc.close()
+    
+    def load(self, digest):
+        """
+        The stored ParsedBrochure, without parsing the PDF; entries from an
+        older library format are re-ingested from their PDF once. None if missing.
+        """
+        if self.brochure_cache is not None:
+            cached = self.brochure_cache.lookup(digest)
+            if cached is not None:
+                return cached
+        
+        entry = self._read_manifest().get(digest)
+        if entry is None:
+            return None
+        directory = self.brochure_dir(digest)
+        try:
+            if entry.get("format") != BROCHURE_LIBRARY_FORMAT:
+                raise ValueError("stored in an older library format")
+            with open(os.path.join(directory, "parsed.pickle"), "rb") as f:
+                brochure = ParsedBrochure.from_state(pickle.load(f))
+        except Exception:
+            try:
+                with open(os.path.join(directory, "brochure.pdf"), "rb") as f:
+                    pdf_bytes = f.read()
+            except OSError as e:
+                self.last_error = str(e)
+                return None
+            if self.ingest(pdf_bytes, entry["file_name"], entry.get("dev_names", [])) is None:
+                return None
+            if self.brochure_cache is not None:
+                brochure = self.brochure_cache.get(pdf_bytes)
+            else:
+                # Read the fresh pickle once; a library that cannot store it gives up
+                try:
+                    with open(os.path.join(directory, "parsed.pickle"), "rb") as f:
+                        brochure = ParsedBrochure.from_state(pickle.load(f))
+                except Exception as e:
+                    self.last_error = str(e)
+                    return None
+        
+        if self.brochure_cache is not None:
+            self.brochure_cache.add(brochure)
+        return brochure
+    
+    def set_dev_names(self, digest, dev_names):
+        """Replace the Dev Names a stored brochure is used for."""
+        with self._lock:
+            manifest = self._read_manifest()
+            if digest not in manifest:
+                return False
+            manifest[digest]["dev_names"] = sorted({str(name).strip() for name in dev_names if str(name).strip()})
+            self._write_manifest(manifest)
+        return True
+    
+    def remove(self, digest):
+        """Delete a brochure and everything stored for it."""
+        with self._lock:
+            manifest = self._read_manifest()
+            manifest.pop(digest, None)
+            self._write_manifest(manifest)
+            shutil.rmtree(self.brochure_dir(digest), ignore_errors=True)
+
+@st.cache_resource
+def get_brochure_library():
+    """One BrochureLibrary for the whole process, loading into the shared BrochureCache."""
+    return BrochureLibrary(brochure_cache=get_brochure_cache())
+
+# --- GALLERY IMAGE PIPELINE ---
+
+# Gallery slot size and the resolution images are embedded at
+GALLERY_MAX_WIDTH = 3*inch
+GALLERY_MAX_HEIGHT = 2.2*inch
+GALLERY_IMAGE_DPI = 200
+GALLERY_JPEG_QUALITY = 85
+
+# Encoded formats reportlab can embed as-is (DCTDecode stream, no re-encode)
+PASSTHROUGH_IMAGE_FORMATS = ('jpeg', 'jpg')
+PASSTHROUGH_IMAGE_MODES = ('RGB', 'L')
+
+def fit_image_to_box(width, height, max_width=GALLERY_MAX_WIDTH, max_height=GALLERY_MAX_HEIGHT):
+    """Draw size (points) of an image scaled to fit the box, keeping its aspect ratio."""
+    aspect = width / height
+    if aspect > (max_width / max_height):
+        return max_width, max_width / aspect
+    return max_height * aspect, max_height
+
+def encode_gallery_image(img, draw_width, draw_height, target_dpi=GALLERY_IMAGE_DPI):
+    """
+    Encoded bytes for an image drawn at draw_width x draw_height points.
+    Brochure JPEGs that fit the slot at target_dpi are embedded untouched;
+    larger images are downsampled and re-encoded as JPEG (PNG if transparent).
+    """
+    max_size = (
+        max(1, math.ceil(draw_width / 72 * target_dpi)),
+        max(1, math.ceil(draw_height / 72 * target_dpi)),
+    )
+    
+    if hasattr(img, 'encoded'):
+        data, ext = img.encoded
+        pil_image = PILImage.open(BytesIO(data))  # reads the header only
+        fits = pil_image.width <= max_size[0] and pil_image.height <= max_size[1]
+        if ext in PASSTHROUGH_IMAGE_FORMATS and pil_image.mode in PASSTHROUGH_IMAGE_MODES and fits:
+            return data
+        # JPEG decode can scale down by 1/2..1/8 for free
+        pil_image.draft(None, max_size)
+    else:
+        pil_image = img
+    
+    if pil_image.width > max_size[0] or pil_image.height > max_size[1]:
+        pil_image = ImageOps.contain(pil_image, max_size, PILImage.LANCZOS)
+    
+    buffer = BytesIO()
+    has_alpha = pil_image.mode in ('RGBA', 'LA') or 'transparency' in pil_image.info
+    if has_alpha:
+        pil_image.save(buffer, format='PNG')
+    else:
+        if pil_image.mode not in PASSTHROUGH_IMAGE_MODES:
+            pil_image = pil_image.convert('RGB')
+        pil_image.save(buffer, format='JPEG', quality=GALLERY_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+# Threads decoding gallery images while the rest of the letter is built
+GALLERY_ENCODE_WORKERS = 4
+
+def prepare_gallery_image(img, image_dpi=GALLERY_IMAGE_DPI, passthrough_images=True):
+    """(buffer, draw width, draw height) of a gallery image, or None if it can't be encoded."""
+    img_width, img_height = fit_image_to_box(img.width, img.height)
+    # Brochure images are only extracted here, when the letter is rendered
+    try:
+        if passthrough_images:
+            img_buffer = BytesIO(encode_gallery_image(img, img_width, img_height, image_dpi))
+        else:
+            img_buffer = BytesIO()
+            img.save(img_buffer, format='PNG')
+            img_buffer.seek(0)
+    except Exception:
+        return None
+    return img_buffer, img_width, img_height
+
+# Name of the per-document form XObject holding the static letterhead
+LETTERHEAD_FORM_NAME = "InertiaLetterhead"
+
+@st.cache_resource(max_entries=8)
+def get_logo_image_reader(logo_data):
+    """Decoded logo, shared by every page and letter that uses the same logo bytes."""
+    reader = ImageReader(BytesIO(logo_data))
+    reader.getRGBData()  # decode once; ImageReader keeps the pixels
+    return reader
+
+class ProfessionalLetterhead(canvas.Canvas):
+    """
+    Custom canvas for professional letterhead template.
+    The static header/footer is drawn once per document into a form XObject
+    and stamped on each page; only the date and page number are drawn per page.
+    """
+    
+    def __init__(self, *args, logo_bytes=None, customer_data=None, logo_reader=None, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self.logo_bytes = logo_bytes
+        self.logo_reader = logo_reader
+        self.customer_data = customer_data or {}
+        self.pages = 0
+        self.issue_date = datetime.now().strftime("%B %d, %Y")
+        self._letterhead_form_ready = False
+        
+    def showPage(self):
+        self.pages += 1
+        self._add_letterhead()
+        canvas.Canvas.showPage(self)
+        
+    def _logo_reader(self):
+        """Shared decoded logo, or None if there is no usable logo."""
+        if self.logo_reader is not None:
+            return self.logo_reader
+        if not self.logo_bytes:
+            return None
+        try:
+            return get_logo_image_reader(self.logo_bytes.getvalue())
+        except Exception:
+            return None
+        
+    def _add_letterhead(self):
+        """Add header and footer to each page"""
+        if not self._letterhead_form_ready:
+            self.beginForm(LETTERHEAD_FORM_NAME)
+            self._draw_static_letterhead()
+            self.endForm()
+            self._letterhead_form_ready = True
+        
+        self.doForm(LETTERHEAD_FORM_NAME)
+        self._draw_page_details()
+        
+    def _draw_static_letterhead(self):
+        """Everything on the letterhead that is identical on every page."""
+        page_width, page_height = A4
+        
         # --- HEADER ---
         # Decorative top line
         self.setStrokeColor(colors.HexColor("#07141D"))
@@ -539,16 +2489,10 @@ class ProfessionalLetterhead(canvas.Canvas):
         self.setFillColor(colors.HexColor("#07141D"))
         self.drawString(50, page_height - 70, "Sales Director")
         
-        # Date
-        current_date = datetime.now().strftime("%B %d, %Y")
-        self.setFont("Helvetica", 9)
-        self.drawString(50, page_height - 85, current_date)
-        
         # Logo (RIGHT side - swapped with name)
-        if self.logo_bytes:
+        img_reader = self._logo_reader()
+        if img_reader:
             try:
-                self.logo_bytes.seek(0)
-                img_reader = ImageReader(self.logo_bytes)
                 self.drawImage(img_reader, page_width - 200, page_height - 100, 
                              width=1.5*inch, height=0.5*inch, 
                              preserveAspectRatio=True, mask='auto')
@@ -589,15 +2533,282 @@ class ProfessionalLetterhead(canvas.Canvas):
         contacts = "Sales: +20 120 014 0100  |  +20 107 039 9500  |  inquiries@inertiaegypt.com"
         self.drawCentredString(page_width/2, footer_y - 2, contacts)
         
+    def _draw_page_details(self):
+        """Per-page parts of the letterhead: issue date and page number."""
+        page_width, page_height = A4
+        
+        # Date
+        self.setFont("Helvetica", 9)
+        self.setFillColor(colors.HexColor("#07141D"))
+        self.drawString(50, page_height - 85, self.issue_date)
+        
         # Page number
         self.setFont("Helvetica", 7)
-        self.setFillColor(colors.HexColor("#07141D"))
         self.drawCentredString(page_width/2, 35, f"Page {self.pages}")
 
-def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_data):
-    """Generate professional offer letter with enhanced letterhead template"""
+# --- LETTER TEMPLATES ---
+
+class LetterTemplate:
+    """Read-only paragraph and table styles for one offer letter design, built once."""
+    
+    def __init__(self, name, title, subtitle, styles, table_styles):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'title', title)
+        object.__setattr__(self, 'subtitle', subtitle)
+        object.__setattr__(self, 'styles', MappingProxyType(dict(styles)))
+        object.__setattr__(self, 'table_styles', MappingProxyType(dict(table_styles)))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("LetterTemplate is immutable")
+
+def build_letter_template(name, primary="#2A3932", text="#07141D", panel="#F5F7F5",
+                          customer_panel="#F9FCFA", rule="#E5E5E5",
+                          title="PROPERTY RESERVATION", subtitle="Exclusive Investment Opportunity"):
+    """Build every style a letter needs; called once per template at import time."""
+    primary = colors.HexColor(primary)
+    text = colors.HexColor(text)
+    panel = colors.HexColor(panel)
+    customer_panel = colors.HexColor(customer_panel)
+    rule = colors.HexColor(rule)
+    
+    sample = getSampleStyleSheet()
+    
+    # --- CUSTOM STYLES ---
+    styles = {
+        'title': ParagraphStyle(
+            f'{name}-Title',
+            parent=sample['Heading1'],
+            fontSize=24,
+            textColor=primary,
+            spaceAfter=6,
+            alignment=TA_CENTER,
+            fontName='Helvetica-Bold',
+            leading=28
+        ),
+        'subtitle': ParagraphStyle(
+            f'{name}-Subtitle',
+            parent=sample['Normal'],
+            fontSize=12,
+            textColor=text,
+            alignment=TA_CENTER,
+            spaceBefore=3,
+            spaceAfter=20,
+            fontName='Helvetica',
+            leading=16
+        ),
+        'section': ParagraphStyle(
+            f'{name}-Section',
+            parent=sample['Heading2'],
+            fontSize=14,
+            textColor=primary,
+            spaceBefore=18,
+            spaceAfter=10,
+            fontName='Helvetica-Bold',
+            borderWidth=0,
+            borderColor=text,
+            borderPadding=5,
+            backColor=panel
+        ),
+        'body': ParagraphStyle(
+            f'{name}-Body',
+            parent=sample['BodyText'],
+            fontSize=10,
+            leading=14,
+            spaceAfter=8,
+            textColor=text,
+            fontName='Helvetica',
+            alignment=TA_JUSTIFY
+        ),
+    }
+    # Body text carrying on right below a reserved overlay slot
+    styles['body_continued'] = ParagraphStyle(f'{name}-BodyContinued', parent=styles['body'], spaceBefore=0)
+    
+    table_styles = {
+        'customer': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), customer_panel),
+            ('TEXTCOLOR', (0, 0), (0, -1), primary),
+            ('TEXTCOLOR', (1, 0), (1, -1), text),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('PADDING', (0, 0), (-1, -1), 10),
+            ('BOX', (0, 0), (-1, -1), 1.5, text),
+            ('LINEBELOW', (0, 0), (-1, -2), 0.5, rule),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]),
+        'highlight': TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), primary),
+            ('BACKGROUND', (1, 0), (1, -1), colors.white),
+            ('TEXTCOLOR', (0, 0), (0, -1), colors.white),
+            ('TEXTCOLOR', (1, 0), (1, -1), text),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (1, 0), (1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 11),
+            ('PADDING', (0, 0), (-1, -1), 12),
+            ('BOX', (0, 0), (-1, -1), 2, primary),
+            ('LINEBELOW', (0, 0), (-1, -2), 1, rule),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]),
+        'specs': TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), panel),
+            ('BACKGROUND', (1, 0), (1, -1), colors.white),
+            ('TEXTCOLOR', (0, 0), (0, -1), primary),
+            ('TEXTCOLOR', (1, 0), (1, -1), text),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('PADDING', (0, 0), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 0.5, rule),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]),
+        'price': TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), primary),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 14),
+            ('PADDING', (0, 0), (-1, -1), 15),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ]),
+        'gallery': TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 5),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 5),
+        ]),
+    }
+    
+    return LetterTemplate(name, title, subtitle, styles, table_styles)
+
+DEFAULT_LETTER_TEMPLATE = "default"
+
+# Named letter templates
+LETTER_TEMPLATES = MappingProxyType({
+    DEFAULT_LETTER_TEMPLATE: build_letter_template(DEFAULT_LETTER_TEMPLATE),
+})
+
+# Development ('Dev Name', case-insensitive) -> LETTER_TEMPLATES name. Only
+# developments listed here get their own letter; every other unit uses the default.
+DEVELOPMENT_LETTER_TEMPLATES = MappingProxyType({})
+
+def get_letter_template(name=None):
+    """Look up a template by name, falling back to the default."""
+    if isinstance(name, LetterTemplate):
+        return name
+    return LETTER_TEMPLATES.get(name or DEFAULT_LETTER_TEMPLATE, LETTER_TEMPLATES[DEFAULT_LETTER_TEMPLATE])
+
+def get_development_letter_template(dev_name):
+    """The template mapped to a development in DEVELOPMENT_LETTER_TEMPLATES, else the default."""
+    key = str(dev_name).strip().lower() if dev_name else ""
+    return get_letter_template(DEVELOPMENT_LETTER_TEMPLATES.get(key))
+
+def build_customer_table(customer_data, template):
+    """The "Prepared For" box, or None when there is nothing to show."""
+    customer_box_data = []
+    
+    if customer_data.get('name'):
+        customer_box_data.append(['Prepared For:', customer_data['name']])
+    if customer_data.get('mobile'):
+        customer_box_data.append(['Mobile:', customer_data['mobile']])
+    if customer_data.get('email'):
+        customer_box_data.append(['Email:', customer_data['email']])
+    if customer_data.get('request'):
+        customer_box_data.append(['Initial Request:', customer_data['request']])
+    
+    if not customer_box_data:
+        return None
+    customer_table = Table(customer_box_data, colWidths=[1.8*inch, 4*inch])
+    customer_table.setStyle(template.table_styles['customer'])
+    return customer_table
+
+# Rows a customer box can have: name, mobile, email and request
+CUSTOMER_BOX_FIELDS = ('name', 'mobile', 'email', 'request')
+
+@functools.lru_cache(maxsize=None)
+def customer_slot_height(template):
+    """Height of a full customer box in this template: the space a base letter reserves."""
+    full_box = build_customer_table(dict.fromkeys(CUSTOMER_BOX_FIELDS, "X"), template)
+    return full_box.wrap(*A4)[1]
+
+def customer_greeting(customer_data):
+    """Opening line of the letter, addressed to the customer's first name."""
+    customer_first_name = "Valued Client"
+    if customer_data.get('name'):
+        name_parts = customer_data['name'].strip().split()
+        if name_parts:
+            customer_first_name = name_parts[0]
+    return f"Dear {customer_first_name},"
+
+class OverlaySlot(Flowable):
+    """
+    Blank space a base letter keeps for a per-customer overlay; records the
+    page and absolute position it was laid out at in `slots[name]`.
+    """
+    
+    def __init__(self, name, height, slots, space_before=0):
+        Flowable.__init__(self)
+        self.name = name
+        self.height = height
+        self.slots = slots
+        self.spaceBefore = space_before
+    
+    def wrap(self, avail_width, avail_height):
+        self.width = avail_width
+        return self.width, self.height
+    
+    def draw(self):
+        x, y = self.canv.absolutePosition(0, 0)
+        self.slots[self.name] = {
+            'page': self.canv.getPageNumber() - 1,
+            'x': x,
+            'y': y,
+            'width': self.width,
+            'height': self.height,
+        }
+
+def measure_offer_letter(pdf, unit_data, images, logo_bytes, *args, **kwargs):
+    """Letter pages, logo and gallery image bytes in, PDF bytes out."""
+    bytes_in = len(logo_bytes.getvalue()) if logo_bytes else 0
+    bytes_in += sum(len(img.encoded[0]) for img in images or [] if hasattr(img, 'encoded'))
+    return {'pages': len(PDF_PAGE_RE.findall(pdf)), 'bytes_in': bytes_in, 'bytes_out': len(pdf)}
+
+@instrumented(measure_offer_letter)
+def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_data,
+                                       image_dpi=GALLERY_IMAGE_DPI, passthrough_images=True,
+                                       template=None, on_progress=None, slots=None, logo_reader=None):
+    """
+    Generate professional offer letter with enhanced letterhead template.
+    Gallery images are embedded as their original JPEG stream when possible and
+    downsampled to image_dpi for the slot; passthrough_images=False restores the
+    legacy full-resolution PNG re-encode. `template` names a LETTER_TEMPLATES
+    entry (default: the one DEVELOPMENT_LETTER_TEMPLATES maps the unit's
+    development to, else the default template).
+    Gallery images are decoded on worker threads while the other pages are built.
+    `on_progress(stage, done, total)` is called from those threads as each image
+    is ready ('images') and as each page is laid out ('layout', total None).
+    Passing a `slots` dict renders a customer-independent base letter instead:
+    the customer box and greeting are left blank and where they belong is
+    recorded in `slots` (see generate_layered_offer_letter).
+    `logo_reader` is the already decoded logo (see get_logo_image_reader), for
+    callers on worker threads.
+    """
     buffer = BytesIO()
     
+    gallery_pool = None
+    gallery_futures = []
+    if images:
+        gallery_pool = ThreadPoolExecutor(max_workers=min(GALLERY_ENCODE_WORKERS, len(images)),
+                                          thread_name_prefix="gallery-encode")
+        # Each task runs in a copy of this context, so a bound perf log carries over
+        gallery_futures = [
+            gallery_pool.submit(contextvars.copy_context().run, prepare_gallery_image, img, image_dpi, passthrough_images)
+            for img in images
+        ]
+        if on_progress is not None:
+            encoded = iter(range(1, len(gallery_futures) + 1))
+            for future in gallery_futures:
+                future.add_done_callback(lambda _: on_progress('images', next(encoded), len(gallery_futures)))
+    
     doc = SimpleDocTemplate(
         buffer, 
         pagesize=A4, 
@@ -608,93 +2819,33 @@ def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_d
     )
     
     elements = []
-    styles = getSampleStyleSheet()
     
-    # --- CUSTOM STYLES ---
-    style_title = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor("#2A3932"),
-        spaceAfter=6,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold',
-        leading=28
-    )
-    
-    style_subtitle = ParagraphStyle(
-        'Subtitle',
-        parent=styles['Normal'],
-        fontSize=12,
-        textColor=colors.HexColor("#07141D"),
-        alignment=TA_CENTER,
-        spaceBefore=3,
-        spaceAfter=20,
-        fontName='Helvetica',
-        leading=16
-    )
-    
-    style_section = ParagraphStyle(
-        'Section',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor("#2A3932"),
-        spaceBefore=18,
-        spaceAfter=10,
-        fontName='Helvetica-Bold',
-        borderWidth=0,
-        borderColor=colors.HexColor("#07141D"),
-        borderPadding=5,
-        backColor=colors.HexColor("#F5F7F5")
-    )
-    
-    style_body = ParagraphStyle(
-        'Body',
-        parent=styles['BodyText'],
-        fontSize=10,
-        leading=14,
-        spaceAfter=8,
-        textColor=colors.HexColor("#07141D"),
-        fontName='Helvetica',
-        alignment=TA_JUSTIFY
-    )
+    # Styles come pre-built from the template registry; the letter supplies only data
+    if template is None:
+        template = get_development_letter_template(unit_data.get('Dev Name'))
+    template = get_letter_template(template)
+    style_title = template.styles['title']
+    style_subtitle = template.styles['subtitle']
+    style_section = template.styles['section']
+    style_body = template.styles['body']
     
     # ==================== PAGE 1: COVER & CUSTOMER INFO ====================
     
     elements.append(Spacer(1, 0.3*inch))
     
-    elements.append(Paragraph("PROPERTY RESERVATION", style_title))
-    elements.append(Paragraph("Exclusive Investment Opportunity", style_subtitle))
+    elements.append(Paragraph(template.title, style_title))
+    elements.append(Paragraph(template.subtitle, style_subtitle))
     
     elements.append(Spacer(1, 0.4*inch))
     
     # Customer Information Box
-    if any(customer_data.values()):
-        customer_box_data = []
-        
-        if customer_data.get('name'):
-            customer_box_data.append(['Prepared For:', customer_data['name']])
-        if customer_data.get('mobile'):
-            customer_box_data.append(['Mobile:', customer_data['mobile']])
-        if customer_data.get('email'):
-            customer_box_data.append(['Email:', customer_data['email']])
-        if customer_data.get('request'):
-            customer_box_data.append(['Initial Request:', customer_data['request']])
-        
-        if customer_box_data:
-            customer_table = Table(customer_box_data, colWidths=[1.8*inch, 4*inch])
-            customer_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F9FCFA')),
-                ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#2A3932')),
-                ('TEXTCOLOR', (1, 0), (1, -1), colors.HexColor('#07141D')),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('PADDING', (0, 0), (-1, -1), 10),
-                ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#07141D')),
-                ('LINEBELOW', (0, 0), (-1, -2), 0.5, colors.HexColor('#E5E5E5')),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
+    if slots is not None:
+        # Room for a full box, filled in per customer by the overlay
+        elements.append(OverlaySlot('customer', customer_slot_height(template), slots))
+        elements.append(Spacer(1, 0.3*inch))
+    elif any(customer_data.values()):
+        customer_table = build_customer_table(customer_data, template)
+        if customer_table is not None:
             elements.append(customer_table)
             elements.append(Spacer(1, 0.3*inch))
     
@@ -707,39 +2858,25 @@ def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_d
     ]
     
     highlight_table = Table(highlight_data, colWidths=[2*inch, 3.8*inch])
-    highlight_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#2A3932')),
-        ('BACKGROUND', (1, 0), (1, -1), colors.white),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.white),
-        ('TEXTCOLOR', (1, 0), (1, -1), colors.HexColor('#07141D')),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('PADDING', (0, 0), (-1, -1), 12),
-        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#2A3932')),
-        ('LINEBELOW', (0, 0), (-1, -2), 1, colors.HexColor('#E5E5E5')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
+    highlight_table.setStyle(template.table_styles['highlight'])
     
     elements.append(highlight_table)
     elements.append(Spacer(1, 0.5*inch))
     
     # Personalized Introduction with customer's first name
-    customer_first_name = "Valued Client"
-    if customer_data.get('name'):
-        name_parts = customer_data['name'].strip().split()
-        if name_parts:
-            customer_first_name = name_parts[0]
-    
     intro_text = f"""
-    Dear {customer_first_name},<br/><br/>
     We are pleased to present this exclusive reservation offer for a premium property 
     at <b>{unit_data.get('Dev Name', 'N/A')}</b>. This document outlines the complete 
     specifications, pricing, and terms for your consideration.<br/><br/>
     Inertia Egypt continues to redefine luxury living through thoughtfully designed 
     communities that blend natural beauty with modern convenience.
     """
-    elements.append(Paragraph(intro_text, style_body))
+    if slots is not None:
+        # The greeting line and the blank line after it come from the overlay
+        elements.append(OverlaySlot('greeting', 2 * style_body.leading, slots, style_body.spaceBefore))
+        elements.append(Paragraph(intro_text, template.styles['body_continued']))
+    else:
+        elements.append(Paragraph(f"{customer_greeting(customer_data)}<br/><br/>{intro_text}", style_body))
     
     elements.append(PageBreak())
     
@@ -762,18 +2899,7 @@ def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_d
     ]
     
     specs_table = Table(specs_data, colWidths=[2.5*inch, 3.3*inch])
-    specs_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F5F7F5')),
-        ('BACKGROUND', (1, 0), (1, -1), colors.white),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#2A3932')),
-        ('TEXTCOLOR', (1, 0), (1, -1), colors.HexColor('#07141D')),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('PADDING', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E5E5E5')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
+    specs_table.setStyle(template.table_styles['specs'])
     
     elements.append(specs_table)
     elements.append(Spacer(1, 0.3*inch))
@@ -787,15 +2913,7 @@ def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_d
     ]
     
     price_table = Table(price_data, colWidths=[2.5*inch, 3.3*inch])
-    price_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#2A3932')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 14),
-        ('PADDING', (0, 0), (-1, -1), 15),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-    ]))
+    price_table.setStyle(template.table_styles['price'])
     
     elements.append(price_table)
     elements.append(Spacer(1, 0.3*inch))
@@ -810,115 +2928,1184 @@ def generate_professional_offer_letter(unit_data, images, logo_bytes, customer_d
     <b>• Additional Costs:</b> Registration fees and applicable taxes apply
     """.format(delivery=unit_data.get('Delivery Date', 'TBD'))
     
-    elements.append(Paragraph(payment_terms, style_body))
-    elements.append(Spacer(1, 0.2*inch))
+    elements.append(Paragraph(payment_terms, style_body))
+    elements.append(Spacer(1, 0.2*inch))
+    
+    # Validity Notice
+    validity_box = Paragraph(
+        "<i>This offer remains valid for 14 calendar days from the date of issue. "
+        "Unit availability is subject to confirmation at time of reservation.</i>",
+        style_body
+    )
+    elements.append(validity_box)
+    
+    # ==================== PAGE 3: PROPERTY VISUALS (only if images exist) ====================
+    if gallery_futures:
+        elements.append(PageBreak())
+        elements.append(Paragraph("PROPERTY GALLERY", style_section))
+        elements.append(Spacer(1, 0.3*inch))
+        
+        # Display images in 2-column grid, in brochure order whatever order they finish in
+        for i in range(0, len(gallery_futures), 2):
+            image_elements = []
+            
+            for future in gallery_futures[i:i+2]:
+                prepared = future.result()
+                if prepared is None:
+                    continue
+                img_buffer, img_width, img_height = prepared
+                image_elements.append(Image(img_buffer, width=img_width, height=img_height))
+            
+            if len(image_elements) == 2:
+                img_table = Table([image_elements], colWidths=[3.2*inch, 3.2*inch])
+                img_table.setStyle(template.table_styles['gallery'])
+                elements.append(img_table)
+            else:
+                for img_elem in image_elements:
+                    elements.append(img_elem)
+            
+            elements.append(Spacer(1, 0.25*inch))
+        
+        gallery_pool.shutdown()
+    
+    # Build PDF with custom canvas
+    def create_canvas(*args, **kwargs):
+        return ProfessionalLetterhead(*args, logo_bytes=logo_bytes, 
+                                     customer_data=customer_data, logo_reader=logo_reader, **kwargs)
+    
+    def report_page(canvas, doc):
+        if on_progress is not None:
+            on_progress('layout', doc.page, None)
+    
+    doc.build(elements, onFirstPage=report_page, onLaterPages=report_page, canvasmaker=create_canvas)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+# --- BROCHURE PAGE ATTACHMENTS ---
+
+# Page keys left behind: link annotations and article beads point at other
+# brochure pages, and following them would copy most of the brochure along
+ATTACHED_PAGE_EXCLUDED_KEYS = ("/Annots", "/B")
+
+@instrumented(lambda pdf, letter_pdf, brochure_pdf, page_indices: {
+    'pages': len(page_indices), 'bytes_in': len(letter_pdf), 'bytes_out': len(pdf)
+})
+def attach_brochure_pages(letter_pdf, brochure_pdf, page_indices):
+    """
+    The letter with the given brochure pages (raw bytes or ParsedBrochure)
+    appended verbatim. Pages are imported object by object: content streams and
+    images are copied as stored, never decoded, rasterized or re-encoded, and
+    resources the attached pages share are written once.
+    """
+    brochure_pdf = getattr(brochure_pdf, 'pdf_bytes', brochure_pdf)
+    writer = PdfWriter()
+    for page in PdfReader(BytesIO(letter_pdf)).pages:
+        writer.add_page(page)
+    
+    brochure = PdfReader(BytesIO(brochure_pdf))
+    for page_index in page_indices:
+        if page_index < len(brochure.pages):
+            writer.add_page(brochure.pages[page_index], excluded_keys=ATTACHED_PAGE_EXCLUDED_KEYS)
+    
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+# --- LAYERED LETTERS ---
+
+# Base letters kept per process (each entry is one rendered letter PDF)
+BASE_LETTER_CACHE_MAX_ENTRIES = 64
+
+def gallery_image_key(img):
+    """Identity of a gallery image: its brochure key (digest and xref or clip), or a hash of the pixels."""
+    if getattr(img, 'brochure_digest', None):
+        return img.key
+    return hashlib.sha256(img.tobytes()).hexdigest()
+
+def base_letter_key(unit_data, images, logo_bytes, template, brochure=None, attached_pages=()):
+    """
+    Cache key of a base letter: everything it is rendered from except the
+    customer. The issue date is part of it, so bases never outlive their day.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(unit_data, sort_keys=True, default=str).encode('utf-8'))
+    for img in images or []:
+        digest.update(gallery_image_key(img).encode('ascii'))
+    if logo_bytes:
+        digest.update(logo_bytes.getvalue())
+    digest.update(json.dumps([
+        template.name,
+        getattr(brochure, 'digest', None),
+        list(attached_pages),
+        datetime.now().strftime("%Y-%m-%d"),
+    ]).encode('utf-8'))
+    return digest.hexdigest()
+
+class BaseLetterCache:
+    """
+    Process-wide LRU cache of base letters (pdf, overlay slots) by
+    base_letter_key, so a campaign renders each unit's letter once.
+    """
+    
+    def __init__(self, max_entries=BASE_LETTER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, render):
+        """(pdf, slots) for the key, calling render() for them on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        
+        entry = render()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+    
+    def __len__(self):
+        return len(self._entries)
+
+def render_customer_overlay(slots, customer_data, template):
+    """
+    One-page PDF with the customer box and greeting drawn where the base letter
+    reserved them, or None if either would not fit its slot.
+    """
+    if slots['greeting']['page'] != slots['customer']['page']:
+        return None
+    
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    layers = [
+        ('customer', build_customer_table(customer_data, template)),
+        ('greeting', Paragraph(customer_greeting(customer_data), template.styles['body'])),
+    ]
+    for name, flowable in layers:
+        if flowable is None:
+            continue
+        slot = slots[name]
+        width, height = flowable.wrapOn(c, slot['width'], slot['height'])
+        if height > slot['height'] + 0.01:
+            return None
+        # Tables are centered in the frame, paragraphs span it
+        x = slot['x'] + (slot['width'] - width) / 2 if isinstance(flowable, Table) else slot['x']
+        flowable.drawOn(c, x, slot['y'] + slot['height'] - height)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+def merge_customer_overlay(base_pdf, overlay_pdf, page_index):
+    """
+    The base letter with the overlay page stamped onto page `page_index` as a
+    form XObject. MuPDF does this without parsing either page's content
+    stream, which PyPDF2's merge_page spends most of its time on.
+    """
+    with FITZ_LOCK:
+        doc = fitz.open(stream=base_pdf, filetype="pdf")
+        overlay = fitz.open(stream=overlay_pdf, filetype="pdf")
+        try:
+            page = doc[page_index]
+            page.show_pdf_page(page.rect, overlay, 0)
+            return doc.tobytes()
+        finally:
+            overlay.close()
+            doc.close()
+
+@instrumented(lambda pdf, *args, **kwargs: {'bytes_out': len(pdf)})
+def generate_layered_offer_letter(unit_data, images, logo_bytes, customer_data, base_cache,
+                                  template=None, brochure=None, attached_pages=()):
+    """
+    Offer letter as a cached customer-independent base plus a one-page customer
+    overlay (the "Prepared For" box and the greeting), for campaigns sending one
+    unit to many customers. The base is rendered once per base_letter_key with
+    the box's full height reserved; each recipient then costs a tiny overlay and
+    a single page merge. `attached_pages` of `brochure` are appended to the base
+    (attach_brochure_pages). Customers whose box or greeting would not fit get a
+    fully rendered letter instead.
+    """
+    if template is None:
+        template = get_development_letter_template(unit_data.get('Dev Name'))
+    template = get_letter_template(template)
+    
+    def render_base():
+        slots = {}
+        base_pdf = generate_professional_offer_letter(
+            unit_data, images, logo_bytes, {}, template=template, slots=slots
+        )
+        if attached_pages:
+            base_pdf = attach_brochure_pages(base_pdf, brochure, attached_pages)
+        return base_pdf, slots
+    
+    key = base_letter_key(unit_data, images, logo_bytes, template, brochure, attached_pages)
+    base_pdf, slots = base_cache.get(key, render_base)
+    
+    overlay_pdf = render_customer_overlay(slots, customer_data, template)
+    if overlay_pdf is None:
+        pdf = generate_professional_offer_letter(unit_data, images, logo_bytes, customer_data, template=template)
+        if attached_pages:
+            pdf = attach_brochure_pages(pdf, brochure, attached_pages)
+        return pdf
+    return merge_customer_overlay(base_pdf, overlay_pdf, slots['customer']['page'])
+
+# --- GENERATION PIPELINE ---
+
+# Share of the progress bar per stage (branding and the page search run side by side)
+PIPELINE_STAGE_WEIGHTS = {'branding': 0.1, 'search': 0.2, 'images': 0.25, 'layout': 0.35, 'attach': 0.1}
+PIPELINE_STAGE_MESSAGES = {
+    'branding': "📥 Loading company branding...",
+    'search': "🔍 Locating '{search_term}' in brochure...",
+    'images': "🖼️ Preparing property visuals ({done}/{total})...",
+    'layout': "📝 Laying out page {done}...",
+    'attach': "📎 Attaching {total} brochure pages...",
+}
+# Pages a letter with a gallery usually has; layout progress before the page count is known
+PIPELINE_EXPECTED_PAGES = 3
+# How often the script thread wakes while waiting for worker events (seconds)
+PIPELINE_POLL_SECONDS = 0.05
+
+def offer_letter_pipeline(unit_data, customer_data, pdf_bytes, search_term,
+                          branding_cache, brochure_cache, clip_raster_cache, perf_log,
+                          logo_image_reader, max_images=4, template=None, attach_pages=False):
+    """
+    Generate an offer letter on worker threads, yielding progress events as the
+    stages report them: the logo fetch and brochure page search run concurrently,
+    then the letter is built while its gallery images decode. `pdf_bytes` may
+    also be a ParsedBrochure (e.g. from the library). With attach_pages
+    the matched brochure pages are appended verbatim instead of a gallery.
+    Events are dicts with 'stage', 'done', 'total', 'progress' (0..1 overall) and
+    'message'. The 'search' event that finishes the stage carries 'pages' and
+    'images' (or 'error'); the last event has stage 'done', 'pdf', 'attached'
+    (pages appended) and 'logo' (False when no logo was available). Letter
+    errors propagate to the caller.
+    Caches, the perf log and the logo decoder (get_logo_image_reader) are
+    passed in because worker threads must not touch Streamlit: the logo is
+    decoded here, on the caller's thread, between stages.
+    """
+    events = queue.Queue()
+    fractions = dict.fromkeys(PIPELINE_STAGE_WEIGHTS, 0.0)
+    
+    def report(stage, done, total, **extra):
+        events.put((stage, done, total, extra))
+    
+    def make_event(stage, done, total, extra):
+        if total is None:
+            fraction = min(1.0, done / PIPELINE_EXPECTED_PAGES)
+        else:
+            fraction = done / total if total else 1.0
+        # Image callbacks can arrive out of order; progress never goes backwards
+        fractions[stage] = max(fractions[stage], fraction)
+        return {
+            'stage': stage,
+            'done': done,
+            'total': total,
+            'progress': min(1.0, sum(PIPELINE_STAGE_WEIGHTS[s] * f for s, f in fractions.items())),
+            'message': PIPELINE_STAGE_MESSAGES[stage].format(done=done, total=total, search_term=search_term),
+            **extra,
+        }
+    
+    def drain(futures):
+        """Yield queued events until every future has finished and the queue is empty."""
+        pending = list(futures)
+        while pending or not events.empty():
+            try:
+                yield make_event(*events.get(timeout=PIPELINE_POLL_SECONDS))
+            except queue.Empty:
+                pass
+            pending = [f for f in pending if not f.done()]
     
-    # Validity Notice
-    validity_box = Paragraph(
-        "<i>This offer remains valid for 14 calendar days from the date of issue. "
-        "Unit availability is subject to confirmation at time of reservation.</i>",
-        style_body
-    )
-    elements.append(validity_box)
+    def fetch_logo():
+        with perf_stage('download_logo') as record:
+            content = branding_cache.get()
+            record['bytes_out'] = len(content) if content else 0
+        report('branding', 1, 1)
+        return content
     
-    # ==================== PAGE 3: PROPERTY VISUALS (only if images exist) ====================
-    if images and len(images) > 0:
-        elements.append(PageBreak())
-        elements.append(Paragraph("PROPERTY GALLERY", style_section))
-        elements.append(Spacer(1, 0.3*inch))
+    def find_images():
+        """(brochure, matched pages, gallery images) for the search term."""
+        if not search_term:
+            report('search', 1, 1, pages=0, images=0)
+            return None, [], []
+        report('search', 0, 1)
+        try:
+            with perf_stage('find_pages_in_pdf') as record:
+                brochure = brochure_cache.get(pdf_bytes)
+                found_pages = brochure.search_pages(search_term, limit=4)
+                record.update(pages=brochure.page_count, bytes_in=len(brochure.pdf_bytes))
+            images = []
+            if found_pages and not attach_pages:
+                images = select_gallery_images(brochure, found_pages, max_images, search_term, clip_raster_cache)
+        except Exception as e:
+            # A letter without a gallery is still worth sending
+            report('search', 1, 1, error=str(e))
+            return None, [], []
+        report('search', 1, 1, pages=len(found_pages), images=len(images))
+        return brochure, found_pages, images
+    
+    def submit(pool, func, *args, **kwargs):
+        return pool.submit(with_perf_log(perf_log, func), *args, **kwargs)
+    
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="offer-pipeline") as pool:
+        logo_future = submit(pool, fetch_logo)
+        images_future = submit(pool, find_images)
+        yield from drain([logo_future, images_future])
         
-        # Display images in 2-column grid
-        for i in range(0, len(images), 2):
-            row_images = images[i:i+2]
-            image_elements = []
-            
-            for img in row_images:
-                max_width = 3*inch
-                max_height = 2.2*inch
-                
-                aspect = img.width / img.height
-                if aspect > (max_width / max_height):
-                    img_width = max_width
-                    img_height = max_width / aspect
-                else:
-                    img_height = max_height
-                    img_width = max_height * aspect
-                
-                img_buffer = BytesIO()
-                img.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                
-                image_elements.append(Image(img_buffer, width=img_width, height=img_height))
-            
-            if len(image_elements) == 2:
-                img_table = Table([image_elements], colWidths=[3.2*inch, 3.2*inch])
-                img_table.setStyle(TableStyle([
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 5),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-                ]))
-                elements.append(img_table)
-            else:
-                for img_elem in image_elements:
-                    elements.append(img_elem)
-            
-            elements.append(Spacer(1, 0.25*inch))
+        logo_content = logo_future.result()
+        logo_reader = None
+        if logo_content:
+            try:
+                logo_reader = logo_image_reader(logo_content)
+            except Exception:
+                pass  # the letterhead is drawn without a logo
+        brochure, found_pages, images = images_future.result()
+        attached_pages = found_pages if attach_pages else []
+        if not images:
+            fractions['images'] = 1.0
+        if not attached_pages:
+            fractions['attach'] = 1.0
+        
+        letter_future = submit(
+            pool, generate_professional_offer_letter, unit_data, images,
+            BytesIO(logo_content) if logo_content else None, customer_data,
+            template=template, on_progress=report, logo_reader=logo_reader,
+        )
+        yield from drain([letter_future])
+        final_pdf = letter_future.result()
+        
+        if attached_pages:
+            report('attach', 0, len(attached_pages))
+            attach_future = submit(pool, attach_brochure_pages, final_pdf, brochure, attached_pages)
+            yield from drain([attach_future])
+            final_pdf = attach_future.result()
     
-    # Build PDF with custom canvas
-    def create_canvas(*args, **kwargs):
-        return ProfessionalLetterhead(*args, logo_bytes=logo_bytes, 
-                                     customer_data=customer_data, **kwargs)
+    yield {
+        'stage': 'done',
+        'done': 1,
+        'total': 1,
+        'progress': 1.0,
+        'message': "✅ Complete!",
+        'pdf': final_pdf,
+        'attached': len(attached_pages),
+        'logo': logo_content is not None,
+    }
+
+# --- INVENTORY LOADING ---
+
+# Columns the app reads from the inventory, with their load-time types
+INVENTORY_CATEGORY_COLUMNS = ['Dev Name', 'Status', 'Type']
+INVENTORY_TEXT_COLUMNS = ['Unit Number', 'Type 4', 'Floor', 'Maid Room', 'Delivery Date']
+INVENTORY_NUMERIC_COLUMNS = ['No.Bedrooms', 'BUA with Terraces', 'Garden', 'Final Price']
+INVENTORY_COLUMNS = INVENTORY_CATEGORY_COLUMNS + INVENTORY_TEXT_COLUMNS + INVENTORY_NUMERIC_COLUMNS
+
+# Leading bytes inspected to pick the CSV encoding and header
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+def sniff_encoding(sample):
+    """Pick a CSV encoding from a leading byte sample (BOM, then UTF-8, else latin-1)."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # Incremental decode: a multi-byte character cut at the sample end is fine
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def sniff_csv_header(sample, encoding):
+    """Raw (unstripped) column names from the first CSV record in the sample."""
+    text = sample.decode(encoding, errors='ignore')
+    return next(csv.reader(io.StringIO(text)), [])
+
+def inventory_usecols(columns):
+    """Raw column names the app uses; None (read everything) if none are recognised."""
+    wanted = [c for c in columns if str(c).strip() in INVENTORY_COLUMNS]
+    return wanted or None
+
+def read_inventory_csv_pyarrow(file, encoding, usecols):
+    """Multi-threaded, block-streaming CSV read with an explicit column schema."""
+    column_types = {}
+    for column in usecols or []:
+        name = column.strip()
+        if name in INVENTORY_CATEGORY_COLUMNS:
+            column_types[column] = pa.dictionary(pa.int32(), pa.string())
+        elif name in INVENTORY_TEXT_COLUMNS:
+            column_types[column] = pa.string()
     
-    doc.build(elements, canvasmaker=create_canvas)
-    buffer.seek(0)
-    return buffer.getvalue()
+    table = pa_csv.read_csv(
+        file,
+        # pyarrow skips a UTF-8 BOM by itself
+        read_options=pa_csv.ReadOptions(encoding='utf8' if encoding == 'utf-8-sig' else encoding),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=usecols,
+            column_types=column_types,
+            strings_can_be_null=True,
+        ),
+    )
+    return table.to_pandas()
+
+def read_inventory_csv_pandas(file, encoding, usecols):
+    """pandas C-engine CSV read with the same schema (fallback when pyarrow is unavailable)."""
+    dtype = {}
+    for column in usecols or []:
+        name = column.strip()
+        if name in INVENTORY_CATEGORY_COLUMNS:
+            dtype[column] = 'category'
+        elif name in INVENTORY_TEXT_COLUMNS:
+            dtype[column] = str
+    return pd.read_csv(file, encoding=encoding, usecols=usecols, dtype=dtype or None)
+
+def coerce_numeric_columns(df):
+    """Make numeric-schema columns numeric when every value parses; otherwise leave them as read."""
+    for column in INVENTORY_NUMERIC_COLUMNS:
+        series = single_column(df, column)
+        if series is None or pd.api.types.is_numeric_dtype(series):
+            continue
+        converted = pd.to_numeric(series, errors='coerce')
+        if converted.notna().sum() == series.notna().sum():
+            df[column] = converted
+    return df
 
+def categorize_columns(df):
+    """Store low-cardinality text columns (dev name, status, type) as categoricals."""
+    for column in INVENTORY_CATEGORY_COLUMNS:
+        series = single_column(df, column)
+        if series is not None and not isinstance(series.dtype, pd.CategoricalDtype):
+            df[column] = series.astype('category')
+    return df
+
+def excel_engines(file_ext):
+    """Excel readers to try, fastest first: calamine if installed, then openpyxl/xlrd."""
+    engines = ['calamine'] if importlib.util.find_spec('python_calamine') is not None else []
+    engines.append('openpyxl' if file_ext == '.xlsx' else None)
+    return engines
+
+def read_inventory_excel(file, engine):
+    """Read only the inventory columns from an Excel sheet (all columns if none match)."""
+    file.seek(0)
+    df = pd.read_excel(file, engine=engine, usecols=lambda c: str(c).strip() in INVENTORY_COLUMNS)
+    if df.columns.empty:
+        # Unrecognised layout: keep every column
+        file.seek(0)
+        df = pd.read_excel(file, engine=engine)
+    return df
+
+@instrumented(lambda df, file: {
+    'bytes_in': file_size(file),
+    'bytes_out': df.attrs['load_stats']['memory_bytes'] if df is not None else None,
+})
 def load_inventory_data(file):
-    """Load inventory data from CSV or Excel file."""
+    """
+    Load inventory data from CSV or Excel file.
+    Only the columns the app uses are read, with an explicit schema; load
+    time and memory are recorded in df.attrs['load_stats'].
+    """
     try:
+        start = time.perf_counter()
         file_name = file.name
         file_ext = os.path.splitext(file_name)[1].lower()
         file.seek(0)
+        stats = {'file_name': os.path.basename(file_name)}
         
         if file_ext in ['.xlsx', '.xls']:
             try:
-                df = pd.read_excel(file, engine='openpyxl' if file_ext == '.xlsx' else None)
+                engines = excel_engines(file_ext)
+                for engine in engines:
+                    try:
+                        df = read_inventory_excel(file, engine)
+                        break
+                    except Exception:
+                        if engine == engines[-1]:
+                            raise
                 df.columns = df.columns.str.strip()
-                return df
+                df = categorize_columns(df)
+                stats['engine'] = engine or 'default'
             except Exception as e:
                 st.error(f"Error reading Excel file: {e}")
                 return None
         
         elif file_ext == '.csv':
-            encodings_to_try = ['utf-8-sig', 'utf-8', 'latin-1', 'cp1252']
+            sample = file.read(ENCODING_SAMPLE_BYTES)
+            file.seek(0)
+            encoding = sniff_encoding(sample)
+            usecols = inventory_usecols(sniff_csv_header(sample, encoding))
             
-            for encoding in encodings_to_try:
+            df = None
+            readers = [('pyarrow', read_inventory_csv_pyarrow)] if pa_csv is not None else []
+            readers.append(('c', read_inventory_csv_pandas))
+            for engine, reader in readers:
                 try:
                     file.seek(0)
-                    df = pd.read_csv(file, encoding=encoding)
-                    df.columns = df.columns.str.strip()
-                    return df
-                except (UnicodeDecodeError, pd.errors.EmptyDataError):
+                    df = reader(file, encoding, usecols)
+                    break
+                except Exception:
                     continue
             
-            st.error("Could not read CSV file with any standard encoding.")
-            return None
+            if df is None and encoding != 'latin-1':
+                # Non-UTF-8 bytes beyond the sample: latin-1 decodes anything
+                try:
+                    file.seek(0)
+                    encoding, engine = 'latin-1', 'c'
+                    df = read_inventory_csv_pandas(file, encoding, usecols)
+                except Exception:
+                    df = None
+            
+            if df is None:
+                st.error("Could not read CSV file with any standard encoding.")
+                return None
+            
+            df.columns = df.columns.str.strip()
+            df = categorize_columns(df)
+            stats.update(engine=engine, encoding=encoding)
         
         else:
             st.error(f"Unsupported file format: {file_ext}")
             return None
         
+        df = coerce_numeric_columns(df)
+        stats.update(
+            rows=len(df),
+            columns=len(df.columns),
+            seconds=time.perf_counter() - start,
+            memory_bytes=int(df.memory_usage(deep=True).sum()),
+        )
+        df.attrs['load_stats'] = stats
+        return df
+        
     except Exception as e:
         st.error(f"Error loading file: {e}")
         return None
 
+# --- INVENTORY SNAPSHOTS ---
+
+# Columnar copies of the last loaded inventory, shared by every session
+INVENTORY_SNAPSHOT_DIR = os.environ.get(
+    "INERTIA_INVENTORY_SNAPSHOT_DIR",
+    os.path.join(ASSET_CACHE_DIR, "inventory")
+)
+INVENTORY_SNAPSHOT_MANIFEST = "latest.json"
+INVENTORY_SNAPSHOT_KEEP = 2
+
+def file_digest(file):
+    """SHA-256 of an uploaded file's contents; the file is left at position 0."""
+    file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+def arrow_compatible_frame(df):
+    """
+    Copy of df that Arrow can store: object columns mixing types (e.g. unit
+    numbers read from Excel as both ints and strings) keep their missing
+    values and have every other value stored as str.
+    """
+    converted = {}
+    for column in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            series = df[column]
+            converted[column] = series.where(series.isna(), series.astype(str))
+    return df.assign(**converted) if converted else df
+
+class InventorySnapshotStore:
+    """
+    Normalized inventory frames persisted as uncompressed Feather (Arrow IPC)
+    files, so new sessions memory-map the latest snapshot instead of parsing
+    the source spreadsheet again. latest.json names the current version.
+    """
+    
+    def __init__(self, snapshot_dir=INVENTORY_SNAPSHOT_DIR, keep=INVENTORY_SNAPSHOT_KEEP):
+        self.snapshot_dir = snapshot_dir
+        self.keep = keep
+        self.manifest_path = os.path.join(snapshot_dir, INVENTORY_SNAPSHOT_MANIFEST)
+        self.last_error = None
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self):
+        return pa_feather is not None
+    
+    def snapshot_path(self, version):
+        return os.path.join(self.snapshot_dir, f"inventory-{version}.feather")
+    
+    def latest(self):
+        """Manifest of the current snapshot, or None if there is no usable one."""
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.snapshot_path(manifest.get("version", ""))):
+            return None
+        return manifest
+    
+    def load(self):
+        """The latest snapshot as a DataFrame, or None. Reads through a memory map."""
+        manifest = self.latest()
+        if manifest is None or not self.enabled:
+            return None
+        try:
+            start = time.perf_counter()
+            table = pa_feather.read_table(self.snapshot_path(manifest["version"]), memory_map=True)
+            df = table.to_pandas(split_blocks=True)
+        except Exception as e:
+            self.last_error = str(e)
+            return None
+        
+        stats = dict(manifest.get("load_stats", {}))
+        stats.update(
+            engine="snapshot",
+            seconds=time.perf_counter() - start,
+            memory_bytes=int(df.memory_usage(deep=True).sum()),
+        )
+        df.attrs["load_stats"] = stats
+        df.attrs["snapshot"] = manifest
+        return df
+    
+    def save(self, df, source_digest=None):
+        """Store df as a new snapshot version and make it the latest; returns the manifest (None on failure)."""
+        if not self.enabled:
+            return None
+        created = datetime.now()
+        version = f"{created:%Y%m%d-%H%M%S}-{(source_digest or os.urandom(8).hex())[:8]}"
+        manifest = {
+            "version": version,
+            "created_at": created.isoformat(timespec="seconds"),
+            "source_digest": source_digest,
+            "rows": len(df),
+            "columns": len(df.columns),
+            "load_stats": df.attrs.get("load_stats", {}),
+        }
+        
+        with self._lock:
+            try:
+                os.makedirs(self.snapshot_dir, exist_ok=True)
+                path = self.snapshot_path(version)
+                # Uncompressed, so readers map the columns straight from the page cache
+                pa_feather.write_feather(arrow_compatible_frame(df), path + ".tmp", compression="uncompressed")
+                os.replace(path + ".tmp", path)
+                
+                tmp_path = self.manifest_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(manifest, f)
+                os.replace(tmp_path, self.manifest_path)
+            except Exception as e:
+                self.last_error = str(e)
+                return None
+            self._prune(path)
+        
+        self.last_error = None
+        return manifest
+    
+    def _prune(self, current_path):
+        """Delete all but the newest `keep` snapshot files (never the current one)."""
+        try:
+            paths = [
+                os.path.join(self.snapshot_dir, name) for name in os.listdir(self.snapshot_dir)
+                if name.startswith("inventory-") and name.endswith(".feather")
+            ]
+            paths.sort(key=os.path.getmtime)
+        except OSError:
+            return
+        paths.remove(current_path)
+        for path in paths[:max(len(paths) - self.keep + 1, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped by a session on a platform that forbids unlinking
+                pass
+
+@st.cache_resource
+def get_inventory_snapshot_store():
+    """One InventorySnapshotStore for the whole process."""
+    return InventorySnapshotStore()
+
+# --- INVENTORY INDEX ---
+
+def parse_price_value(value):
+    """Parse a price cell such as '12,500,000 EGP' into a float (NaN if unparsable)."""
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return float(str(value).lower().replace(',', '').replace('egp', '').strip())
+    except Exception:
+        return np.nan
+
+def parse_price_column(series):
+    """Vectorized price parser: float array in EGP, NaN where invalid."""
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else None
+    if kind in ('i', 'u', 'f'):
+        return series.to_numpy(dtype=float)
+    return map_column_values(series, parse_price_value)
+
+def lower_text_column(df, column):
+    """Object array of str(cell).lower() for a column ('' where the column is missing)."""
+    series = single_column(df, column)
+    if series is None:
+        return np.full(len(df), '', dtype=object)
+    return map_column_values(series, lambda v: str(v).lower(), dtype=object)
+
+def build_index_arrays(df):
+    """Every per-row array InventoryIndex keeps (scoring features included) for the rows of df."""
+    arrays = build_scoring_features(df)
+    price = single_column(df, 'Final Price')
+    arrays['price'] = parse_price_column(price) if price is not None else np.full(len(df), np.nan)
+    arrays['status_lower'] = lower_text_column(df, 'Status')
+    arrays['dev_lower'] = lower_text_column(df, 'Dev Name')
+    arrays['type_lower'] = lower_text_column(df, 'Type')
+    arrays['is_available'] = arrays['status_lower'] == 'available'
+    # Range-filter columns (BUA cells use the same 'N m²' format as Garden)
+    bua = single_column(df, 'BUA with Terraces')
+    arrays['bua'] = parse_garden_column(bua) if bua is not None else np.full(len(df), np.nan)
+    arrays['floor'] = parse_text_column(df, 'Floor', parse_floor_value)
+    arrays['delivery_year'] = parse_text_column(df, 'Delivery Date', parse_delivery_year_value)
+    return arrays
+
+def cells_differ(old, new):
+    """Boolean array: the two object arrays differ at each position (missing == missing)."""
+    old_na, new_na = pd.isna(old), pd.isna(new)
+    differ = old_na != new_na
+    both = ~(old_na | new_na)
+    differ[both] = old[both] != new[both]
+    return differ
+
+def category_codes(series, categories):
+    """Codes of a categorical Series against another category index (-1 for missing)."""
+    codes = series.cat.codes.to_numpy()
+    mapping = categories.get_indexer(series.cat.categories)
+    return np.where(codes >= 0, mapping[codes], -1)
+
+def columns_differ(old, new):
+    """
+    Boolean array: two equally long Series differ at each row (missing ==
+    missing). Compares natively when the dtypes allow it, else cell by cell.
+    """
+    old = old.reset_index(drop=True)
+    new = new.reset_index(drop=True)
+    if isinstance(old.dtype, pd.CategoricalDtype) and isinstance(new.dtype, pd.CategoricalDtype):
+        categories = old.cat.categories.union(new.cat.categories)
+        return category_codes(old, categories) != category_codes(new, categories)
+    if old.dtype == new.dtype and not isinstance(old.dtype, pd.CategoricalDtype) and old.dtype != object:
+        equal = (old == new).to_numpy(dtype=bool, na_value=False)
+        return ~(equal | (old.isna().to_numpy() & new.isna().to_numpy()))
+    return cells_differ(old.to_numpy(dtype=object), new.to_numpy(dtype=object))
+
+class InventoryIndex:
+    """
+    Typed, pre-normalized view of the master inventory.
+    Built once per uploaded file so reruns never rescan whole columns;
+    apply_update() then keeps it current one changed row at a time.
+    """
+    
+    def __init__(self, df):
+        self.df = df
+        
+        # Normalized per-row arrays; the scoring features are a subset of them
+        self.features = build_index_arrays(df)
+        
+        # Unit number -> row position (first occurrence wins, like iloc[0] on a filter)
+        self.unit_positions = self._build_unit_map()
+        
+        # Summary counts for the metrics row, adjusted in place by apply_update()
+        self.total_units = len(df)
+        self.available_units = int(np.count_nonzero(self.features['is_available']))
+        self.project_counts = self._count_projects()
+        
+        # Free-text index; rebuilt lazily after updates that touch its columns
+        self._text_index = UnitTextIndex(df)
+        # Column -> (sorted values, row positions) for range pre-filters, built on first use
+        self._sorted_columns = {}
+        
+        # Changes with every applied update; keys cached suggestions
+        self._version_token = os.urandom(6).hex()
+        self.updates_applied = 0
+    
+    @property
+    def version(self):
+        return f"{self._version_token}.{self.updates_applied}"
+    
+    @property
+    def text_index(self):
+        if self._text_index is None:
+            self._text_index = UnitTextIndex(self.df)
+        return self._text_index
+    
+    @property
+    def bedrooms(self):
+        return self.features['bedrooms']
+    
+    @property
+    def garden_m2(self):
+        return self.features['garden']
+    
+    @property
+    def price(self):
+        return self.features['price']
+    
+    @property
+    def status_lower(self):
+        return self.features['status_lower']
+    
+    @property
+    def dev_lower(self):
+        return self.features['dev_lower']
+    
+    @property
+    def type_lower(self):
+        return self.features['type_lower']
+    
+    @property
+    def projects(self):
+        return len(self.project_counts)
+    
+    def _build_unit_map(self):
+        """Hash map from stripped unit number to row position."""
+        if 'Unit Number' not in self.df.columns:
+            return {}
+        keys = self.df['Unit Number'].astype(str).str.strip()
+        first = ~keys.duplicated(keep='first').to_numpy()
+        positions = np.flatnonzero(first)
+        return dict(zip(keys.to_numpy()[first], positions.tolist()))
+    
+    def _count_projects(self):
+        """Rows per distinct Dev Name (missing names are not a project)."""
+        dev = single_column(self.df, 'Dev Name')
+        if dev is None:
+            return {}
+        counts = dev.value_counts(dropna=True)
+        return {name: int(count) for name, count in counts.items() if count > 0}
+    
+    def _adjust_counts(self, positions, sign):
+        """Add (sign=1) or remove (sign=-1) the given rows from the summary counts."""
+        self.available_units += sign * int(np.count_nonzero(self.features['is_available'][positions]))
+        dev = single_column(self.df, 'Dev Name')
+        if dev is None:
+            return
+        for name in dev.iloc[positions].dropna():
+            count = self.project_counts.get(name, 0) + sign
+            if count > 0:
+                self.project_counts[name] = count
+            else:
+                self.project_counts.pop(name, None)
+    
+    def __len__(self):
+        return self.total_units
+    
+    def find_unit(self, unit_number):
+        """Return the unit's row as a dict, or None if it is not in the inventory."""
+        pos = self.unit_positions.get(str(unit_number).strip())
+        if pos is None:
+            return None
+        return self.df.iloc[pos].to_dict()
+    
+    def sorted_column(self, column):
+        """(ascending values, their row positions) of a numeric index column, NaNs left out."""
+        if column not in self._sorted_columns:
+            values = self.features[column]
+            positions = np.flatnonzero(~np.isnan(values))
+            positions = positions[np.argsort(values[positions], kind='stable')]
+            self._sorted_columns[column] = (values[positions], positions)
+        return self._sorted_columns[column]
+    
+    def filter_positions(self, constraints):
+        """
+        Ascending row positions satisfying every RangeConstraint, or None if
+        there are none. The most selective range is cut from its sorted column
+        with binary search; the others are checked on those rows only.
+        """
+        if not constraints:
+            return None
+        slices = []
+        for constraint in constraints.values():
+            values, positions = self.sorted_column(constraint.column)
+            start = 0 if constraint.low is None else np.searchsorted(values, constraint.low, side='left')
+            stop = len(values) if constraint.high is None else np.searchsorted(values, constraint.high, side='right')
+            slices.append((stop - start, constraint, positions[start:stop]))
+        slices.sort(key=lambda s: s[0])
+        
+        candidates = np.sort(slices[0][2])
+        for _, constraint, _ in slices[1:]:
+            values = self.features[constraint.column][candidates]
+            keep = ~np.isnan(values)
+            if constraint.low is not None:
+                keep &= values >= constraint.low
+            if constraint.high is not None:
+                keep &= values <= constraint.high
+            candidates = candidates[keep]
+        for constraint in constraints.values():
+            if constraint.values is not None:
+                allowed = np.fromiter(constraint.values, dtype=float)
+                candidates = candidates[np.isin(self.features[constraint.column][candidates], allowed)]
+        return candidates
+    
+    def suggest_units(self, customer_request, max_suggestions=5, constraints=None):
+        """
+        Rank units for a customer request using the pre-parsed feature arrays.
+        Ranges in the request (or `constraints` from parse_request_constraints)
+        filter the inventory before anything is scored; if no unit passes
+        them, every unit is scored instead.
+        """
+        if constraints is None:
+            constraints = parse_request_constraints(customer_request)
+        candidates = self.filter_positions(constraints)
+        if candidates is not None and len(candidates) == 0:
+            # A misread or over-tight constraint must not hide every unit: score them all
+            candidates = None
+        return suggest_units_based_on_request(
+            self.df, customer_request, max_suggestions,
+            features=self.features, text_index=self.text_index,
+            candidates=candidates
+        )
+    
+    # --- Incremental updates ---
+    
+    def apply_update(self, update_df, full_export=False):
+        """
+        Merge a delta file (changed/new units) or, with full_export=True, a new
+        full export (units it no longer lists are removed) into the inventory,
+        matching rows by Unit Number. Only rows whose values changed are
+        rewritten and re-parsed, and the summary counts are adjusted rather
+        than recounted. Columns the inventory does not have are ignored.
+        Returns counts of updated, added, removed and unchanged units.
+        """
+        if single_column(update_df, 'Unit Number') is None or single_column(self.df, 'Unit Number') is None:
+            raise ValueError("Inventory and update must both have a 'Unit Number' column.")
+        
+        columns = [c for c in dict.fromkeys(update_df.columns)
+                   if single_column(update_df, c) is not None and single_column(self.df, c) is not None]
+        keys = update_df['Unit Number'].astype(str).str.strip()
+        # A unit listed twice in the update: the last row wins
+        last = ~keys.duplicated(keep='last').to_numpy()
+        update = update_df.loc[last, columns].reset_index(drop=True)
+        keys = keys[last].reset_index(drop=True)
+        
+        positions = [self.unit_positions.get(key, -1) for key in keys.to_numpy(dtype=object)]
+        positions = np.array(positions, dtype=np.int64)
+        known = positions >= 0
+        known_positions = positions[known]
+        known_rows = update[known].reset_index(drop=True)
+        
+        # Per column: which of the known units have a different value
+        column_changes = {}
+        current = self.df.iloc[known_positions]
+        for column in columns:
+            differ = columns_differ(current[column], known_rows[column])
+            if differ.any():
+                column_changes[column] = differ
+        
+        changed = np.zeros(len(known_positions), dtype=bool)
+        for differ in column_changes.values():
+            changed |= differ
+        self._write_rows(known_positions, known_rows, column_changes, changed)
+        added = self._append_rows(update[~known])
+        
+        removed = 0
+        if full_export:
+            listed_keys = set(keys.to_numpy(dtype=object))
+            row_keys = self.df['Unit Number'].astype(str).str.strip().to_numpy(dtype=object)
+            listed = np.fromiter((key in listed_keys for key in row_keys), dtype=bool, count=len(row_keys))
+            removed = self._remove_rows(listed)
+        
+        updated = int(np.count_nonzero(changed))
+        if updated or added or removed:
+            self.updates_applied += 1
+        return {
+            'updated': updated,
+            'added': added,
+            'removed': removed,
+            'unchanged': len(known_positions) - updated,
+        }
+    
+    def _set_cells(self, positions, column, values):
+        """Write values into one column at the given row positions, widening its dtype if needed."""
+        series = self.df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            new_categories = pd.Index(pd.unique(values[~pd.isna(values)])).difference(series.cat.categories)
+            if len(new_categories):
+                self.df[column] = series.cat.add_categories(new_categories)
+        elif series.dtype.kind in 'iuf':
+            missing = pd.isna(values)
+            present = values[~missing]
+            if all(isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_)) for v in present):
+                # Numbers go in as a float array: an object array would turn the column into objects
+                numeric = np.full(len(values), np.nan)
+                numeric[~missing] = np.asarray(present, dtype='float64')
+                if series.dtype.kind in 'iu' and (missing.any() or (numeric[~missing] % 1 != 0).any()):
+                    # As pandas does for missing values: int columns become float64
+                    self.df[column] = series.astype('float64')
+                    values = numeric
+                elif series.dtype.kind in 'iu':
+                    values = numeric.astype(series.dtype)
+                else:
+                    values = numeric
+        j = self.df.columns.get_loc(column)
+        try:
+            self.df.iloc[positions, j] = values
+        except (TypeError, ValueError):
+            # e.g. text written into a numeric column
+            self.df[column] = self.df[column].astype(object)
+            self.df.iloc[positions, j] = values
+    
+    def _write_rows(self, positions, rows, column_changes, changed):
+        """
+        Overwrite the changed cells of existing rows in place (only columns that
+        changed are touched) and re-derive the arrays and counts of those rows.
+        """
+        if not changed.any():
+            return
+        changed_positions = positions[changed]
+        self._adjust_counts(changed_positions, -1)
+        self._sorted_columns = {}
+        if any(column in UNIT_TEXT_COLUMNS for column in column_changes):
+            self._text_index = None
+        for column, differ in column_changes.items():
+            self._set_cells(positions[differ], column, rows[column].to_numpy(dtype=object)[differ])
+        positions = changed_positions
+        for name, values in build_index_arrays(self.df.iloc[positions]).items():
+            if name == 'size' or values is None:
+                continue
+            target = self.features[name]
+            if not target.flags.writeable:
+                # Read-only view of a frame column (copy-on-write): copy on first update
+                target = self.features[name] = target.copy()
+            target[positions] = values
+        self._adjust_counts(positions, 1)
+    
+    def _append_rows(self, rows):
+        """Append new units and extend every per-row array with theirs."""
+        if rows.empty:
+            return 0
+        new = rows.reindex(columns=self.df.columns)
+        for column in self.df.columns:
+            series = self.df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Share one category set so concat keeps the column categorical
+                values = new[column].to_numpy(dtype=object)
+                new_categories = pd.Index(pd.unique(values[~pd.isna(values)])).difference(series.cat.categories)
+                if len(new_categories):
+                    self.df[column] = series.cat.add_categories(new_categories)
+                new[column] = pd.Categorical(values, dtype=self.df[column].dtype)
+        
+        start = len(self.df)
+        attrs = self.df.attrs
+        self.df = pd.concat([self.df, new], ignore_index=True)
+        self.df.attrs = attrs
+        
+        positions = np.arange(start, len(self.df))
+        fresh = build_index_arrays(self.df.iloc[start:])
+        for name, values in fresh.items():
+            if name != 'size' and values is not None:
+                self.features[name] = np.concatenate([self.features[name], values])
+        self.features['size'] = len(self.df)
+        
+        keys = self.df['Unit Number'].iloc[start:].astype(str).str.strip()
+        for key, pos in zip(keys, positions.tolist()):
+            self.unit_positions.setdefault(key, pos)
+        self.total_units = len(self.df)
+        self._adjust_counts(positions, 1)
+        self._text_index = None
+        self._sorted_columns = {}
+        return len(positions)
+    
+    def _remove_rows(self, keep):
+        """Drop rows where keep is False; positions shift, so the unit map is rebuilt."""
+        removed = np.flatnonzero(~keep)
+        if len(removed) == 0:
+            return 0
+        self._adjust_counts(removed, -1)
+        attrs = self.df.attrs
+        self.df = self.df[keep].reset_index(drop=True)
+        self.df.attrs = attrs
+        for name, values in self.features.items():
+            if name != 'size' and values is not None:
+                self.features[name] = values[keep]
+        self.features['size'] = len(self.df)
+        self.unit_positions = self._build_unit_map()
+        self.total_units = len(self.df)
+        self._text_index = None
+        self._sorted_columns = {}
+        return len(removed)
+
+# --- SUGGESTION CACHE ---
+
+# Suggestion results kept per process (each entry is a handful of small dicts)
+SUGGESTION_CACHE_MAX_ENTRIES = 1024
+
+def suggestion_request_key(customer_request):
+    """
+    Cache key form of a request. Scoring lowercases the request and every
+    pattern tolerates any whitespace, so case and spacing never change the
+    suggestions.
+    """
+    return ' '.join(customer_request.lower().split())
+
+class SuggestionCache:
+    """
+    Process-wide LRU cache of suggestion results keyed by (inventory version,
+    request key, max_suggestions), so reruns triggered by unrelated widgets
+    reuse the last ranking instead of scoring the inventory again.
+    """
+    
+    def __init__(self, max_entries=SUGGESTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, inventory_index, customer_request, max_suggestions=5):
+        """
+        (suggestions, constraints, hit) for a request against an inventory
+        index; computed from the request key on a miss.
+        """
+        request_key = suggestion_request_key(customer_request)
+        key = (inventory_index.version, request_key, max_suggestions)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1], True
+        
+        constraints = parse_request_constraints(request_key)
+        suggestions = inventory_index.suggest_units(request_key, max_suggestions, constraints=constraints)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (suggestions, constraints)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return suggestions, constraints, False
+    
+    def __len__(self):
+        return len(self._entries)
+
+@st.cache_resource
+def get_suggestion_cache():
+    """Single SuggestionCache shared by every session and rerun in this process."""
+    return SuggestionCache()
+
 # --- MAIN APPLICATION ---
 
 def main():
+    setup_page()
+    
+    # Fetch the logo in the background so the first letter doesn't wait on it
+    get_branding_cache(LOGO_URL).start_background_refresh()
+    
     # Initialize session state for inventory
-    if 'inventory_df' not in st.session_state:
-        st.session_state.inventory_df = None
+    if 'inventory_index' not in st.session_state:
+        st.session_state.inventory_index = None
+    if 'inventory_source' not in st.session_state:
+        st.session_state.inventory_source = None
     if 'selected_unit' not in st.session_state:
         st.session_state.selected_unit = ""
     
@@ -934,33 +4121,104 @@ def main():
     
     # === STEP 1: INVENTORY UPLOAD (Persistent) ===
     st.markdown("### 📊 Upload Master Inventory")
-    st.info("📌 Upload your complete inventory file once. It will remain loaded for the entire session.")
+    st.info("📌 Upload your complete inventory file once. It is saved as a snapshot that later sessions open instantly.")
     
+    snapshot_store = get_inventory_snapshot_store()
     inventory_file = st.file_uploader(
         "Master Inventory (CSV/Excel)", 
         type=['csv', 'xlsx', 'xls'], 
         help="Upload complete inventory with all projects",
         key="inventory_upload"
     )
+    replace_snapshot = st.checkbox(
+        "Replace the saved inventory snapshot with this upload",
+        value=True,
+        disabled=not snapshot_store.enabled,
+        help="New sessions open the latest snapshot instead of re-reading the file (requires pyarrow)"
+    )
+    
+    # Load inventory into session state: a new upload, else the latest snapshot
+    inventory_df = None
+    if inventory_file:
+        upload_key = (inventory_file.name, inventory_file.size, getattr(inventory_file, 'file_id', None))
+        if st.session_state.inventory_source != upload_key:
+            with st.spinner("📥 Loading inventory..."):
+                inventory_df = load_inventory_data(inventory_file)
+                if inventory_df is not None:
+                    st.session_state.inventory_index = InventoryIndex(inventory_df)
+                    st.session_state.inventory_source = upload_key
+                    st.success(f"✅ Loaded {len(inventory_df)} units from inventory!")
+                    if replace_snapshot and snapshot_store.enabled:
+                        manifest = snapshot_store.save(inventory_df, file_digest(inventory_file))
+                        if manifest is not None:
+                            st.caption(f"💾 Saved inventory snapshot {manifest['version']}")
+                        else:
+                            st.warning(f"Could not save inventory snapshot: {snapshot_store.last_error}")
+    elif st.session_state.inventory_index is None:
+        inventory_df = snapshot_store.load()
+        if inventory_df is not None:
+            manifest = inventory_df.attrs['snapshot']
+            st.session_state.inventory_index = InventoryIndex(inventory_df)
+            st.session_state.inventory_source = ('snapshot', manifest['version'])
+            st.success(
+                f"✅ Opened inventory snapshot {manifest['version']} "
+                f"({len(inventory_df)} units, saved {manifest['created_at']})"
+            )
+    
+    if inventory_df is not None:
+        load_stats = inventory_df.attrs.get('load_stats', {})
+        if load_stats:
+            st.caption(
+                f"⏱️ Read {len(inventory_df.columns)} columns in {load_stats['seconds']:.2f}s "
+                f"({load_stats['engine']} engine), {load_stats['memory_bytes'] / 1024 / 1024:.1f} MB in memory"
+            )
+    
+    inventory_index = st.session_state.inventory_index
     
-    # Load inventory into session state
-    if inventory_file and st.session_state.inventory_df is None:
-        with st.spinner("📥 Loading inventory..."):
-            st.session_state.inventory_df = load_inventory_data(inventory_file)
-            if st.session_state.inventory_df is not None:
-                st.success(f"✅ Loaded {len(st.session_state.inventory_df)} units from inventory!")
+    # Incremental refresh: apply only the rows that changed since the loaded inventory
+    if inventory_index is not None:
+        with st.expander("🔄 Apply Inventory Update"):
+            st.caption("Upload the changed rows (delta) or a new full export. Units are matched by Unit Number and only changed rows are applied.")
+            update_file = st.file_uploader(
+                "Inventory update (CSV/Excel)",
+                type=['csv', 'xlsx', 'xls'],
+                key="inventory_update_upload"
+            )
+            full_export = st.checkbox(
+                "This is a full export (remove units it no longer lists)",
+                value=False,
+                key="inventory_update_full"
+            )
+            if update_file is not None and st.button("Apply Update", key="apply_inventory_update"):
+                with st.spinner("🔄 Applying inventory update..."):
+                    update_df = load_inventory_data(update_file)
+                    if update_df is not None:
+                        try:
+                            start = time.perf_counter()
+                            changes = inventory_index.apply_update(update_df, full_export=full_export)
+                            st.success(
+                                f"✅ {changes['updated']} updated, {changes['added']} added, "
+                                f"{changes['removed']} removed, {changes['unchanged']} unchanged "
+                                f"({time.perf_counter() - start:.2f}s)"
+                            )
+                            if replace_snapshot and snapshot_store.enabled and (changes['updated'] or changes['added'] or changes['removed']):
+                                manifest = snapshot_store.save(inventory_index.df, file_digest(update_file))
+                                if manifest is not None:
+                                    st.caption(f"💾 Saved inventory snapshot {manifest['version']}")
+                                else:
+                                    st.warning(f"Could not save inventory snapshot: {snapshot_store.last_error}")
+                        except ValueError as e:
+                            st.error(f"Could not apply update: {e}")
     
     # Show inventory status
-    if st.session_state.inventory_df is not None:
+    if inventory_index is not None:
         col_info1, col_info2, col_info3 = st.columns(3)
         with col_info1:
-            st.metric("Total Units", len(st.session_state.inventory_df))
+            st.metric("Total Units", inventory_index.total_units)
         with col_info2:
-            projects = st.session_state.inventory_df['Dev Name'].nunique() if 'Dev Name' in st.session_state.inventory_df.columns else 0
-            st.metric("Projects", projects)
+            st.metric("Projects", inventory_index.projects)
         with col_info3:
-            available = len(st.session_state.inventory_df[st.session_state.inventory_df['Status'].str.lower() == 'available']) if 'Status' in st.session_state.inventory_df.columns else 0
-            st.metric("Available Units", available)
+            st.metric("Available Units", inventory_index.available_units)
     
     st.markdown("---")
     
@@ -995,15 +4253,19 @@ def main():
         )
     
     # === AI-POWERED SUGGESTIONS ===
-    if customer_request and st.session_state.inventory_df is not None:
+    if customer_request and inventory_index is not None:
         st.markdown("---")
         st.markdown("### 🤖 AI-Recommended Units")
         
+        # Cached per (inventory version, request): reruns from other widgets do not re-score
+        suggestion_cache = get_suggestion_cache()
         with st.spinner("🔍 Analyzing requirements and finding best matches..."):
-            suggestions = suggest_units_based_on_request(
-                st.session_state.inventory_df, 
-                customer_request
-            )
+            suggestions, constraints, cache_hit = suggestion_cache.get(inventory_index, customer_request)
+        
+        if constraints:
+            st.caption("🎯 Filters from request: " + " · ".join(c.describe() for c in constraints.values()))
+            if len(inventory_index.filter_positions(constraints)) == 0:
+                st.caption("No unit meets all of these filters, so the closest matches are shown instead.")
         
         if suggestions:
             st.success(f"✨ Found {len(suggestions)} matching units based on requirements!")
@@ -1025,6 +4287,18 @@ def main():
                     st.info(f"**Match Reasons:** {suggestion['reasons']}")
         else:
             st.warning("No specific matches found. You can manually enter unit details below.")
+        
+        with st.expander("🛠️ Debug: suggestion cache"):
+            col_hit, col_miss, col_entries = st.columns(3)
+            with col_hit:
+                st.metric("Cache Hits", suggestion_cache.hits)
+            with col_miss:
+                st.metric("Cache Misses", suggestion_cache.misses)
+            with col_entries:
+                st.metric("Cached Requests", len(suggestion_cache))
+            st.caption(
+                f"This rerun: {'hit' if cache_hit else 'miss'} · inventory version {inventory_index.version}"
+            )
     
     st.markdown("---")
     
@@ -1038,6 +4312,44 @@ def main():
         key="brochure_upload"
     )
     
+    brochure_library = get_brochure_library()
+    
+    if pdf_file:
+        pdf_file.seek(0)
+        pdf_bytes = pdf_file.read()
+        
+        with st.expander("📚 Save this brochure to the library", expanded=False):
+            dev_options = sorted(inventory_index.project_counts) if inventory_index is not None else []
+            library_dev_names = st.multiselect(
+                "Use it for these developments",
+                options=dev_options,
+                default=match_dev_names(get_parsed_brochure(pdf_bytes), dev_options),
+                help="Units of these developments get this brochure automatically, without uploading it"
+            )
+            if st.button("📚 Save to Library"):
+                entry = brochure_library.ingest(pdf_bytes, pdf_file.name, library_dev_names)
+                if entry is not None:
+                    st.success(f"✅ Saved {entry['file_name']} ({entry['pages']} pages) to the library")
+                else:
+                    st.error(f"❌ Could not save the brochure: {brochure_library.last_error}")
+    
+    library_entries = brochure_library.entries()
+    if library_entries:
+        with st.expander(f"📚 Brochure Library ({len(library_entries)})", expanded=False):
+            for entry in library_entries:
+                col_thumb, col_info, col_remove = st.columns([1, 5, 1])
+                with col_thumb:
+                    thumbnail = brochure_library.thumbnail_path(entry['digest'])
+                    if os.path.exists(thumbnail):
+                        st.image(thumbnail, width=80)
+                with col_info:
+                    st.markdown(f"**{entry['file_name']}** · {entry['pages']} pages")
+                    st.caption("Developments: " + (", ".join(entry['dev_names']) or "none"))
+                with col_remove:
+                    if st.button("🗑️", key=f"remove_brochure_{entry['digest']}", help="Remove from the library"):
+                        brochure_library.remove(entry['digest'])
+                        st.rerun()
+    
     st.markdown("---")
     
     # === STEP 4: UNIT SELECTION ===
@@ -1051,15 +4363,29 @@ def main():
         help="Select from suggestions above or enter manually"
     )
     
+    # An uploaded brochure wins; otherwise the library's brochure for the unit's development
+    brochure = None
+    if pdf_file:
+        brochure = pdf_bytes
+    elif inventory_index is not None and unit_input:
+        selected_unit = inventory_index.find_unit(unit_input)
+        library_entry = brochure_library.find(selected_unit.get('Dev Name')) if selected_unit is not None else None
+        if library_entry is not None:
+            brochure = brochure_library.load(library_entry['digest'])
+            if brochure is not None:
+                st.caption(
+                    f"📚 Using {library_entry['file_name']} from the brochure library "
+                    f"for {selected_unit.get('Dev Name')}"
+                )
+    
     # Auto-detect unit type from brochure
     available_unit_types = []
     search_term = ""
+    attach_pages = False
     
-    if pdf_file:
+    if brochure is not None:
         with st.spinner("🔍 Analyzing brochure..."):
-            pdf_file.seek(0)
-            pdf_bytes = pdf_file.read()
-            available_unit_types = extract_unit_types_from_pdf(pdf_bytes)
+            available_unit_types = extract_unit_types_from_pdf(brochure)
             
             if available_unit_types:
                 with st.expander("📋 Detected Unit Types from Brochure", expanded=False):
@@ -1080,16 +4406,21 @@ def main():
                 placeholder="e.g., The Una Villa",
                 help="Enter unit type to find in brochure"
             )
+        
+        attach_pages = st.radio(
+            "Brochure visuals",
+            options=[False, True],
+            format_func=lambda attach: "📎 Attach matched brochure pages" if attach else "🖼️ Image gallery",
+            horizontal=True,
+            help="Attach copies the matched pages into the letter as they are, at full fidelity; "
+                 "the gallery extracts their images"
+        )
     
     # === PREVIEW UNIT DATA ===
-    if st.session_state.inventory_df is not None and unit_input:
-        unit_row = st.session_state.inventory_df[
-            st.session_state.inventory_df['Unit Number'].astype(str).str.strip() == unit_input.strip()
-        ]
+    if inventory_index is not None and unit_input:
+        unit_data = inventory_index.find_unit(unit_input)
         
-        if not unit_row.empty:
-            unit_data = unit_row.iloc[0].to_dict()
-            
+        if unit_data is not None:
             with st.expander("✅ Selected Unit Details", expanded=True):
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
@@ -1108,12 +4439,12 @@ def main():
     # === GENERATE BUTTON ===
     if st.button("🚀 GENERATE PROFESSIONAL OFFER LETTER", type="primary", use_container_width=True):
         # Validation
-        if st.session_state.inventory_df is None:
+        if inventory_index is None:
             st.error("⚠️ Please upload inventory file first.")
             st.stop()
         
-        if not pdf_file:
-            st.error("⚠️ Please upload project brochure (PDF).")
+        if brochure is None:
+            st.error("⚠️ Please upload project brochure (PDF), or save one to the library for this development.")
             st.stop()
         
         if not unit_input:
@@ -1121,29 +4452,12 @@ def main():
             st.stop()
         
         # === PROCESSING ===
-        progress_bar = st.progress(0)
-        status = st.empty()
+        unit_data = inventory_index.find_unit(unit_input)
         
-        # 1. Logo
-        status.text("📥 Loading company branding...")
-        progress_bar.progress(10)
-        logo_bytes = download_logo(LOGO_URL)
-        
-        # 2. Unit Data
-        status.text("📊 Processing unit data...")
-        progress_bar.progress(25)
-        
-        unit_row = st.session_state.inventory_df[
-            st.session_state.inventory_df['Unit Number'].astype(str).str.strip() == unit_input.strip()
-        ]
-        
-        if unit_row.empty:
+        if unit_data is None:
             st.error(f"Unit '{unit_input}' not found in inventory.")
             st.stop()
         
-        unit_data = unit_row.iloc[0].to_dict()
-        
-        # 3. Customer Data
         customer_data = {
             'name': customer_name,
             'mobile': customer_mobile,
@@ -1151,42 +4465,42 @@ def main():
             'request': customer_request
         }
         
-        # 4. Find Pages & Extract Images
-        images = []
-        if search_term:
-            status.text(f"🔍 Locating '{search_term}' in brochure...")
-            progress_bar.progress(40)
-            pdf_file.seek(0)
-            pdf_bytes = pdf_file.read()
-            found_pages = find_pages_in_pdf(pdf_bytes, search_term, limit=4)
-            
-            if found_pages:
-                st.success(f"✅ Found {len(found_pages)} relevant pages")
-                
-                status.text("🖼️ Extracting property visuals...")
-                progress_bar.progress(60)
-                images = extract_images_from_pdf_pages(pdf_bytes, found_pages, max_images=4)
-                if images:
-                    st.info(f"📸 Extracted {len(images)} professional images")
-        
-        # 5. Generate PDF
-        status.text("📝 Generating professional offer letter...")
-        progress_bar.progress(80)
+        progress_bar = st.progress(0)
+        status = st.empty()
         
+        # Stages run on worker threads; only this thread draws their progress
         try:
-            final_pdf = generate_professional_offer_letter(
-                unit_data, images, logo_bytes, customer_data
-            )
+            final_event = None
+            for event in offer_letter_pipeline(
+                unit_data, customer_data, brochure, search_term,
+                get_branding_cache(LOGO_URL), get_brochure_cache(), get_clip_raster_cache(),
+                get_perf_log(), get_logo_image_reader, attach_pages=attach_pages
+            ):
+                progress_bar.progress(event['progress'])
+                status.text(event['message'])
+                
+                if event['stage'] == 'search' and event['done'] == event['total']:
+                    if event.get('error'):
+                        st.error(f"Error searching PDF: {event['error']}")
+                    elif event.get('pages'):
+                        st.success(f"✅ Found {event['pages']} relevant pages")
+                        if event.get('images'):
+                            st.info(f"📸 Extracted {event['images']} professional images")
+                elif event['stage'] == 'done':
+                    final_event = event
+                    if event['attached']:
+                        st.info(f"📎 Attached {event['attached']} brochure pages")
             
-            progress_bar.progress(100)
-            status.text("✅ Complete!")
+            if not final_event['logo']:
+                logo_error = get_branding_cache(LOGO_URL).last_error
+                st.warning(f"Could not load logo: {logo_error or 'no cached or bundled copy available'}")
             
             st.success("🎉 Professional Offer Letter Generated!")
             
             # Download Button
             st.download_button(
                 label="📥 DOWNLOAD OFFER LETTER",
-                data=final_pdf,
+                data=final_event['pdf'],
                 file_name=f"Inertia_Offer_{unit_input}_{datetime.now().strftime('%Y%m%d')}.pdf",
                 mime="application/pdf",
                 use_container_width=True
@@ -1198,6 +4512,124 @@ def main():
             st.error(f"❌ Error generating PDF: {e}")
             import traceback
             st.code(traceback.format_exc())
+    
+    st.markdown("---")
+    
+    # === BATCH MODE ===
+    import batch
+    
+    st.markdown("### 📦 Batch Offer Letters")
+    
+    with st.expander("Generate letters for a whole campaign from a CSV", expanded=False):
+        st.caption("CSV columns: Unit Number, Customer Name, Mobile, Email, Request, Unit Type (optional brochure search term)")
+        
+        jobs_file = st.file_uploader(
+            "Batch Jobs (CSV)",
+            type=['csv'],
+            help="One row per (customer, unit) pair",
+            key="batch_upload"
+        )
+        batch_workers = st.number_input(
+            "Worker processes",
+            min_value=1,
+            max_value=32,
+            value=batch.default_worker_count()
+        )
+        batch_layered = st.checkbox(
+            "Render each unit once and overlay each customer",
+            value=False,
+            help="Much faster when many customers receive the same unit; the customer box always "
+                 "takes the room of a full box"
+        )
+        
+        if st.button("📦 GENERATE BATCH", use_container_width=True):
+            if inventory_index is None:
+                st.error("⚠️ Please upload inventory file first.")
+                st.stop()
+            
+            if not jobs_file:
+                st.error("⚠️ Please upload a batch jobs CSV.")
+                st.stop()
+            
+            try:
+                jobs, failed = batch.resolve_batch_jobs(
+                    batch.read_batch_jobs(jobs_file), inventory_index, search_term
+                )
+            except Exception as e:
+                st.error(f"❌ Could not read batch jobs: {e}")
+                st.stop()
+            
+            progress_bar = st.progress(0)
+            status = st.empty()
+            
+            def on_result(done, total, result):
+                progress_bar.progress(done / total)
+                status.text(f"📝 {done}/{total} letters processed...")
+            
+            logo = download_logo(LOGO_URL)
+            zip_buffer = BytesIO()
+            # Parsed here, through this session's brochure cache
+            report = batch.run_batch(
+                jobs, zip_buffer,
+                brochure=get_parsed_brochure(brochure) if brochure is not None else None,
+                logo_bytes=logo.getvalue() if logo else None,
+                max_workers=int(batch_workers),
+                failed=failed,
+                on_result=on_result,
+                attach_pages=attach_pages,
+                layered=batch_layered
+            )
+            
+            status.text("✅ Batch complete!")
+            st.success(f"🎉 {report.summary()}")
+            
+            if report.errors:
+                st.warning(f"⚠️ {report.failed} jobs failed")
+                st.dataframe(pd.DataFrame([
+                    {'Job': r['job_id'], 'Unit': r['unit_number'], 'Error': r['error'].splitlines()[0]}
+                    for r in report.errors
+                ]), use_container_width=True)
+            
+            st.download_button(
+                label="📥 DOWNLOAD OFFER LETTERS (ZIP)",
+                data=zip_buffer.getvalue(),
+                file_name=f"Inertia_Offers_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                mime="application/zip",
+                use_container_width=True
+            )
+    
+    # === PERFORMANCE PANEL ===
+    perf_log = get_perf_log()
+    
+    with st.expander("⏱️ Performance: stage timings"):
+        if not len(perf_log):
+            st.caption("No stages recorded yet in this process.")
+        else:
+            tab_summary, tab_recent = st.tabs(["By stage", "Recent calls"])
+            with tab_summary:
+                st.dataframe(perf_log.summary(), use_container_width=True)
+            with tab_recent:
+                st.dataframe(
+                    pd.DataFrame(perf_log.records()[-50:][::-1], columns=list(PERF_RECORD_FIELDS)),
+                    use_container_width=True
+                )
+            st.caption(
+                f"{len(perf_log)} calls recorded · CPU is the calling thread's own time"
+                + (f" · also appending to {perf_log.path}" if perf_log.path else "")
+            )
+            col_export, col_clear = st.columns(2)
+            with col_export:
+                st.download_button(
+                    label="📥 Export JSON lines",
+                    data=perf_log.to_jsonl(),
+                    file_name=f"inertia_perf_{datetime.now().strftime('%Y%m%d_%H%M')}.jsonl",
+                    mime="application/x-ndjson",
+                    use_container_width=True
+                )
+            with col_clear:
+                if st.button("🧹 Clear timings", use_container_width=True):
+                    perf_log.clear()
+                    st.rerun()
 
 if __name__ == "__main__":
     main()
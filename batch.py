@@ -0,0 +1,334 @@
+"""
+Batch offer letter generation.
+
+Renders one offer letter per (customer, unit) row of a jobs CSV on a process
+pool and streams the PDFs into a ZIP archive. Used by the Streamlit batch
+section and from the command line:
+
+    python batch.py jobs.csv --inventory inventory.xlsx --brochure brochure.pdf --out offers.zip
+
+Without --inventory the latest saved inventory snapshot is used.
+Set INERTIA_PERF_LOG=perf.jsonl to append per-stage timings from every worker.
+
+Jobs CSV columns: Unit Number (required), Customer Name, Mobile, Email,
+Request, Unit Type (brochure search term, defaults to --unit-type).
+"""
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+def _loaded_app_module():
+    """
+    app.py as already loaded. Under Streamlit it runs as __main__, and a plain
+    `import app` would load a second copy with its own caches and perf log.
+    """
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    for name in ('__main__', 'app'):
+        module = sys.modules.get(name)
+        module_file = getattr(module, '__file__', None)
+        if module_file and os.path.abspath(module_file) == app_path:
+            return module
+    import app
+    return app
+
+app = _loaded_app_module()
+
+# Jobs CSV column -> job field
+BATCH_JOB_COLUMNS = {
+    'Unit Number': 'unit_number',
+    'Customer Name': 'name',
+    'Mobile': 'mobile',
+    'Email': 'email',
+    'Request': 'request',
+    'Unit Type': 'unit_type',
+}
+
+REPORT_FILE_NAME = "batch_report.csv"
+
+# --- JOBS ---
+
+def read_batch_jobs(file):
+    """Read a jobs CSV (path or file object) into a list of job dicts."""
+    df = pd.read_csv(file, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    df.columns = df.columns.str.strip()
+    if 'Unit Number' not in df.columns:
+        raise ValueError("Jobs file must have a 'Unit Number' column.")
+
+    jobs = []
+    for job_id, row in enumerate(df.to_dict('records'), 1):
+        job = {field: str(row.get(column, '')).strip() for column, field in BATCH_JOB_COLUMNS.items()}
+        job['job_id'] = job_id
+        jobs.append(job)
+    return jobs
+
+def resolve_batch_jobs(jobs, inventory_index, default_unit_type=""):
+    """
+    Attach unit data from the inventory to each job (O(1) lookups in the parent),
+    so workers receive everything they need and never touch the inventory.
+    Returns (ready_jobs, failed_results).
+    """
+    ready, failed = [], []
+    for job in jobs:
+        unit_data = inventory_index.find_unit(job['unit_number'])
+        if unit_data is None:
+            failed.append(batch_result(job, error=f"Unit '{job['unit_number']}' not found in inventory."))
+            continue
+        ready.append({
+            'job_id': job['job_id'],
+            'unit_number': job['unit_number'],
+            'unit_data': unit_data,
+            'customer_data': {
+                'name': job.get('name', ''),
+                'mobile': job.get('mobile', ''),
+                'email': job.get('email', ''),
+                'request': job.get('request', ''),
+            },
+            'search_term': job.get('unit_type') or default_unit_type,
+        })
+    return ready, failed
+
+def batch_file_name(job):
+    """ZIP entry name for a job's letter."""
+    customer = job.get('customer_data', {}).get('name') or job.get('name') or "customer"
+    safe = re.sub(r'[^\w\-]+', '_', f"{job['unit_number']}_{customer}").strip('_')
+    return f"{job['job_id']:04d}_Inertia_Offer_{safe}_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+def batch_result(job, file_name=None, pdf_bytes=None, seconds=0.0, error=None):
+    """Uniform per-job result record."""
+    return {
+        'job_id': job['job_id'],
+        'unit_number': job['unit_number'],
+        'file_name': file_name,
+        'pdf_bytes': pdf_bytes,
+        'bytes': len(pdf_bytes) if pdf_bytes else 0,
+        'seconds': seconds,
+        'error': error,
+    }
+
+# --- WORKERS ---
+
+# Set once per worker process by init_batch_worker
+_WORKER_CONTEXT = {}
+
+def init_batch_worker(brochure_state, logo_bytes, attach_pages=False, layered=False):
+    """
+    Pool initializer: keep the parsed brochure and logo for every job in this
+    process. The brochure arrives as ParsedBrochure.to_state() plain data.
+    """
+    brochure = app.ParsedBrochure.from_state(brochure_state) if brochure_state is not None else None
+    _WORKER_CONTEXT['brochure'] = brochure
+    _WORKER_CONTEXT['logo_bytes'] = logo_bytes
+    _WORKER_CONTEXT['attach_pages'] = attach_pages
+    # Base letters rendered by this worker, reused for every customer of the same unit
+    _WORKER_CONTEXT['base_letters'] = app.BaseLetterCache() if layered else None
+
+def render_batch_job(job):
+    """Render one offer letter; errors are returned in the result, never raised."""
+    start = time.perf_counter()
+    try:
+        brochure = _WORKER_CONTEXT.get('brochure')
+        logo_bytes = _WORKER_CONTEXT.get('logo_bytes')
+        attach_pages = _WORKER_CONTEXT.get('attach_pages', False)
+        base_letters = _WORKER_CONTEXT.get('base_letters')
+
+        found_pages, images = [], []
+        if brochure is not None and job['search_term']:
+            found_pages = brochure.search_pages(job['search_term'], limit=4)
+            if not attach_pages:
+                images = app.extract_images_from_pdf_pages(brochure, found_pages, max_images=4,
+                                                            search_term=job['search_term'])
+
+        logo = BytesIO(logo_bytes) if logo_bytes else None
+        if base_letters is not None:
+            pdf_bytes = app.generate_layered_offer_letter(
+                job['unit_data'], images, logo, job['customer_data'], base_letters,
+                brochure=brochure, attached_pages=found_pages if attach_pages else ()
+            )
+        else:
+            pdf_bytes = app.generate_professional_offer_letter(
+                job['unit_data'], images, logo, job['customer_data']
+            )
+            if attach_pages and found_pages:
+                pdf_bytes = app.attach_brochure_pages(pdf_bytes, brochure, found_pages)
+        return batch_result(job, batch_file_name(job), pdf_bytes, time.perf_counter() - start)
+    except Exception as e:
+        detail = traceback.format_exc(limit=3)
+        return batch_result(job, seconds=time.perf_counter() - start, error=f"{e}\n{detail}")
+
+# --- RUNNER ---
+
+class BatchReport:
+    """Per-job outcomes and throughput of a batch run."""
+
+    def __init__(self, total):
+        self.total = total
+        self.results = []
+        self.bytes_out = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+        self.bytes_out += result['bytes']
+
+    @property
+    def succeeded(self):
+        return sum(1 for r in self.results if r['error'] is None)
+
+    @property
+    def failed(self):
+        return len(self.results) - self.succeeded
+
+    @property
+    def errors(self):
+        return [r for r in self.results if r['error'] is not None]
+
+    @property
+    def letters_per_second(self):
+        return self.succeeded / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.succeeded}/{self.total} letters in {self.elapsed:.1f}s "
+            f"({self.letters_per_second:.2f} letters/s, {self.bytes_out / 1024 / 1024:.1f} MB), "
+            f"{self.failed} failed"
+        )
+
+    def to_csv(self):
+        """Per-job report (status, timing, size, error) as CSV text."""
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['job_id', 'unit_number', 'status', 'file_name', 'seconds', 'bytes', 'error'])
+        for r in sorted(self.results, key=lambda r: r['job_id']):
+            writer.writerow([
+                r['job_id'], r['unit_number'], 'ok' if r['error'] is None else 'failed',
+                r['file_name'] or '', f"{r['seconds']:.3f}", r['bytes'],
+                (r['error'] or '').splitlines()[0] if r['error'] else '',
+            ])
+        return out.getvalue()
+
+def default_worker_count():
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
+
+def run_batch(jobs, output, brochure=None, logo_bytes=None, max_workers=None,
+              failed=None, on_result=None, attach_pages=False, layered=False):
+    """
+    Render resolved jobs on a process pool and stream each letter into a ZIP
+    written to `output` (path or binary file object) as soon as it completes.
+    `failed` holds results for jobs rejected before rendering; `on_result`
+    is called as on_result(done, total, result) for progress reporting.
+    With attach_pages the matched brochure pages are appended to each letter
+    verbatim instead of an image gallery. With layered each worker renders a
+    unit's letter once and stamps every customer onto it
+    (app.generate_layered_offer_letter); jobs are submitted grouped by unit.
+    Returns a BatchReport; the ZIP also contains batch_report.csv.
+    """
+    failed = failed or []
+    report = BatchReport(len(jobs) + len(failed))
+    brochure = app.get_parsed_brochure(brochure) if brochure is not None else None
+    # Workers get plain data: a ParsedBrochure may be an instance of a class
+    # from an earlier Streamlit rerun, which pickle cannot find by name
+    brochure_state = brochure.to_state() if brochure is not None else None
+    max_workers = max_workers or default_worker_count()
+
+    def record(result):
+        report.add(result)
+        if result['pdf_bytes']:
+            archive.writestr(result['file_name'], result['pdf_bytes'])
+            # Only the archive keeps the letter
+            result['pdf_bytes'] = None
+        if on_result:
+            on_result(len(report.results), report.total, result)
+
+    # PDFs are already compressed, so store them as-is
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for result in failed:
+            record(result)
+
+        if jobs:
+            # spawn: safe from inside the multi-threaded Streamlit server
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                     initializer=init_batch_worker,
+                                     initargs=(brochure_state, logo_bytes, attach_pages, layered)) as pool:
+                if layered:
+                    jobs = sorted(jobs, key=lambda job: (job['unit_number'], job['search_term']))
+                futures = {pool.submit(render_batch_job, job): job for job in jobs}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        result = batch_result(futures[future], error=f"Worker crashed: {e}")
+                    record(result)
+
+        report.elapsed = time.perf_counter() - report.started
+        archive.writestr(REPORT_FILE_NAME, report.to_csv())
+
+    return report
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('jobs', help="Jobs CSV: one row per (customer, unit) pair")
+    parser.add_argument('--inventory', help="Master inventory (CSV/Excel); default: latest snapshot")
+    parser.add_argument('--brochure', help="Project brochure PDF for gallery images")
+    parser.add_argument('--unit-type', default="", help="Default brochure search term")
+    parser.add_argument('--attach-pages', action='store_true',
+                        help="Append the matched brochure pages verbatim instead of an image gallery")
+    parser.add_argument('--layered', action='store_true',
+                        help="Render each unit's letter once and overlay each customer on it")
+    parser.add_argument('--out', default="offers.zip", help="Output ZIP path")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes")
+    parser.add_argument('--no-logo', action='store_true', help="Skip downloading the logo")
+    args = parser.parse_args(argv)
+
+    if args.inventory:
+        with open(args.inventory, 'rb') as f:
+            inventory_df = app.load_inventory_data(f)
+    else:
+        inventory_df = app.InventorySnapshotStore().load()
+    if inventory_df is None:
+        print(f"Could not load inventory from {args.inventory or 'the latest snapshot'}", file=sys.stderr)
+        return 1
+    inventory_index = app.InventoryIndex(inventory_df)
+
+    brochure = None
+    if args.brochure:
+        with open(args.brochure, 'rb') as f:
+            brochure = app.get_parsed_brochure(f.read())
+
+    logo_bytes = None
+    if not args.no_logo:
+        # This process exits before the background fetch would finish
+        app.get_branding_cache(app.LOGO_URL).fetch_now()
+        logo = app.download_logo(app.LOGO_URL)
+        logo_bytes = logo.getvalue() if logo else None
+
+    jobs, failed = resolve_batch_jobs(read_batch_jobs(args.jobs), inventory_index, args.unit_type)
+
+    def progress(done, total, result):
+        status = "ok" if result['error'] is None else f"FAILED: {result['error'].splitlines()[0]}"
+        print(f"[{done}/{total}] job {result['job_id']} {result['unit_number']}: {status}")
+
+    report = run_batch(jobs, args.out, brochure, logo_bytes, args.workers, failed, progress,
+                       attach_pages=args.attach_pages, layered=args.layered)
+    print(report.summary())
+    print(f"Wrote {args.out}")
+    return 0 if report.failed == 0 else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
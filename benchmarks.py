@@ -0,0 +1,242 @@
+"""
+Performance benchmarks for the offer letter generator.
+
+Run with plain Python, e.g.:
+    python benchmarks.py text-backends path/to/brochure.pdf
+    python benchmarks.py text-backends --pages 300
+    python benchmarks.py gallery path/to/brochure.pdf
+    python benchmarks.py letter-setup
+    python benchmarks.py campaign path/to/brochure.pdf --recipients 50
+    python benchmarks.py normalize path/to/brochure.pdf
+    python benchmarks.py suggest --units 50000
+When no brochure is given a synthetic one is generated with reportlab.
+"""
+import argparse
+import random
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from PIL import Image as PILImage
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+import app
+
+SAMPLE_UNIT_TYPES = [
+    "The Una Villa", "Twin House Lagoon", "Sea View Apartment Type A",
+    "Penthouse Residence Deluxe", "Chalet Élégant Café",
+]
+
+# --- FIXTURES ---
+
+def make_photo(width, height, seed, fmt='JPEG'):
+    """Encode a noisy photo-like test image."""
+    rng = random.Random(seed)
+    img = PILImage.new('RGB', (width, height), tuple(rng.randint(0, 255) for _ in range(3)))
+    for _ in range(40):
+        x, y = rng.randint(0, width - 1), rng.randint(0, height - 1)
+        img.paste(tuple(rng.randint(0, 255) for _ in range(3)), (x, y, x + width // 4, y + height // 4))
+    buffer = BytesIO()
+    img.save(buffer, format=fmt, quality=85)
+    return buffer.getvalue()
+
+def make_synthetic_brochure(pages=120):
+    """Build a brochure-like PDF: text on every page, icons, hero renders and photos."""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    hero = make_photo(1600, 1000, 1)
+    icons = [make_photo(48, 48, 100 + i, 'PNG') for i in range(8)]
+
+    for page in range(pages):
+        unit_type = SAMPLE_UNIT_TYPES[page % len(SAMPLE_UNIT_TYPES)]
+        c.setFont("Helvetica", 12)
+        c.drawString(50, 800, f"Page {page + 1} - Project brochure")
+        c.drawString(50, 780, unit_type)
+        c.drawString(50, 760, "Spacious living with garden and clubhouse access near the lagoon.")
+        for i, icon in enumerate(icons):
+            c.drawImage(ImageReader(BytesIO(icon)), 50 + i * 60, 700, 40, 40)
+        if page % 3 == 0:
+            c.drawImage(ImageReader(BytesIO(hero)), 50, 380, 450, 280)
+        elif page % 3 == 1:
+            c.drawImage(ImageReader(BytesIO(make_photo(1200, 800, page))), 50, 380, 450, 300)
+        c.showPage()
+
+    c.save()
+    return buffer.getvalue()
+
+def make_synthetic_inventory(units, seed=0):
+    """Inventory frame shaped like the master sheet, with free-text columns."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Unit Number': [f"BM-{i:06d}" for i in range(units)],
+        'Dev Name': rng.choice(['Lagoon Park', 'Bay Villas', 'Seashell', 'Jefaira', 'Golf Heights'], units),
+        'Type': rng.choice(['Villa', 'Twin House', 'Townhouse', 'Chalet', 'Apartment'], units),
+        'Type 4': rng.choice(['Lagoon Facing', 'Clubhouse View', 'Corner', 'Standalone', 'فيلا مستقلة'], units),
+        'Floor': rng.choice(['Ground', 'First', 'Roof', None], units),
+        'Delivery Date': rng.choice(['Q3 2027', 'Q1 2028', 'Ready'], units),
+        'No.Bedrooms': rng.integers(1, 6, units),
+        'BUA with Terraces': rng.integers(80, 450, units),
+        'Garden': np.where(rng.random(units) < 0.4, rng.integers(20, 300, units), 0),
+        'Status': rng.choice(['Available', 'Sold', 'Hold', 'Ready'], units),
+        'Final Price': rng.integers(3, 60, units) * 1_000_000,
+    })
+
+def load_brochure(args):
+    """Brochure bytes from --pdf, or a synthetic brochure of --pages pages."""
+    if args.pdf:
+        with open(args.pdf, 'rb') as f:
+            return f.read()
+    return make_synthetic_brochure(args.pages)
+
+def best_of(func, repeat):
+    """Best wall time of `repeat` runs, and the last result."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+# --- BENCHMARKS ---
+
+def bench_text_backends(args):
+    """Pages/sec of each registered text extraction backend."""
+    pdf_bytes = load_brochure(args)
+    print(f"{'backend':<12} {'pages':>6} {'seconds':>9} {'pages/sec':>10}")
+    for name, backend in app.TEXT_BACKENDS.items():
+        elapsed, texts = best_of(lambda: backend(pdf_bytes), args.repeat)
+        print(f"{name:<12} {len(texts):>6} {elapsed:>9.3f} {len(texts) / elapsed:>10.1f}")
+
+def bench_gallery(args):
+    """Offer letter generation time and size: PNG re-encode vs JPEG pass-through vs attached pages."""
+    pdf_bytes = load_brochure(args)
+    pages = list(range(app.get_parsed_brochure(pdf_bytes).page_count))
+    unit_data = {'Unit Number': 'BENCH-001', 'Dev Name': 'Benchmark Bay', 'No.Bedrooms': 3}
+    customer_data = {'name': 'Bench Mark'}
+
+    def gallery(**kwargs):
+        images = app.extract_images_from_pdf_pages(pdf_bytes, pages, max_images=4)
+        return app.generate_professional_offer_letter(unit_data, images, None, customer_data, **kwargs)
+
+    def attach():
+        letter = app.generate_professional_offer_letter(unit_data, [], None, customer_data)
+        return app.attach_brochure_pages(letter, pdf_bytes, pages[:4])
+
+    print(f"{'gallery mode':<22} {'seconds':>9} {'size (KB)':>10}")
+    for label, render in [
+        ("png re-encode", lambda: gallery(passthrough_images=False)),
+        (f"pass-through @{app.GALLERY_IMAGE_DPI}dpi", gallery),
+        ("attach 4 pages", attach),
+    ]:
+        elapsed, pdf = best_of(render, args.repeat)
+        print(f"{label:<22} {elapsed:>9.3f} {len(pdf) / 1024:>10.1f}")
+
+def bench_letter_setup(args):
+    """Per-letter style setup: building every style vs looking up the template registry."""
+    loops = 2000
+
+    def per_call(func):
+        elapsed, _ = best_of(lambda: [func() for _ in range(loops)], args.repeat)
+        return elapsed / loops * 1e6
+
+    rebuild = per_call(lambda: app.build_letter_template(app.DEFAULT_LETTER_TEMPLATE))
+    registry = per_call(lambda: app.get_development_letter_template("Benchmark Bay"))
+    print(f"{'style setup':<22} {'us/letter':>10}")
+    print(f"{'rebuild per letter':<22} {rebuild:>10.1f}")
+    print(f"{'template registry':<22} {registry:>10.2f}")
+
+def bench_campaign(args):
+    """Per-recipient cost of one unit sent to many customers: full render vs base + overlay."""
+    brochure = app.get_parsed_brochure(load_brochure(args))
+    pages = list(range(brochure.page_count))
+    unit_data = {'Unit Number': 'BENCH-001', 'Dev Name': 'Benchmark Bay', 'No.Bedrooms': 3}
+    customers = [
+        {'name': f"Customer {i}", 'mobile': f"+20 100 000 {i:04d}", 'email': f"c{i}@example.com"}
+        for i in range(args.recipients)
+    ]
+
+    def images():
+        return app.extract_images_from_pdf_pages(brochure, pages, max_images=4)
+
+    def full():
+        return [app.generate_professional_offer_letter(unit_data, images(), None, c) for c in customers]
+
+    def layered():
+        cache = app.BaseLetterCache()
+        return [app.generate_layered_offer_letter(unit_data, images(), None, c, cache) for c in customers]
+
+    print(f"{'mode':<22} {'seconds':>9} {'ms/letter':>10}")
+    for label, render in [("full render", full), ("base + overlay", layered)]:
+        elapsed, _ = best_of(render, args.repeat)
+        print(f"{label:<22} {elapsed:>9.3f} {elapsed / len(customers) * 1000:>10.1f}")
+
+SAMPLE_QUERIES = [
+    "The Una Villa", "twin house", "Chalet Élégant Café", "Penthouse Résidence",
+    "فيلا مستقلة", "شاليه بحديقة",
+]
+
+def bench_normalize(args):
+    """normalize_text vs the unicodedata reference on brochure page text and short queries."""
+    pages = app.extract_page_texts(load_brochure(args))
+    text_bytes = sum(len(page.encode('utf-8')) for page in pages)
+    assert [app.normalize_text(p) for p in pages] == [app.normalize_text_unicodedata(p) for p in pages]
+    assert [app.normalize_text(q) for q in SAMPLE_QUERIES] == [app.normalize_text_unicodedata(q) for q in SAMPLE_QUERIES]
+    loops = 1000
+
+    print(f"{len(pages)} pages, {text_bytes / 1024:.0f} KB of text")
+    print(f"{'normalizer':<22} {'pages ms':>9} {'MB/s':>8} {'us/query':>9}")
+    for label, func in [
+        ("unicodedata (ref)", app.normalize_text_unicodedata),
+        ("normalize_text", app.normalize_text),
+    ]:
+        elapsed, _ = best_of(lambda: [func(p) for p in pages], args.repeat)
+        query, _ = best_of(lambda: [func(q) for _ in range(loops) for q in SAMPLE_QUERIES], args.repeat)
+        print(f"{label:<22} {elapsed * 1000:>9.2f} {text_bytes / elapsed / 1e6:>8.1f} "
+              f"{query / (loops * len(SAMPLE_QUERIES)) * 1e6:>9.2f}")
+
+SAMPLE_REQUESTS = [
+    "3 bedroom villa with garden and sea view",
+    "near the clubhouse",
+    "lagoon-facing twin house",
+    "فيلا مستقلة",
+]
+
+def bench_suggest(args):
+    """Inventory index build time and per-request suggestion latency."""
+    df = make_synthetic_inventory(args.units)
+    build, index = best_of(lambda: app.InventoryIndex(df), 1)
+    print(f"{len(index)} units: index built in {build * 1000:.0f} ms "
+          f"({len(index.text_index.doc_terms)} distinct descriptions)")
+    print(f"{'request':<42} {'text ms':>8} {'suggest ms':>11}")
+    for request in SAMPLE_REQUESTS:
+        text, _ = best_of(lambda: index.text_index.score(request), args.repeat)
+        total, _ = best_of(lambda: index.suggest_units(request), args.repeat)
+        print(f"{request:<42} {text * 1000:>8.2f} {total * 1000:>11.2f}")
+
+BENCHMARKS = {
+    'text-backends': bench_text_backends,
+    'gallery': bench_gallery,
+    'letter-setup': bench_letter_setup,
+    'campaign': bench_campaign,
+    'normalize': bench_normalize,
+    'suggest': bench_suggest,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('pdf', nargs='?', help="Brochure PDF (default: synthetic)")
+    parser.add_argument('--pages', type=int, default=120, help="Pages in the synthetic brochure")
+    parser.add_argument('--units', type=int, default=50000, help="Units in the synthetic inventory")
+    parser.add_argument('--recipients', type=int, default=50, help="Customers per unit in the campaign benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
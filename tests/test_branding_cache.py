@@ -0,0 +1,148 @@
+"""
+BrandingAssetCache against a local HTTP stand-in for the logo host.
+
+Run with: python -m pytest tests
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image as PILImage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+ETAG = '"logo-v1"'
+LAST_MODIFIED = "Wed, 01 Oct 2025 10:00:00 GMT"
+
+def make_logo(color):
+    buffer = BytesIO()
+    PILImage.new("RGB", (40, 20), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+class LogoHost:
+    """Serves one logo with an ETag and answers matching If-None-Match with 304."""
+
+    def __init__(self, content):
+        self.content = content
+        self.requests = []
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host.requests.append(dict(self.headers))
+                if self.headers.get("If-None-Match") == ETAG:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(host.content)))
+                self.send_header("ETag", ETAG)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.end_headers()
+                self.wfile.write(host.content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/logo.png"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def logo_host():
+    host = LogoHost(make_logo("navy"))
+    yield host
+    host.close()
+
+def closed_port_url():
+    """URL of a port nothing listens on."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    port = server.server_address[1]
+    server.server_close()
+    return f"http://127.0.0.1:{port}/logo.png"
+
+def test_fresh_cache_fetches_once_and_persists(logo_host, tmp_path):
+    cache = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path), fallback_path=None)
+    try:
+        assert cache.source is None
+        assert cache.fetch_now() == logo_host.content
+        assert cache.source == "disk"
+        assert cache.meta["etag"] == ETAG
+        assert cache.fetch_now() == logo_host.content
+        assert cache.get() == logo_host.content
+    finally:
+        cache.stop()
+    assert len(logo_host.requests) == 1
+
+    # A new process serves the disk copy without touching the network
+    reloaded = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path), fallback_path=None)
+    assert reloaded.source == "disk"
+    assert reloaded.content == logo_host.content
+
+def test_get_serves_fallback_while_fetching_in_background(logo_host, tmp_path):
+    fallback = tmp_path / "logo.png"
+    fallback.write_bytes(make_logo("green"))
+    cache = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path / "cache"), fallback_path=str(fallback))
+    try:
+        assert cache.get() == fallback.read_bytes()
+        deadline = time.time() + 5
+        while cache.source != "disk" and time.time() < deadline:
+            time.sleep(0.05)
+        assert cache.source == "disk"
+        assert cache.get() == logo_host.content
+    finally:
+        cache.stop()
+
+def test_revalidation_304_keeps_copy(logo_host, tmp_path):
+    cache = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path), fallback_path=None)
+    assert cache.refresh() is True
+    checked_at = cache.meta["checked_at"]
+
+    logo_host.content = make_logo("red")  # not served: the ETag still matches
+    assert cache.refresh() is False
+    assert logo_host.requests[-1]["If-None-Match"] == ETAG
+    assert logo_host.requests[-1]["If-Modified-Since"] == LAST_MODIFIED
+    assert cache.content == make_logo("navy")
+    assert cache.meta["checked_at"] >= checked_at
+    assert cache.last_error is None
+
+def test_network_failure_uses_disk_copy(logo_host, tmp_path):
+    cache = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path), fallback_path=None)
+    cache.refresh()
+
+    offline = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path), fallback_path=None)
+    offline.url = closed_port_url()
+    assert offline.refresh() is False
+    assert offline.last_error
+    assert offline.content == logo_host.content
+    assert offline.source == "disk"
+
+def test_network_failure_without_copy(tmp_path):
+    fallback = tmp_path / "logo.png"
+    fallback.write_bytes(make_logo("green"))
+    url = closed_port_url()
+
+    cache = app.BrandingAssetCache(url, cache_dir=str(tmp_path / "cache"), fallback_path=str(fallback))
+    assert cache.fetch_now() == fallback.read_bytes()
+    assert cache.source == "fallback"
+    assert cache.last_error
+
+    empty = app.BrandingAssetCache(url, cache_dir=str(tmp_path / "cache"), fallback_path=None)
+    assert empty.fetch_now() is None
+
+def test_rejects_non_image_download(logo_host, tmp_path):
+    logo_host.content = b"<html>Service unavailable</html>"
+    cache = app.BrandingAssetCache(logo_host.url, cache_dir=str(tmp_path), fallback_path=None)
+    assert cache.refresh() is False
+    assert cache.content is None
+    assert not os.path.exists(cache.data_path)
@@ -0,0 +1,96 @@
+"""
+parse_request_constraints on the request phrasings sales staff actually type.
+
+Run with: python -m pytest tests
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+def described(request):
+    return sorted(c.describe() for c in app.parse_request_constraints(request).values())
+
+@pytest.mark.parametrize("request_text, expected", [
+    ("under 15M", ["Price ≤ 15M"]),
+    ("between 8M and 12.5M", ["Price 8M–12.5M"]),
+    ("budget 12,500,000", ["Price ≤ 12.5M"]),
+    ("12000000", ["Price ≤ 12M"]),
+    # An area word earlier in the clause does not turn millions into metres
+    ("villa with garden under 30M", ["Price ≤ 30M"]),
+    ("twin house with private garden up to 25M", ["Price ≤ 25M"]),
+    ("land under 10M", ["Price ≤ 10M"]),
+    ("villa with roof under 18M", ["Price ≤ 18M"]),
+    ("villa between 8 and 10m with garden", ["Price 8M–10M"]),
+])
+def test_prices(request_text, expected):
+    assert described(request_text) == expected
+
+@pytest.mark.parametrize("request_text", [
+    "3 bedroom villa, down payment 1.5M",
+    "monthly installment 80k",
+    "10% down payment 500k",
+    "installments 7 years 500k per quarter",
+    "call me at 01001234567",
+    "2m ceiling",
+])
+def test_payments_phones_and_lengths_are_not_prices(request_text):
+    assert described(request_text) == []
+
+def test_payment_clause_keeps_the_budget():
+    assert described("villa under 5m with 10% down payment") == ["Price ≤ 5M"]
+    assert described("villa 8m, 80k monthly") == ["Price ≤ 8M"]
+
+@pytest.mark.parametrize("request_text, expected", [
+    ("villa with 200m garden", ["Garden ≥ 200 m²"]),
+    ("garden 200m", ["Garden ≥ 200 m²"]),
+    ("garden 100-200m", ["Garden 100 m²–200 m²"]),
+    ("garden of 150m under 20m", ["Garden ≥ 150 m²", "Price ≤ 20M"]),
+    ("at least 250 m²", ["BUA ≥ 250 m²"]),
+    ("250 sq m under 9m", ["BUA ≥ 250 m²", "Price ≤ 9M"]),
+    ("garden 100-200 sqm", ["Garden 100 m²–200 m²"]),
+])
+def test_areas(request_text, expected):
+    assert described(request_text) == expected
+
+@pytest.mark.parametrize("request_text, expected", [
+    ("ground floor", ["Floor = Ground"]),
+    ("3rd floor", ["Floor = 3"]),
+    ("above the 2nd floor", ["Floor ≥ 3"]),
+    ("1st or 2nd floor", ["Floor 1 / 2"]),
+    ("1st and 2nd floors", ["Floor 1 / 2"]),
+    ("ground, first or roof floor", ["Floor Ground / 1 / Roof"]),
+    ("floor 2 or 3", ["Floor 2 / 3"]),
+    # A storey count is not the unit's floor
+    ("3 floors villa", []),
+])
+def test_floors(request_text, expected):
+    assert described(request_text) == expected
+
+@pytest.mark.parametrize("request_text, expected", [
+    ("delivery 2027", ["Delivery = 2027"]),
+    ("delivery by 2027", ["Delivery ≤ 2027"]),
+    ("Q3 2027 delivery", ["Delivery = 2027"]),
+    ("from 2026", ["Delivery ≥ 2026"]),
+    ("before 2028", ["Delivery ≤ 2027"]),
+])
+def test_delivery(request_text, expected):
+    assert described(request_text) == expected
+
+def test_unmatched_filters_fall_back_to_all_units():
+    df = pd.DataFrame({
+        'Unit Number': ['A-1', 'A-2'],
+        'Dev Name': ['Bay Villas', 'Bay Villas'],
+        'Type': ['Villa', 'Villa'],
+        'No.Bedrooms': [3, 4],
+        'Final Price': [20_000_000, 32_000_000],
+        'Status': ['Available', 'Available'],
+    })
+    index = app.InventoryIndex(df)
+    assert len(index.filter_positions(app.parse_request_constraints("villa under 1000 egp"))) == 0
+    assert index.suggest_units("villa under 1000 egp")
+    assert [s['unit_number'] for s in index.suggest_units("villa under 25M")] == ['A-1']